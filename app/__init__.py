@@ -124,7 +124,7 @@ def create_app(extra_config_settings={}):
     csrf_protect.init_app(app)
 
     # Setup Cache
-    cache = init_cache_manager(app)
+    init_cache_manager(app)
 
     # Setup Session Manager
     init_session_manager(app)
@@ -208,12 +208,13 @@ def init_email_error_handler(app):
 
 
 def init_cache_manager(app):
+    global cache
     cache_opts = {'cache.expire': app.config.get('CACHE_EXPIRE', 3600)}
 
     if 'CACHE_TYPE' not in app.config or not app.config['CACHE_TYPE']:
         app.config['CACHE_TYPE'] = 'file'
 
-    if app.config['CACHE_TYPE'] is 'file':
+    if app.config['CACHE_TYPE'] == 'file':
         if 'CACHE_ROOT' not in app.config or not app.config['CACHE_ROOT']:
             app.config['CACHE_ROOT'] = '/tmp/%s' % __name__
 
@@ -226,8 +227,8 @@ def init_cache_manager(app):
     if 'CACHE_URL' in app.config and app.config['CACHE_URL']:
         cache_opts['cache.url'] = app.config['CACHE_URL']
 
-
     cache = CacheManager(**parse_cache_config_options(cache_opts))
+    return cache
 
 
 def init_session_manager(app):
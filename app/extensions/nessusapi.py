@@ -4,9 +4,18 @@ Created on Tues Apr 14 11:48:43 2020
 @author: Tyler Banks
 """
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import asyncio
 import json
+import threading
 import time
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -18,70 +27,119 @@ class Nessus:
     url_session = '/session'
     url_pull_scan = None
 
+    retry_statuses = (500, 502, 503, 504)
+
 
-    def __init__(self, server, username, password, verify=False):
+    def __init__(self, server, username, password, verify=False, pool_size=10,
+        retries=3, backoff_factor=0.5):
         self.entry = server
         self.username = username
         self.password = password
 
         self.token = None
+        self._token_lock = threading.Lock()
 
         self.verify = verify
+
+        # One pooled keep-alive session shared by every request (and thread),
+        # connection errors and 5xx responses are retried with exponential backoff.
+        # Only idempotent methods are retried by the adapter, a POST that reached
+        # the scanner may have queued an export already, see _post
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+            status_forcelist=Nessus.retry_statuses, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         return
 
-    def _post(self, url, payload={}, connect_timeout = 5.0, read_timeout = 30.0, 
-        session_retrys=2, x_cookie=False):
-        """
-        Generic post wrapper
+    def close(self):
+        self.session.close()
 
-        Parameters:
-        url (str): URL to send post request to
+    def _request(self, method, url, payload, headers, connect_timeout, read_timeout,
+        session_retrys, x_cookie, as_json=False, idempotent=True, reauth=True):
+        """
+        Send a request through the pooled session, reauthenticating on a 401
+        unless reauth is False. Other failures are only sent again when idempotent.
 
         Returns:
-        response (dict): dictionary of post response
+        response (requests.Response)
         """
-
-        headers = {"Content-Type":"application/json"}
-
+        token = None
         if x_cookie:
-            headers["X-Cookie"] = "token="+self.get_session_token()+";"
+            token = self.get_session_token()
+            headers["X-Cookie"] = "token="+token+";"
+
+        kwargs = {'json':payload} if as_json else {'params':payload}
 
         attempts = 0
         status_code = -1
 
-        while attempts < session_retrys and status_code != 200: 
-            response = requests.post(url, json=payload, headers=headers,
-                timeout=(connect_timeout, read_timeout), verify=self.verify)
+        while attempts < session_retrys and status_code != 200:
+            if attempts and status_code != 401 and not idempotent:
+                break
+            response = self.session.request(method, url, headers=headers,
+                timeout=(connect_timeout, read_timeout), verify=self.verify, **kwargs)
             status_code = response.status_code
             attempts = attempts + 1
-            if status_code == 401:
-                payload['token'] = self.get_session_token(reauth=True)
+            if status_code == 401 and reauth:
+                token = self.get_session_token(reauth=True, stale_token=token or payload.get('token'))
+                payload['token'] = token
+                if x_cookie:
+                    headers["X-Cookie"] = "token="+token+";"
         return response
 
-    def _delete(self, url, payload={}, connect_timeout = 5.0, read_timeout = 30.0, session_retrys=2):
+    def _post(self, url, payload=None, connect_timeout = 5.0, read_timeout = 30.0, 
+        session_retrys=2, x_cookie=False, idempotent=False, reauth=True):
         """
         Generic post wrapper
 
         Parameters:
         url (str): URL to send post request to
+        idempotent (bool): retry connection errors and 5xx responses like a GET,
+            only for posts that are safe to send twice
+        reauth (bool): get a new token on a 401, False for the login itself
 
         Returns:
         response (dict): dictionary of post response
         """
-        attempts = 0
-        status_code = -1
 
-        while attempts < session_retrys and status_code != 200: 
-            response = requests.delete(url, params=payload, 
-                timeout=(connect_timeout, read_timeout), verify=self.verify)
-            status_code = response.status_code
-            attempts = attempts + 1
-            if status_code == 401:
-                payload['token'] = self.get_session_token(reauth=True)
-        return response
+        headers = {"Content-Type":"application/json"}
+        payload = payload if payload is not None else {}
+
+        attempt = 0
+        while True:
+            try:
+                response = self._request('POST', url, payload, headers,
+                    connect_timeout, read_timeout, session_retrys, x_cookie, as_json=True,
+                    idempotent=idempotent, reauth=reauth)
+                if not idempotent or response.status_code not in Nessus.retry_statuses or \
+                    attempt >= self.retries:
+                    return response
+            except requests.exceptions.ConnectionError:
+                if not idempotent or attempt >= self.retries:
+                    raise
+            time.sleep(self.backoff_factor * (2 ** attempt))
+            attempt = attempt + 1
+
+    def _delete(self, url, payload=None, connect_timeout = 5.0, read_timeout = 30.0, session_retrys=2):
+        """
+        Generic post wrapper
+
+        Parameters:
+        url (str): URL to send post request to
+
+        Returns:
+        response (dict): dictionary of post response
+        """
+        return self._request('DELETE', url, payload if payload is not None else {}, {},
+            connect_timeout, read_timeout, session_retrys, False)
 
 
-    def _get(self, url, payload={}, connect_timeout = 5.0, read_timeout = 30.0, 
+    def _get(self, url, payload=None, connect_timeout = 5.0, read_timeout = 30.0, 
                 session_retrys=2, x_cookie=False):
         """
         Generic get wrapper
@@ -94,26 +152,28 @@ class Nessus:
         """
         #headers = {"Content-Type":"application/json"}
         headers = {}
-        if x_cookie:
-            headers["X-Cookie"] = "token="+self.get_session_token()+";"
-        attempts = 0
-        status_code = -1
-
-        while attempts < session_retrys and status_code != 200:
-            response = requests.get(url, params=payload, headers=headers,
-                timeout=(connect_timeout, read_timeout), verify=self.verify)
-            status_code = response.status_code
-            attempts = attempts + 1
-            if status_code == 401:
-                payload['token'] = self.get_session_token(reauth=True)
-        
-        return response
+        return self._request('GET', url, payload if payload is not None else {}, headers,
+            connect_timeout, read_timeout, session_retrys, x_cookie)
     
     """
     Self defined methods for this use case
     """
-    def get_session_token(self, reauth=False):
-        if not self.token or reauth:    
+    def get_session_token(self, reauth=False, stale_token=None):
+        """
+        Return the session token, creating one if needed.
+
+        Reauthentication is single-flight: when several threads see a 401 for
+        the same stale_token only the first one calls /session, the others
+        pick up the token it created.
+        """
+        if self.token and not reauth:
+            return self.token
+
+        with self._token_lock:
+            if self.token and not reauth:
+                return self.token
+            if self.token and stale_token and self.token != stale_token:
+                return self.token
             response_text = self.session_create()
             self.token = response_text['token']
 
@@ -160,13 +220,104 @@ class Nessus:
 
         return download_response
 
+    def scans_export_batch(self,exports,status_interval=1,max_interval=30,backoff=1.5,
+        timeout=3600,max_outstanding=50,verbose=False):
+        """
+        Submit many exports up front and poll all of them together.
+        Each export is polled on its own schedule, starting at status_interval
+        and growing by backoff up to max_interval while it is not ready.
 
-    def download_file(self,url,filename,payload={},x_cookie=False):
+        Parameters:
+        exports (iterable): tuples (scan_id, history_id) or (scan_id, history_id, filename)
+        status_interval: Wait n seconds before the first status check
+        max_interval: Upper bound in seconds between status checks of one export
+        backoff: Factor the interval grows by after each "not ready"
+        timeout: Seconds an export may take before it is given up
+        max_outstanding: Exports being prepared by the scanner at once
+
+        Yields:
+        (scan_id, history_id, result, error) as soon as each export finishes.
+        result is the downloaded filename, or the file_id when no filename was
+        given. error is the exception raised for that export, otherwise None.
+        """
+        exports = iter(exports)
+        pending = {}
+        exhausted = False
+
+        while pending or not exhausted:
+            # keep the scanner busy preparing up to max_outstanding exports
+            while not exhausted and len(pending) < max_outstanding:
+                try:
+                    export = next(exports)
+                except StopIteration:
+                    exhausted = True
+                    break
+                scan_id, history_id = export[0], export[1]
+                filename = export[2] if len(export) > 2 else None
+                try:
+                    file_id = self.scans_export_request(scan_id,history_id)['file']
+                except Exception as e:
+                    yield (scan_id, history_id, None, e)
+                    continue
+                now = time.time()
+                pending[(scan_id,file_id)] = [history_id, filename, status_interval,
+                    now + status_interval, now]
+
+            if not pending:
+                continue
+
+            wait = min(p[3] for p in pending.values()) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            now = time.time()
+            for key in list(pending):
+                scan_id, file_id = key
+                history_id, filename, interval, next_check, submitted = pending[key]
+                if next_check > now:
+                    continue
+                try:
+                    ready = self.scans_export_status(scan_id,file_id)
+                except Exception as e:
+                    del pending[key]
+                    yield (scan_id, history_id, None, e)
+                    continue
+
+                if ready:
+                    del pending[key]
+                    if filename is None:
+                        yield (scan_id, history_id, file_id, None)
+                        continue
+                    try:
+                        result = self.scans_export_download(scan_id,file_id,filename)
+                    except Exception as e:
+                        yield (scan_id, history_id, None, e)
+                        continue
+                    yield (scan_id, history_id, result, None)
+                elif now - submitted > timeout:
+                    del pending[key]
+                    yield (scan_id, history_id, None,
+                        Exception("File not ready for download in time, increase timeout value"))
+                else:
+                    interval = min(interval * backoff, max_interval)
+                    pending[key] = [history_id, filename, interval, now + interval, submitted]
+                    if verbose:
+                        print("Waiting for file download (" + str(file_id) + ") to be ready, next check in " +
+                        str(round(interval,1)) + "s")
+
+
+    def download_file(self,url,filename,payload={},x_cookie=False,connect_timeout=5.0,read_timeout=60.0):
+        """
+        Save a GET response body to filename. read_timeout bounds the wait
+        for each chunk, not the whole download, so a stalled transfer fails
+        instead of blocking its worker forever.
+        """
         headers = {}
         if x_cookie:
             headers["X-Cookie"] = "token="+self.get_session_token()+";"
 
-        with requests.get(url, params=payload, headers=headers, verify=self.verify, stream=True) as r:
+        with self.session.get(url, params=payload, headers=headers, verify=self.verify, stream=True,
+            timeout=(connect_timeout, read_timeout)) as r:
             r.raise_for_status()
             with open(filename, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192): 
@@ -175,6 +326,25 @@ class Nessus:
                         # f.flush()
         return filename
 
+    def open_stream(self,url,payload={},x_cookie=False,connect_timeout=5.0,read_timeout=60.0):
+        """
+        Open a streaming GET, the caller reads the body and closes the response.
+        read_timeout bounds the wait for each read from the body.
+
+        Returns:
+        response (requests.Response): use as a context manager, read from response.raw
+        """
+        headers = {}
+        if x_cookie:
+            headers["X-Cookie"] = "token="+self.get_session_token()+";"
+
+        r = self.session.get(url, params=payload, headers=headers, verify=self.verify, stream=True,
+            timeout=(connect_timeout, read_timeout))
+        r.raise_for_status()
+        # undo any gzip transfer encoding while reading from r.raw
+        r.raw.decode_content = True
+        return r
+
     def get_scan_folders(self):
         """
         Get all of the scan folders
@@ -202,6 +372,19 @@ class Nessus:
 
         return ret
 
+    def get_scans(self):
+        """
+        Get every scan of every folder with a single request
+
+        Returns:
+        ret (list): a list of tuples (scan_id, scan_name, folder_id, last_modification_date)
+        """
+        scans_list = self.scans_list()
+        ret = [(f['id'],f['name'],f['folder_id'],f.get('last_modification_date'))
+            for f in scans_list['scans'] or []]
+
+        return ret
+
     def get_scan_history_ids(self, scan_id, completed=True):
         """
         Get all of the history ids for a specified scan
@@ -262,17 +445,12 @@ class Nessus:
     def scans_details(self,scan_id):
         return self.scans_list(scan_id=scan_id)
 
-    def scans_export_request(self,scan_id,history_id=None,format_type='csv'):
-        url = self.entry + Nessus.url_scans
-
-        url = url + '/' + str(scan_id) + '/export'
-
-        if history_id:
-            url = url + '?history_id=' + str(history_id)
-
+    @staticmethod
+    def export_payload(format_type='csv'):
+        """
+        Report options sent with every export request
+        """
         payload = {}
-        self.update_payload_token(payload)
-
         payload['format']=format_type
         
         payload['reportContents.hostSections.scan_information']=True
@@ -302,6 +480,21 @@ class Nessus:
 
         payload['reportContents'] = {'csvColumns':csvColumns}
 
+        return payload
+
+    def scans_export_request(self,scan_id,history_id=None,format_type='csv'):
+        url = self.entry + Nessus.url_scans
+
+        url = url + '/' + str(scan_id) + '/export'
+
+        if history_id:
+            url = url + '?history_id=' + str(history_id)
+
+        payload = {}
+        self.update_payload_token(payload)
+
+        payload.update(Nessus.export_payload(format_type))
+
         response = self._post(url,payload,x_cookie=True)
         response_text = json.loads(response.text)
 
@@ -337,6 +530,19 @@ class Nessus:
         response = self.download_file(url,filename,payload=payload,x_cookie=True)
 
         return response
+
+    def scans_export_stream(self,scan_id,file_id):
+        """
+        Stream a ready export instead of saving it to a file
+
+        Returns:
+        response (requests.Response): streaming response, read the body from response.raw
+        """
+        url = self.entry + Nessus.url_scans
+
+        url = url + '/' + str(scan_id) + '/export/' + str(file_id) + '/download'
+
+        return self.open_stream(url,x_cookie=True)
     """
     SESSION
     """
@@ -349,8 +555,13 @@ class Nessus:
                     "password":self.password
                 }
 
-        response = self._post(url, payload)
-        #TODO Handle 400, 401, 500
+        # A 401 here is a bad login, never try to reauthenticate with a token,
+        # get_session_token holds its lock while it waits for this.
+        # Logging in twice only creates another session, so it is retried
+        response = self._post(url, payload, session_retrys=1, idempotent=True, reauth=False)
+        if response.status_code == 401:
+            raise Exception("Nessus login failed, check the username and password")
+        #TODO Handle 400, 500
         response_text = json.loads(response.text)
 
         return response_text
@@ -377,3 +588,357 @@ class Nessus:
         response_text = json.loads(response.text)
 
         return response_text
+
+
+class AsyncNessus:
+    """
+    asyncio counterpart of Nessus built on aiohttp.
+
+    Every request runs on one event loop through a single pooled
+    ClientSession, so thousands of status polls can be in flight without
+    a thread each. Use it as an async context manager or call close().
+    """
+
+    url_folders = Nessus.url_folders
+    url_scans = Nessus.url_scans
+    url_session = Nessus.url_session
+
+
+    def __init__(self, server, username, password, verify=False, pool_size=100,
+        retries=3, backoff_factor=0.5):
+        if aiohttp is None:
+            raise ImportError("AsyncNessus requires the aiohttp package")
+
+        self.entry = server
+        self.username = username
+        self.password = password
+
+        self.token = None
+        self._token_lock = None
+
+        self.verify = verify
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+        self.session = None
+        return
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self):
+        # Created lazily so the session binds to the loop that uses it
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size,
+                ssl=None if self.verify else False)
+            self.session = aiohttp.ClientSession(connector=connector)
+            self._token_lock = asyncio.Lock()
+        return self.session
+
+    async def _request(self, method, url, payload=None, connect_timeout=5.0, read_timeout=30.0,
+        session_retrys=2, x_cookie=False, as_json=False, idempotent=None, reauth=True):
+        """
+        Send a request, retrying connection errors and 5xx responses with
+        exponential backoff and reauthenticating on a 401 unless reauth is False.
+        Like Nessus, a POST is only retried when the connection could not be
+        made, unless it is marked idempotent.
+
+        Returns:
+        (status, text): status code and body of the response
+        """
+        session = self._get_session()
+        payload = payload if payload is not None else {}
+        headers = {"Content-Type":"application/json"} if as_json else {}
+
+        token = None
+        if x_cookie:
+            token = await self.get_session_token()
+            headers["X-Cookie"] = "token="+token+";"
+
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        if idempotent is None:
+            idempotent = method != 'POST'
+
+        attempts = 0
+        status = -1
+
+        while attempts < session_retrys and status != 200:
+            if attempts and status != 401 and not idempotent:
+                break
+            kwargs = {'json':payload} if as_json else {'params':_query_params(payload)}
+            retry = 0
+            while True:
+                try:
+                    async with session.request(method, url, headers=headers,
+                            timeout=timeout, **kwargs) as response:
+                        status = response.status
+                        text = await response.text()
+                except aiohttp.ClientConnectorError:
+                    # nothing was sent, safe for any method
+                    if retry >= self.retries:
+                        raise
+                    status = -1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if retry >= self.retries or not idempotent:
+                        raise
+                    status = -1
+                if (status == -1 or (idempotent and status in Nessus.retry_statuses)) and retry < self.retries:
+                    await asyncio.sleep(self.backoff_factor * (2 ** retry))
+                    retry = retry + 1
+                    continue
+                break
+
+            attempts = attempts + 1
+            if status == 401 and reauth:
+                token = await self.get_session_token(reauth=True, stale_token=token or payload.get('token'))
+                payload['token'] = token
+                if x_cookie:
+                    headers["X-Cookie"] = "token="+token+";"
+        return status, text
+
+    async def _get_json(self, url, payload=None, x_cookie=False):
+        status, text = await self._request('GET', url, payload, x_cookie=x_cookie)
+        return json.loads(text)
+
+    """
+    Self defined methods for this use case
+    """
+    async def get_session_token(self, reauth=False, stale_token=None):
+        """
+        Return the session token, creating one if needed.
+        Reauthentication is single-flight, see Nessus.get_session_token.
+        """
+        if self.token and not reauth:
+            return self.token
+
+        self._get_session()
+        async with self._token_lock:
+            if self.token and not reauth:
+                return self.token
+            if self.token and stale_token and self.token != stale_token:
+                return self.token
+            response_text = await self.session_create()
+            self.token = response_text['token']
+
+        return self.token
+
+    async def logout(self):
+        return await self.session_delete()
+
+    async def update_payload_token(self, dic):
+        dic['token'] = await self.get_session_token()
+
+    async def scans_export(self,scan_id,history_id,filename,status_interval=1,max_interval=30,
+        backoff=1.5,timeout=3600,verbose=False):
+        """
+        Request an export, wait for it with adaptive backoff and stream it to filename
+
+        Parameters:
+        status_interval: Wait n seconds before the first status check
+        max_interval: Upper bound in seconds between status checks
+        backoff: Factor the interval grows by after each "not ready"
+        timeout: Seconds the export may take before it is given up
+        """
+        request = await self.scans_export_request(scan_id,history_id)
+        file_id = request['file']
+
+        loop = asyncio.get_event_loop()
+        submitted = loop.time()
+        interval = status_interval
+        while True:
+            await asyncio.sleep(interval)
+            if await self.scans_export_status(scan_id,file_id):
+                break
+            if loop.time() - submitted > timeout:
+                raise Exception("File not ready for download in time, increase timeout value")
+            interval = min(interval * backoff, max_interval)
+            if verbose:
+                print("Waiting for file download (" + str(file_id) + ") to be ready, next check in " +
+                str(round(interval,1)) + "s")
+
+        return await self.scans_export_download(scan_id,file_id,filename)
+
+    async def scans_export_batch(self,exports,max_outstanding=50,**kwargs):
+        """
+        Run many exports concurrently on the event loop.
+
+        Parameters:
+        exports (iterable): tuples (scan_id, history_id, filename)
+        max_outstanding: Exports being prepared by the scanner at once
+        kwargs: passed on to scans_export
+
+        Yields:
+        (scan_id, history_id, filename, error) as soon as each export is downloaded
+        """
+        semaphore = asyncio.Semaphore(max_outstanding)
+
+        async def run(scan_id, history_id, filename):
+            async with semaphore:
+                try:
+                    result = await self.scans_export(scan_id,history_id,filename,**kwargs)
+                except Exception as e:
+                    return (scan_id, history_id, None, e)
+                return (scan_id, history_id, result, None)
+
+        tasks = [asyncio.ensure_future(run(*export)) for export in exports]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def download_file(self,url,filename,payload=None,x_cookie=False,chunk_size=65536,
+        connect_timeout=5.0,read_timeout=60.0):
+        """
+        Save a GET response body to filename. There is no limit on the total
+        time, multi-GB exports take a while, read_timeout bounds the wait for
+        each read so a stalled transfer still fails.
+        """
+        headers = {}
+        if x_cookie:
+            headers["X-Cookie"] = "token="+(await self.get_session_token())+";"
+
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        async with session.get(url, params=_query_params(payload or {}), headers=headers,
+                timeout=timeout) as r:
+            r.raise_for_status()
+            with open(filename, 'wb') as f:
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+        return filename
+
+    async def get_scan_folders(self):
+        """
+        Get all of the scan folders
+
+        Returns:
+        ret (list): a list of tuples (folder_id, folder_name)
+        """
+        folders_list = await self.folders_list()
+        return [(f['id'],f['name']) for f in folders_list['folders']]
+
+    async def get_scan_ids(self,folder_id=None):
+        """
+        Get all of the scans for a speficied folder
+
+        Returns:
+        ret (list): a list of tuples (scan_id, scan_name)
+        """
+        scans_list = await self.scans_list()
+        return [(f['id'],f['name']) for f in scans_list['scans'] if not folder_id or f['folder_id']==folder_id]
+
+    async def get_scans(self):
+        """
+        Get every scan of every folder with a single request
+
+        Returns:
+        ret (list): a list of tuples (scan_id, scan_name, folder_id, last_modification_date)
+        """
+        scans_list = await self.scans_list()
+        return [(f['id'],f['name'],f['folder_id'],f.get('last_modification_date'))
+            for f in scans_list['scans'] or []]
+
+    async def get_scan_history_ids(self, scan_id, completed=True):
+        """
+        Get all of the history ids for a specified scan
+
+        Returns:
+        history (list): a list of tuples (history_id(int),timestamp:int)
+        """
+        scans_details = await self.scans_details(scan_id)
+        if scans_details['history']:
+            return [(f['history_id'],f['creation_date'])for f in scans_details['history']
+                if not completed or f['status'] == 'completed']
+        return []
+
+    """
+    FOLDERS
+    """
+
+    async def folders_list(self):
+        payload = {}
+        await self.update_payload_token(payload)
+        return await self._get_json(self.entry + AsyncNessus.url_folders, payload)
+
+    """
+    SCANS
+    """
+
+    async def scans_list(self,folder_id=None,scan_id=None):
+        url = self.entry + AsyncNessus.url_scans
+
+        if scan_id:
+            url = url + '/' + str(scan_id)
+
+        payload = {}
+
+        if folder_id:
+            payload['folder_id'] = folder_id
+
+        await self.update_payload_token(payload)
+        return await self._get_json(url,payload)
+
+    async def scans_details(self,scan_id):
+        return await self.scans_list(scan_id=scan_id)
+
+    async def scans_export_request(self,scan_id,history_id=None,format_type='csv'):
+        url = self.entry + AsyncNessus.url_scans + '/' + str(scan_id) + '/export'
+
+        if history_id:
+            url = url + '?history_id=' + str(history_id)
+
+        payload = {}
+        await self.update_payload_token(payload)
+        payload.update(Nessus.export_payload(format_type))
+
+        status, text = await self._request('POST', url, payload, x_cookie=True, as_json=True)
+        return json.loads(text)
+
+    async def scans_export_status(self,scan_id,file_id):
+        url = self.entry + AsyncNessus.url_scans + '/' + str(scan_id) + '/export/' + str(file_id) + '/status'
+
+        status, text = await self._request('GET', url, x_cookie=True)
+        return status == 200 and json.loads(text)['status'] == 'ready'
+
+    async def scans_export_download(self,scan_id,file_id,filename):
+        url = self.entry + AsyncNessus.url_scans + '/' + str(scan_id) + '/export/' + str(file_id) + '/download'
+        return await self.download_file(url,filename,x_cookie=True)
+
+    """
+    SESSION
+    """
+
+    async def session_create(self):
+        payload = {
+                    "username":self.username,
+                    "password":self.password
+                }
+
+        # A 401 here is a bad login, never try to reauthenticate with a token,
+        # get_session_token holds its lock while it waits for this
+        status, text = await self._request('POST', self.entry + AsyncNessus.url_session, payload,
+            session_retrys=1, as_json=True, idempotent=True, reauth=False)
+        if status == 401:
+            raise Exception("Nessus login failed, check the username and password")
+        return json.loads(text)
+
+    async def session_delete(self):
+        payload = {}
+        await self.update_payload_token(payload)
+        return await self._request('DELETE', self.entry + AsyncNessus.url_session, payload)
+
+
+def _query_params(payload):
+    # aiohttp only accepts str/int/float query values
+    return {k:(str(v).lower() if isinstance(v, bool) else v) for k,v in payload.items()}
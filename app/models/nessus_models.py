@@ -0,0 +1,256 @@
+# Tables of the Nessus database bind (NESSUS_SQLALCHEMY_BINDS).
+#
+# The ingest pipeline (app.utils.nessus.Batch) also runs outside of a Flask
+# app (see offline_batch.py), so these are plain SQLAlchemy Core tables on
+# their own MetaData instead of Flask-SQLAlchemy models.
+#
+# The schema is managed by the Alembic environment in migrations/nessus,
+# call upgrade_schema() to bring a database up to date.
+
+import os
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from app import settings
+
+
+nessus_metadata = sa.MetaData()
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', '..', 'migrations', 'nessus')
+
+
+def upgrade_schema(engine, revision='head', vulnerabilities=settings.OMNIANA_NESSUS_TABLE,
+    history=settings.OMNIANA_HISTORY_TABLE, latest=settings.OMNIANA_LATEST_TABLE,
+    plugins=settings.OMNIANA_PLUGIN_TABLE, trend=settings.OMNIANA_TREND_TABLE,
+    mskb=settings.OMNIANA_MSKB_TABLE, cve=settings.OMNIANA_CVE_TABLE,
+    summary=settings.OMNIANA_SUMMARY_TABLE, lifecycle=settings.OMNIANA_LIFECYCLE_TABLE,
+    scan_state=settings.OMNIANA_SCAN_STATE_TABLE):
+    """Run the Nessus bind migrations against engine, creating or converting its tables"""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_PATH)
+    config.attributes['nessus_tables'] = {
+        'vulnerabilities': vulnerabilities,
+        'history': history,
+        'latest': latest,
+        'plugins': plugins,
+        'trend': trend,
+        'mskb': mskb,
+        'cve': cve,
+        'summary': summary,
+        'lifecycle': lifecycle,
+        'scan_state': scan_state,
+    }
+    with engine.begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, revision)
+
+
+def history_table(name=settings.OMNIANA_HISTORY_TABLE):
+    """The History ledger, one row per scan history loaded into the database"""
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    return sa.Table(name, nessus_metadata,
+        sa.Column('history_id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('scan_id', sa.Integer(), index=True),
+        sa.Column('history_date', sa.Integer()),
+        sa.Column('loaded_at', sa.DateTime(), default=datetime.utcnow),
+    )
+
+
+def _findings_table(name):
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    table = sa.Table(name, nessus_metadata,
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('Plugin ID', sa.Integer()),
+        sa.Column('CVE', sa.Text()),
+        sa.Column('CVSS', sa.Float()),
+        sa.Column('Risk', sa.String(16)),
+        sa.Column('Host', sa.String(255)),
+        sa.Column('Protocol', sa.String(16)),
+        sa.Column('Port', sa.Integer()),
+        sa.Column('Plugin Output', sa.Text()),
+        sa.Column('MSKB', sa.Text()),
+        sa.Column('scan_id', sa.Integer()),
+        sa.Column('scan_name', sa.String(255)),
+        sa.Column('history_id', sa.Integer()),
+        sa.Column('history_date', sa.Integer()),
+        sa.Column('fingerprint', sa.BigInteger()),
+    )
+    sa.Index('ix_%s_scan_history' % name, table.c.scan_id, table.c.history_date)
+    sa.Index('ix_%s_history_id' % name, table.c.history_id)
+    sa.Index('ix_%s_risk' % name, table.c['Risk'])
+    sa.Index('ix_%s_host' % name, table.c['Host'])
+    sa.Index('ix_%s_plugin_id' % name, table.c['Plugin ID'])
+    sa.Index('ix_%s_fingerprint' % name, table.c.fingerprint)
+    return table
+
+
+def plugins_table(name=settings.OMNIANA_PLUGIN_TABLE):
+    """
+    The Plugins dimension, the text and flags of each Nessus plugin stored
+    once, as of the newest history (history_date) that reported the plugin
+    """
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    table = sa.Table(name, nessus_metadata,
+        sa.Column('Plugin ID', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('Name', sa.Text()),
+        sa.Column('Synopsis', sa.Text()),
+        sa.Column('Description', sa.Text()),
+        sa.Column('Solution', sa.Text()),
+        sa.Column('See Also', sa.Text()),
+        sa.Column('Plugin Publication Date', sa.Date()),
+        sa.Column('Metasploit', sa.Boolean(create_constraint=False)),
+        sa.Column('Core Impact', sa.Boolean(create_constraint=False)),
+        sa.Column('CANVAS', sa.Boolean(create_constraint=False)),
+        sa.Column('history_date', sa.Integer()),
+    )
+    sa.Index('ix_%s_publication_date' % name, table.c['Plugin Publication Date'])
+    return table
+
+
+def trend_table(name=settings.OMNIANA_TREND_TABLE):
+    """
+    Finding counts per scan, week and risk, kept up to date as histories load.
+    week is the Monday closing the week (pandas W-MON) of history_date minus
+    seven days, the row holds the counts of the newest history of that week.
+    """
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    table = sa.Table(name, nessus_metadata,
+        sa.Column('scan_id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('week', sa.Date(), primary_key=True),
+        sa.Column('Risk', sa.String(16), primary_key=True),
+        sa.Column('scan_name', sa.String(255)),
+        sa.Column('history_id', sa.Integer()),
+        sa.Column('history_date', sa.Integer()),
+        sa.Column('findings', sa.Integer()),
+        sa.Column('plugin_hosts', sa.Integer()),
+    )
+    sa.Index('ix_%s_week' % name, table.c.week)
+    return table
+
+
+def trend_week(history_date):
+    """The week column of trend_table for a history_date (unix seconds)"""
+    day = (datetime.utcfromtimestamp(history_date) - timedelta(days=7)).date()
+    return day + timedelta(days=(7 - day.weekday()) % 7)
+
+
+def scan_state_table(name=settings.OMNIANA_SCAN_STATE_TABLE):
+    """
+    The Nessus last_modification_date of every scan as of the last run that
+    loaded all of its histories, scans that still have it are not listed again
+    """
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    return sa.Table(name, nessus_metadata,
+        sa.Column('scan_id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('scan_name', sa.String(255)),
+        sa.Column('last_modification_date', sa.Integer()),
+        sa.Column('checked_at', sa.DateTime(), default=datetime.utcnow),
+    )
+
+
+def summary_table(name=settings.OMNIANA_SUMMARY_TABLE):
+    """
+    The dashboard risk cards of a data version (see Plots.get_data_version):
+    distinct Plugin ID and Host pairs of the latest findings per risk, each
+    pair counted at its most severe risk. Every risk level has a row.
+    """
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    return sa.Table(name, nessus_metadata,
+        sa.Column('data_version', sa.String(64), primary_key=True),
+        sa.Column('Risk', sa.String(16), primary_key=True),
+        sa.Column('plugin_hosts', sa.Integer()),
+        sa.Column('created_at', sa.DateTime(), default=datetime.utcnow),
+    )
+
+
+def lifecycle_table(name=settings.OMNIANA_LIFECYCLE_TABLE):
+    """
+    The intervals over which each finding (scan, Host, Plugin ID, Port) was
+    seen. first_seen and last_seen are the history_date of the first and
+    last history of the scan the finding is in, fixed_at that of the first
+    history after last_seen without it, NULL while it is still open. A
+    finding that comes back after being fixed starts a new interval.
+    fingerprint is that of the finding's rows, see Batch.fingerprint.
+    """
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    table = sa.Table(name, nessus_metadata,
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('scan_id', sa.Integer()),
+        sa.Column('Host', sa.String(255)),
+        sa.Column('Plugin ID', sa.Integer()),
+        sa.Column('Port', sa.Integer()),
+        sa.Column('Risk', sa.String(16)),
+        sa.Column('first_seen', sa.Integer()),
+        sa.Column('last_seen', sa.Integer()),
+        sa.Column('fixed_at', sa.Integer()),
+        sa.Column('fingerprint', sa.BigInteger()),
+    )
+    sa.Index('ix_%s_finding' % name, table.c.scan_id, table.c.fingerprint)
+    sa.Index('ix_%s_last_seen' % name, table.c.scan_id, table.c.last_seen)
+    sa.Index('ix_%s_first_seen' % name, table.c.first_seen)
+    sa.Index('ix_%s_fixed_at' % name, table.c.fixed_at)
+    return table
+
+
+def _link_table(name, value):
+    if name in nessus_metadata.tables:
+        return nessus_metadata.tables[name]
+    table = sa.Table(name, nessus_metadata,
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('finding_id', sa.Integer()),
+        sa.Column('history_id', sa.Integer()),
+        sa.Column('Host', sa.String(255)),
+        sa.Column(value, sa.String(32)),
+    )
+    sa.Index('ix_%s_finding_id' % name, table.c.finding_id)
+    sa.Index('ix_%s_history_id' % name, table.c.history_id)
+    sa.Index('ix_%s_%s' % (name, value.lower()), table.c[value], table.c['Host'])
+    return table
+
+
+def mskb_table(name=settings.OMNIANA_MSKB_TABLE):
+    """
+    One row per Microsoft KB of a finding, split from its ; separated MSKB
+    column when the history is loaded. finding_id is the id of the finding
+    in Vulnerabilities and, for the latest histories, LatestVulnerabilities.
+    """
+    return _link_table(name, 'MSKB')
+
+
+def cve_table(name=settings.OMNIANA_CVE_TABLE):
+    """One row per CVE of a finding, like mskb_table"""
+    return _link_table(name, 'CVE')
+
+
+def split_links(value):
+    """The distinct KBs or CVEs of an MSKB or CVE column value, in order"""
+    if not value:
+        return []
+    links = []
+    for link in value.replace(',', ';').split(';'):
+        link = link.strip()
+        if link and link not in links:
+            links.append(link)
+    return links
+
+
+def vulnerabilities_table(name=settings.OMNIANA_NESSUS_TABLE):
+    """Every finding of every loaded scan history, plugin text lives in plugins_table"""
+    return _findings_table(name)
+
+
+def latest_table(name=settings.OMNIANA_LATEST_TABLE):
+    """The findings of the newest loaded history of each scan, same columns as Vulnerabilities"""
+    return _findings_table(name)
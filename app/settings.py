@@ -86,6 +86,26 @@ NESSUS_USERNAME = False
 NESSUS_PASSWORD = False
 NESSUS_FOLDER_EXCLUDE = ["Trash"]
 NESSUS_SCAN_EXCLUDE = ["Sample Scan"]
+NESSUS_EXPORT_WORKERS = 4  # Number of scan exports to download and load at once
+NESSUS_EXPORT_BATCH_SIZE = 50  # Number of exports the Nessus server prepares at once
+NESSUS_ASYNC = False  # Poll and download exports on one asyncio event loop (requires aiohttp)
+NESSUS_STREAM_INGEST = False  # Parse exports from the HTTP response instead of temporary csvs
+NESSUS_CHUNK_SIZE = 50000  # Rows parsed and inserted at a time
+NESSUS_HTTP_POOL_SIZE = 10  # Keep-alive connections to the Nessus server
+NESSUS_HTTP_RETRIES = 3  # Retries with exponential backoff on connection errors and 5xx
 
 OMNIANA_NESSUS_TABLE = 'Vulnerabilities'
 OMNIANA_HISTORY_TABLE = 'History'
+OMNIANA_LATEST_TABLE = 'LatestVulnerabilities'  # Findings of the newest history of every scan
+OMNIANA_PLUGIN_TABLE = 'Plugins'  # Name, description, solution etc. once per Nessus plugin
+OMNIANA_TREND_TABLE = 'VulnerabilityTrend'  # Weekly per scan finding counts behind the trend charts
+OMNIANA_MSKB_TABLE = 'FindingMSKB'  # One row per Microsoft KB of a finding
+OMNIANA_CVE_TABLE = 'FindingCVE'  # One row per CVE of a finding
+OMNIANA_SUMMARY_TABLE = 'DashboardSummary'  # Risk card counts of the current data version
+OMNIANA_SCAN_STATE_TABLE = 'ScanState'  # last_modification_date of every scan at its last complete load, unchanged scans are skipped
+OMNIANA_LIFECYCLE_TABLE = 'FindingLifecycle'  # first_seen/last_seen/fixed_at of every finding of every scan
+OMNIANA_KEEP_HISTORY_FINDINGS = True  # False keeps only the latest history of each scan in Vulnerabilities, older ones live on in FindingLifecycle
+OMNIANA_STREAM_RESPONSES = False  # Stream full finding responses from the database: flat memory, but every request runs the query. Off, each is built once per data version in the result cache. ?format=csv/ndjson always streams
+OMNIANA_STREAM_BATCH_SIZE = 5000  # Rows fetched and encoded at a time when streaming
+OMNIANA_SNAPSHOT_PATH = False  # Directory for an uncompressed Arrow copy of every loaded history (requires pyarrow), the shared latest dataset is then published from them
+OMNIANA_LATEST_DATASET_PATH = False  # Absolute path of a directory the batch publishes an Arrow file of the latest findings to after each load, shared by all web workers for full responses (requires pyarrow)
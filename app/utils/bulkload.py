@@ -0,0 +1,117 @@
+"""
+Bulk loading of DataFrames into the Nessus database.
+
+load_dataframe() picks the fastest insert path for the connection's
+dialect: one executemany per frame on SQLite, COPY FROM STDIN on Postgres
+and pandas to_sql for anything else. Loaders for other dialects can be
+added with register_loader.
+"""
+import io
+import time
+
+import sqlalchemy as sa
+
+
+LOADERS = {}
+
+
+def register_loader(dialect):
+    """Register func(df, connection, table) as the bulk loader for a dialect name"""
+    def wrapper(func):
+        LOADERS[dialect] = func
+        return func
+    return wrapper
+
+
+def load_dataframe(df, connection, table):
+    """
+    Append a DataFrame to a table, creating the table from the frame if needed.
+
+    Parameters:
+    df (DataFrame): rows to insert
+    connection: SQLAlchemy Connection (the caller owns the transaction) or Engine
+    table (str): table name
+
+    Returns:
+    (rows, seconds): number of rows inserted and the time it took
+    """
+    if isinstance(connection, sa.engine.Engine):
+        with connection.begin() as transaction_connection:
+            return load_dataframe(df, transaction_connection, table)
+
+    start = time.time()
+    if len(df):
+        if not connection.dialect.has_table(connection, table):
+            df.head(0).to_sql(table, con=connection, index=False)
+        loader = LOADERS.get(connection.dialect.name, _load_to_sql)
+        loader(df, connection, table)
+    return len(df), time.time() - start
+
+
+def tune_engine(engine):
+    """Apply ingest friendly settings to new connections of a SQLite engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+    if sa.event.contains(engine, 'connect', _sqlite_pragmas):
+        return
+    sa.event.listen(engine, 'connect', _sqlite_pragmas)
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets the dashboard keep reading while a load is committing,
+    # NORMAL sync is safe with WAL and skips an fsync per transaction
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-65536')
+    cursor.close()
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _rows(df):
+    # plain python values with NaN as NULL, which every DBAPI driver accepts
+    return df.astype(object).where(df.notnull(), None).itertuples(index=False, name=None)
+
+
+@register_loader('sqlite')
+def _load_sqlite(df, connection, table):
+    columns = ', '.join(_quote(c) for c in df.columns)
+    params = ', '.join('?' for _ in df.columns)
+    query = 'INSERT INTO ' + _quote(table) + ' (' + columns + ') VALUES (' + params + ')'
+    cursor = connection.connection.cursor()
+    try:
+        cursor.executemany(query, _rows(df))
+    finally:
+        cursor.close()
+
+
+# Marks NULL in the COPY csv. Without it CSV format reads an empty field
+# as NULL, and empty strings would differ from the executemany loaders.
+COPY_NULL = '\\N'
+
+
+def _copy_csv(df):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+    buffer.seek(0)
+    return buffer
+
+
+@register_loader('postgresql')
+def _load_postgres(df, connection, table):
+    buffer = _copy_csv(df)
+    columns = ', '.join(_quote(c) for c in df.columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert('COPY ' + _quote(table) + ' (' + columns + ") FROM STDIN WITH CSV NULL '" +
+            COPY_NULL + "'", buffer)
+    finally:
+        cursor.close()
+
+
+def _load_to_sql(df, connection, table):
+    df.to_sql(table, con=connection, if_exists='append', index=False, chunksize=10000)
@@ -0,0 +1,55 @@
+"""
+Result cache for the Nessus views.
+
+Results are stored in the Beaker CacheManager set up by
+app.init_cache_manager, keyed by the data version of the Nessus database
+(see Plots.get_data_version) and the request's parameters. Loading a new
+history changes the data version, so entries of older data are never
+read again and expire on their own (CACHE_EXPIRE).
+"""
+import threading
+
+from flask import current_app
+
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def make_key(data_version, params=None):
+    """Cache key for a data version and a dict of request parameters"""
+    key = str(data_version)
+    if params:
+        key += '?' + '&'.join('%s=%s' % (k, params[k]) for k in sorted(params))
+    return key
+
+
+def get_or_create(namespace, key, createfunc):
+    """Return the cached value of key in namespace, calling createfunc() on a miss"""
+    from app import cache
+    if cache is None:
+        return createfunc()
+
+    created = []
+
+    def create():
+        created.append(True)
+        return createfunc()
+
+    region = cache.get_cache(namespace, expire=current_app.config.get('CACHE_EXPIRE', 3600))
+    value = region.get(key, createfunc=create)
+    with _stats_lock:
+        if created:
+            _stats['misses'] += 1
+        else:
+            _stats['hits'] += 1
+    return value
+
+
+def cache_stats():
+    """Hit and miss counters of this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = float(stats['hits']) / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,61 @@
+"""
+DataTables server-side processing protocol.
+
+With "serverSide": true DataTables sends draw, start, length, order and
+search with every ajax request and expects one page of rows back
+together with the total and filtered row counts, see
+https://datatables.net/manual/server-side
+"""
+import json
+from collections import namedtuple
+
+
+PageRequest = namedtuple('PageRequest', ['draw', 'start', 'length', 'order', 'search'])
+
+# Upper bound on a page, DataTables sends length=-1 for "show all"
+MAX_LENGTH = 1000
+
+
+def is_server_side(args):
+    """True if the request args come from a server-side DataTable"""
+    return 'draw' in args
+
+
+def parse_request(args, columns):
+    """
+    Read a DataTables request from request.args.
+
+    Parameters:
+    args (MultiDict): flask request.args
+    columns (list): names the table may be ordered by, order on any other column is ignored
+
+    Returns:
+    PageRequest: order is a list of (column name, ascending) tuples
+    """
+    draw = args.get('draw', default=0, type=int)
+    start = max(0, args.get('start', default=0, type=int))
+    length = args.get('length', default=10, type=int)
+    if length < 0 or length > MAX_LENGTH:
+        length = MAX_LENGTH
+
+    order = []
+    i = 0
+    while 'order[%d][column]' % i in args:
+        index = args.get('order[%d][column]' % i, type=int)
+        name = args.get('columns[%d][data]' % index)
+        if name in columns and args.get('columns[%d][orderable]' % index, 'true') == 'true':
+            order.append((name, args.get('order[%d][dir]' % i, 'asc') != 'desc'))
+        i += 1
+
+    search = args.get('search[value]', default='', type=str).strip()
+    return PageRequest(draw, start, length, order, search)
+
+
+def make_response_body(page, records_total, records_filtered, data_json):
+    """
+    The JSON body of a server-side response, data_json is an already
+    serialized JSON array of the page's rows
+    """
+    return '{"draw": %s, "recordsTotal": %d, "recordsFiltered": %d, "data": %s}' % (
+        json.dumps(page.draw), records_total, records_filtered, data_json)
+
@@ -0,0 +1,91 @@
+"""
+Conditional requests and compression for the Nessus data responses.
+
+The data only changes when Batch loads a history, so a response is
+identified by the data version (Plots.get_data_version), the endpoint
+and its parameters. etag_for() turns those into a strong ETag, a client
+that sends it back in If-None-Match gets a 304 without the data being
+read. compress() gzips or brotli compresses a response, streamed ones
+included, for clients that accept it. brotli is optional.
+"""
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Bodies smaller than this are sent as they are
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_TYPES = ['application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain']
+
+
+def negotiate_encoding(accept_encodings):
+    """
+    Pick br or gzip from a request's Accept-Encoding (request.accept_encodings),
+    None to send the body as is
+    """
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def etag_for(data_version, path, params, encoding=None):
+    """
+    Strong ETag of a response. The content encoding is part of it, a
+    gzipped and a plain body are different representations. Pass the
+    Content-Encoding the body is sent with, compress() leaves small
+    bodies plain whatever the client accepts.
+    """
+    key = '%s|%s|%s' % (data_version, path,
+        '&'.join('%s=%s' % (k, params[k]) for k in sorted(params)))
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    if encoding:
+        etag += '-' + encoding
+    return etag
+
+
+def _compressor(encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+    # wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def _compress_iter(chunks, encoding):
+    process, finish = _compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress(response, encoding):
+    """Compress response with encoding (br or gzip) in place, if it is worth it"""
+    if encoding is None or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        response.response = _compress_iter(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        process, finish = _compressor(encoding)
+        response.set_data(process(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    return response
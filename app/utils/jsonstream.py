@@ -0,0 +1,58 @@
+"""
+Incremental JSON and CSV encoding for large responses.
+
+Rows arrive in batches (lists of dicts, see
+Plots.iter_latest_vulnerabilities) and are encoded one batch at a time,
+so a response never holds more than one batch in memory. orjson is used
+when it is installed, the standard library json module otherwise.
+"""
+import csv as csv_module
+import io
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    """Encode obj as JSON bytes, dates and other non JSON types as strings"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def json_array(batches):
+    """Yield the rows of batches as the chunks of one JSON array"""
+    yield b'['
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        chunk = b','.join(dumps(row) for row in batch)
+        if not first:
+            chunk = b',' + chunk
+        first = False
+        yield chunk
+    yield b']'
+
+
+def ndjson(batches):
+    """Yield the rows of batches as newline delimited JSON, one row per line"""
+    for batch in batches:
+        if batch:
+            yield b'\n'.join(dumps(row) for row in batch) + b'\n'
+
+
+def csv(batches, columns):
+    """Yield a header of columns then the rows of batches as CSV, one batch per chunk"""
+    buffer = io.StringIO()
+    writer = csv_module.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
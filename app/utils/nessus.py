@@ -1,64 +1,541 @@
-from flask import current_app
+from flask import current_app, has_app_context
 
 import pandas as pd
-from app import db
+from app import db, settings
 
-from app.extensions.nessusapi import Nessus
+from app.extensions.nessusapi import Nessus, AsyncNessus
+import asyncio
 import json
 import os
 import sys
+import threading
 import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import plotly.graph_objs as go 
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.sql.util import find_tables
+
+from app.models import nessus_models
+from app.utils import bulkload, snapshots
+
+# Columns kept from a Nessus csv export and the dtype each is parsed as.
+# Anything else in the export is skipped by the parser. The integers are
+# nullable, a blank Port must not fail the whole history.
+EXPORT_DTYPES = {
+    'Plugin ID':'Int64',
+    'CVE':'object',
+    'CVSS':'float64',
+    'Risk':'object',
+    'Host':'object',
+    'Protocol':'object',
+    'Port':'Int64',
+    'Name':'object',
+    'Synopsis':'object',
+    'Description':'object',
+    'Solution':'object',
+    'See Also':'object',
+    'Plugin Output':'object',
+    'MSKB':'object',
+    'Plugin Publication Date':'object',
+    'Metasploit':'object',
+    'Core Impact':'object',
+    'CANVAS':'object',
+}
+
+# "exploitable with" columns, stored as booleans
+EXPORT_FLAG_COLUMNS = ['Metasploit','Core Impact','CANVAS']
+
+# yyyy/mm/dd columns, stored as dates
+EXPORT_DATE_COLUMNS = ['Plugin Publication Date']
+
+# Columns that only depend on the plugin, stored once per plugin in the
+# Plugins table instead of on every finding
+PLUGIN_COLUMNS = ['Name','Synopsis','Description','Solution','See Also',
+    'Plugin Publication Date','Metasploit','Core Impact','CANVAS']
+
+# Columns that identify a finding across the histories of a scan, hashed
+# into its fingerprint, see Batch.fingerprint
+FINGERPRINT_COLUMNS = ['Plugin ID','Host','Port']
+
+LATEST_COLUMNS = ['Plugin ID','CVE','CVSS','Risk','Host','Protocol','Port','Name',
+    'Synopsis','Description','Solution','Plugin Output','See Also','Scan','MSKB',
+    'Plugin Publication Date','Metasploit','Core Impact','CANVAS']
+
+# Risk levels from least to most severe, compact frames order Risk by them
+RISK_LEVELS = ['None','Low','Medium','High','Critical']
+
+# dtypes of compact frames, see Plots.compact_frame
+COMPACT_DTYPES = {
+    'Plugin ID':'int32',
+    'CVE':'category',
+    'CVSS':'float32',
+    'Risk':pd.api.types.CategoricalDtype(RISK_LEVELS,ordered=True),
+    'Host':'category',
+    'Protocol':'category',
+    'Port':'int32',
+    'Scan':'category',
+    'MSKB':'category',
+}
+
+def get_config(key):
+    """Read a setting from the running app, or from app.settings outside of one"""
+    if has_app_context():
+        return current_app.config[key]
+    return getattr(settings, key)
+
+def get_latest_dataset_path():
+    """
+    OMNIANA_LATEST_DATASET_PATH, False when the shared dataset is disabled.
+    Batch publishes it and every web worker reads it, so a relative path
+    that resolves against each process's working directory is refused.
+    """
+    path = get_config('OMNIANA_LATEST_DATASET_PATH')
+    if path and not os.path.isabs(path):
+        raise ValueError("OMNIANA_LATEST_DATASET_PATH must be an absolute path, got " + str(path))
+    return path
+
+ExportJob = namedtuple('ExportJob',['scan_id','scan_name','history_id','history_date','save_path'])
 
 class Plots:
     
     @staticmethod
-    def get_latest_vulnerabilities_data(engine=None):
-        """
-        Return a dataframe of the latest vulnerabilities
-        """
-
-        query = """
-        SELECT
-        `Plugin ID`,
-        CVE,
-        CVSS,
-        Risk,
-        Host,
-        Protocol,
-        Port,
-        Name,
-        Synopsis,
-        Description,
-        Solution,
-        `Plugin Output`,
-        `See Also`,
-        scan_name as Scan,
-        MSKB,
-        `Plugin Publication Date`,
-        Metasploit, 
-        `Core Impact`, 
-        CANVAS
-        FROM Vulnerabilities 
-        LEFT JOIN 
-            (SELECT 
-            scan_id,
-            MAX(history_date) as latest 
-            FROM Vulnerabilities 
-            GROUP BY scan_id) as dates 
-        ON dates.scan_id = Vulnerabilities.scan_id 
-        WHERE Vulnerabilities.history_date = dates.latest
+    def get_latest_vulnerabilities_data(engine=None,table=None,columns=None,plugin_table=None,
+        where=None,distinct_plugin_host=False,compact=False,per_mskb=False):
         """
+        Return a dataframe of the latest vulnerabilities,
+        read from the LatestVulnerabilities table that Batch keeps up to date.
+        Plugin text and flags live in the Plugins table, which is only
+        joined when one of PLUGIN_COLUMNS is asked for.
 
-        if engine is None:
-            bind = current_app.config['NESSUS_SQLALCHEMY_BINDS']
-            database = db.get_engine(bind=bind)
+        Only the given columns and the rows matching every where clause
+        (see breakdown_filters) are read from the database. Unfiltered
+        reads come from the shared latest dataset or the history snapshots
+        when they are enabled.
+
+        With compact the frame is converted by compact_frame.
+
+        With per_mskb there is one row per Microsoft KB of a finding, read
+        from the FindingMSKB links, and one row per Host and KB.
+        """
+        if columns is None:
+            columns = LATEST_COLUMNS
+        if compact:
+            return Plots.compact_frame(Plots.get_latest_vulnerabilities_data(engine,table,columns,
+                plugin_table,where,distinct_plugin_host,per_mskb=per_mskb))
+
+        if not where and not distinct_plugin_host and not per_mskb and snapshots.available() and \
+            table is None and plugin_table is None:
+            if get_latest_dataset_path():
+                df = Plots.get_latest_vulnerabilities_shared(columns,engine=engine)
+                if df is not None:
+                    return df
+            if get_config('OMNIANA_SNAPSHOT_PATH'):
+                return Plots.get_latest_vulnerabilities_snapshot(columns,engine=engine)
+
+        query = Plots.latest_query(columns,where=where,distinct_plugin_host=distinct_plugin_host,
+            per_mskb=per_mskb,table=table,plugin_table=plugin_table)
+        df = pd.read_sql_query(query,Plots.get_engine(engine))
+
+        return df
+
+    @staticmethod
+    def compact_frame(df,dtypes=None):
+        """
+        Convert the columns of a findings frame to COMPACT_DTYPES: repeated
+        strings become categories and numbers 32 bit. Risk is ordered by
+        severity, so sorting, dedup and groupby run on its integer codes
+        and sort_values('Risk',ascending=False) puts Critical first.
+        Integer columns with blanks are left as they are.
+        """
+        if dtypes is None:
+            dtypes = COMPACT_DTYPES
+        dtypes = {name:dtype for name, dtype in dtypes.items() if name in df.columns and
+            not (dtype == 'int32' and df[name].isnull().any())}
+        return df.astype(dtypes)
+
+    @staticmethod
+    def get_latest_vulnerabilities_shared(columns=None,engine=None,dataset_path=None):
+        """
+        Return the same frame as get_latest_vulnerabilities_data from the
+        memory mapped Arrow dataset of the current data version, which all
+        workers share. None until Batch has published that version.
+        """
+        if columns is None:
+            columns = LATEST_COLUMNS
+        dataset = Plots.get_latest_dataset(engine,dataset_path)
+        if dataset is None:
+            return None
+        return snapshots.dataset_frame(dataset,columns)
+
+    @staticmethod
+    def get_latest_dataset(engine=None,dataset_path=None):
+        """
+        Return the memory mapped Arrow table of the current data version,
+        None if it has not been published. Only Batch.run_batch publishes,
+        a web request never writes the file.
+        """
+        if dataset_path is None:
+            dataset_path = get_latest_dataset_path()
+        return snapshots.open_dataset(dataset_path,Plots.get_data_version(engine))
+
+    @staticmethod
+    def publish_latest_dataset(engine=None,dataset_path=None,version=None):
+        """
+        Write every latest vulnerabilities column to the shared Arrow
+        dataset of the data version, see app.utils.snapshots.publish_dataset.
+        The frame is compacted first, its categories are stored dictionary
+        encoded and read back as categories by every worker.
+        """
+        if dataset_path is None:
+            dataset_path = get_latest_dataset_path()
+        if version is None:
+            version = Plots.get_data_version(engine)
+        columns = LATEST_COLUMNS + ['Exploitable']
+        if get_config('OMNIANA_SNAPSHOT_PATH'):
+            df = Plots.get_latest_vulnerabilities_snapshot(columns,engine=engine)
         else:
-            database = engine
+            df = pd.read_sql_query(Plots.latest_query(columns),Plots.get_engine(engine))
+        # float32 9.8 would be streamed to the tables as 9.800000190734863
+        df = Plots.compact_frame(df,dict(COMPACT_DTYPES,CVSS='float64'))
+        return snapshots.publish_dataset(dataset_path,version,df)
+
+    @staticmethod
+    def get_latest_vulnerabilities_snapshot(columns=None,engine=None,table=None,plugin_table=None,
+        snapshot_path=None):
+        """
+        Return the same frame as get_latest_vulnerabilities_data, built from
+        the Arrow snapshots of the latest histories (see app.utils.snapshots)
+        with only the needed columns decoded. Histories without a snapshot
+        and the plugin columns are read from the database.
+        """
+        if columns is None:
+            columns = LATEST_COLUMNS
+        if table is None:
+            table = get_config('OMNIANA_LATEST_TABLE')
+        if plugin_table is None:
+            plugin_table = get_config('OMNIANA_PLUGIN_TABLE')
+        if snapshot_path is None:
+            snapshot_path = get_config('OMNIANA_SNAPSHOT_PATH')
+        database = Plots.get_engine(engine)
+        latest = nessus_models.latest_table(table)
+
+        plugin_columns = [name for name in columns if name in PLUGIN_COLUMNS]
+        if 'Exploitable' in columns:
+            plugin_columns += [name for name in EXPORT_FLAG_COLUMNS if name not in plugin_columns]
+        finding_columns = []
+        for name in columns:
+            if name == 'Scan':
+                finding_columns.append('scan_name')
+            elif name in snapshots.COLUMNS:
+                finding_columns.append(name)
+        if plugin_columns and 'Plugin ID' not in finding_columns:
+            finding_columns.append('Plugin ID')
+
+        with database.connect() as connection:
+            histories = connection.execute(sa.select([latest.c.scan_id,latest.c.history_id]).distinct()).fetchall()
+        df, missing = snapshots.read_histories(snapshot_path,histories,finding_columns)
+        if missing:
+            query = sa.select([latest.c[name] for name in finding_columns]) \
+                .where(latest.c.history_id.in_([history_id for _, history_id in missing]))
+            df = pd.concat([df,pd.read_sql_query(query,database)],ignore_index=True,sort=False)
+
+        if plugin_columns:
+            plugins = pd.read_sql_query(Plots.plugins_query(plugin_columns,plugin_table),database)
+            df = df.merge(plugins,on='Plugin ID',how='left')
+        if 'Exploitable' in columns:
+            df['Exploitable'] = (df['Metasploit']==True) | (df['Core Impact']==True) |(df['CANVAS']==True)
+
+        return df.rename(columns={'scan_name':'Scan'})[columns]
+
+    @staticmethod
+    def plugins_query(columns,plugin_table=None):
+        """Select Plugin ID and columns from the Plugins table"""
+        if plugin_table is None:
+            plugin_table = get_config('OMNIANA_PLUGIN_TABLE')
+        plugins = nessus_models.plugins_table(plugin_table)
+        select = [plugins.c['Plugin ID']]
+        for name in columns:
+            if name in EXPORT_DATE_COLUMNS:
+                select.append(sa.cast(plugins.c[name],sa.String(10)).label(name))
+            else:
+                select.append(plugins.c[name])
+        return sa.select(select)
+
+    @staticmethod
+    def iter_latest_vulnerabilities(columns=None,where=None,distinct_plugin_host=False,batch_size=5000,
+        engine=None,table=None,plugin_table=None,per_mskb=False):
+        """
+        Return a generator of the latest vulnerabilities in lists of at most
+        batch_size row dicts, read through a server-side cursor so only one
+        batch is held in memory. Takes the same columns and filters as
+        get_latest_vulnerabilities_data.
+
+        Unfiltered reads are sliced from the shared latest dataset when it
+        is enabled and published, without a copy of it in the worker.
+        """
+        if columns is None:
+            columns = LATEST_COLUMNS
+        if not where and not distinct_plugin_host and not per_mskb and snapshots.available() and \
+            table is None and plugin_table is None and get_latest_dataset_path():
+            dataset = Plots.get_latest_dataset(engine)
+            if dataset is not None:
+                return snapshots.dataset_batches(dataset,columns,batch_size)
+        # resolved now, the generator may run after the request context is gone
+        database = Plots.get_engine(engine)
+        query = Plots.latest_query(columns,where=where,distinct_plugin_host=distinct_plugin_host,
+            per_mskb=per_mskb,table=table,plugin_table=plugin_table)
+
+        def batches():
+            with database.connect() as connection:
+                result = connection.execution_options(stream_results=True).execute(query)
+                while True:
+                    rows = result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield [dict(zip(columns,row)) for row in rows]
+
+        return batches()
+
+    @staticmethod
+    def get_latest_vulnerabilities_page(columns,start=0,length=10,order=None,search=None,
+        search_columns=None,where=None,distinct_plugin_host=False,engine=None,table=None,plugin_table=None,
+        per_mskb=False):
+        """
+        Return one page of the latest vulnerabilities, filtered, sorted and
+        paged in the database for DataTables server-side processing
+
+        Parameters:
+        columns (list): names from LATEST_COLUMNS, or Exploitable
+        order (list): (column name, ascending) tuples
+        search (str): keep rows where any of search_columns contains it
+        where (list): clauses every row must match, see breakdown_filters
+        distinct_plugin_host (bool): one row per Plugin ID and Host
+        per_mskb (bool): one row per Host and Microsoft KB
+
+        Returns:
+        records_total (int): rows matching where, before searching
+        records_filtered (int): rows after searching
+        df (DataFrame): the page
+        """
+        database = Plots.get_engine(engine)
+        base = list(where or [])
+        where = base + Plots.search_filter(search,search_columns,table,plugin_table,per_mskb=per_mskb)
+
+        def count(where):
+            query = Plots.latest_query(['Plugin ID'],where=where,distinct_plugin_host=distinct_plugin_host,
+                per_mskb=per_mskb,table=table,plugin_table=plugin_table)
+            with database.connect() as connection:
+                return connection.execute(sa.select([sa.func.count()]).select_from(query.alias())).scalar()
+
+        records_total = count(base)
+        records_filtered = count(where) if len(where) > len(base) else records_total
+
+        query = Plots.latest_query(columns,where=where,order=order,distinct_plugin_host=distinct_plugin_host,
+            per_mskb=per_mskb,table=table,plugin_table=plugin_table)
+        query = query.offset(start).limit(length)
         df = pd.read_sql_query(query,database)
 
-        return df
+        return records_total, records_filtered, df
+
+    @staticmethod
+    def search_filter(search,search_columns,table=None,plugin_table=None,per_mskb=False):
+        """
+        Return the where clauses keeping rows where any of search_columns
+        contains search, none when there is nothing to search for
+        """
+        if not search or not search_columns:
+            return []
+        expressions = Plots.latest_columns(table,plugin_table,per_mskb=per_mskb)
+        pattern = '%' + search.replace('\\','\\\\').replace('%','\\%').replace('_','\\_') + '%'
+        return [sa.or_(*[sa.cast(expressions[name],sa.Text).ilike(pattern,escape='\\')
+            for name in search_columns])]
+
+    @staticmethod
+    def breakdown_filters(cvss=-1,risk=None,daysold=-1,exploit=0,cve=None,table=None,plugin_table=None,
+        cve_table=None):
+        """
+        Return the where clauses of the plugin breakdown's url filters
+
+        Parameters:
+        cvss (int): minimum CVSS, ignored unless 0 < cvss <= 10
+        risk (str): '-' separated risks to keep
+        daysold (int): plugins published more than this many days ago
+        exploit (int): only exploitable findings unless 0
+        cve (str): ',' separated CVEs, findings of any of them, looked up in FindingCVE
+        """
+        if table is None:
+            table = get_config('OMNIANA_LATEST_TABLE')
+        if cve_table is None:
+            cve_table = get_config('OMNIANA_CVE_TABLE')
+        expressions = Plots.latest_columns(table,plugin_table)
+        where = []
+        if exploit != 0:
+            where.append(expressions['Exploitable'] == sa.true())
+        if cvss != -1 and cvss>0 and cvss<=10:
+            where.append(expressions['CVSS'] >= cvss)
+        if risk:
+            where.append(expressions['Risk'].in_(risk.split('-')))
+        if daysold >= 0:
+            new_date = datetime.now() - timedelta(days=daysold)
+            where.append(expressions['Plugin Publication Date'] < new_date.date())
+        if cve:
+            links = nessus_models.cve_table(cve_table)
+            where.append(nessus_models.latest_table(table).c.id.in_(sa.select([links.c.finding_id])
+                .where(links.c['CVE'].in_([name.strip() for name in cve.split(',')]))))
+        return where
+
+    @staticmethod
+    def latest_columns(table=None,plugin_table=None,per_mskb=False,mskb_table=None):
+        """
+        Return the column expressions of the latest vulnerabilities by name,
+        the names of LATEST_COLUMNS plus the derived Exploitable flag.
+        With per_mskb MSKB is the single KB of the FindingMSKB link.
+        """
+        if table is None:
+            table = get_config('OMNIANA_LATEST_TABLE')
+        if plugin_table is None:
+            plugin_table = get_config('OMNIANA_PLUGIN_TABLE')
+        latest = nessus_models.latest_table(table)
+        plugins = nessus_models.plugins_table(plugin_table)
+
+        expressions = {}
+        for name in LATEST_COLUMNS:
+            if name in PLUGIN_COLUMNS:
+                expressions[name] = plugins.c[name]
+            elif name == 'Scan':
+                expressions[name] = latest.c.scan_name
+            else:
+                expressions[name] = latest.c[name]
+        expressions['Exploitable'] = sa.type_coerce(sa.case([(sa.or_(*[plugins.c[name] == sa.true()
+            for name in EXPORT_FLAG_COLUMNS]), sa.true())], else_=sa.false()), sa.Boolean)
+        if per_mskb:
+            if mskb_table is None:
+                mskb_table = get_config('OMNIANA_MSKB_TABLE')
+            expressions['MSKB'] = nessus_models.mskb_table(mskb_table).c['MSKB']
+        return expressions
+
+    @staticmethod
+    def latest_query(columns,where=None,order=None,distinct_plugin_host=False,per_mskb=False,
+        table=None,plugin_table=None,mskb_table=None):
+        """
+        Build the select of columns from LatestVulnerabilities, joining
+        Plugins only when a plugin column is selected, filtered or sorted on.
+        per_mskb joins the FindingMSKB links instead of splitting MSKB,
+        keeping the first link of every Host and KB.
+        """
+        if table is None:
+            table = get_config('OMNIANA_LATEST_TABLE')
+        if plugin_table is None:
+            plugin_table = get_config('OMNIANA_PLUGIN_TABLE')
+        latest = nessus_models.latest_table(table)
+        plugins = nessus_models.plugins_table(plugin_table)
+        if mskb_table is None:
+            mskb_table = get_config('OMNIANA_MSKB_TABLE')
+        expressions = Plots.latest_columns(table,plugin_table,per_mskb,mskb_table)
+        order = order or []
+
+        select = []
+        for name in columns:
+            expression = expressions[name]
+            if name in EXPORT_DATE_COLUMNS:
+                # keep the yyyy-mm-dd text, not a date object
+                expression = sa.cast(expression,sa.String(10))
+            select.append(expression.label(name))
+        query = sa.select(select)
+
+        source = latest
+        if per_mskb:
+            links = nessus_models.mskb_table(mskb_table)
+            source = source.join(links,links.c.finding_id == latest.c.id)
+        used = list(columns) + [name for name, _ in order]
+        if any(name in PLUGIN_COLUMNS or name == 'Exploitable' for name in used) or \
+            any(plugins in find_tables(clause,check_columns=True) for clause in where or []):
+            source = source.outerjoin(plugins,plugins.c['Plugin ID'] == latest.c['Plugin ID'])
+        query = query.select_from(source)
+
+        if distinct_plugin_host:
+            first = sa.select([sa.func.min(latest.c.id)]).group_by(latest.c['Plugin ID'],latest.c['Host'])
+            query = query.where(latest.c.id.in_(first))
+        if per_mskb:
+            # only links of findings that are still in LatestVulnerabilities
+            others, current = links.alias(), latest.alias()
+            first = sa.select([sa.func.min(others.c.id)]) \
+                .select_from(others.join(current,current.c.id == others.c.finding_id)) \
+                .group_by(others.c['Host'],others.c['MSKB'])
+            query = query.where(links.c.id.in_(first))
+        for clause in where or []:
+            query = query.where(clause)
+
+        for name, ascending in order:
+            query = query.order_by(expressions[name].asc() if ascending else expressions[name].desc())
+        if order or per_mskb:
+            # a stable order for paging
+            query = query.order_by(latest.c.id)
+        if per_mskb:
+            query = query.order_by(links.c.id)
+        return query
+
+    @staticmethod
+    def get_engine(engine=None):
+        """The Nessus bind engine, unless an engine is given"""
+        if engine is None:
+            bind = current_app.config['NESSUS_SQLALCHEMY_BINDS']
+            return db.get_engine(bind=bind)
+        return engine
+
+    @staticmethod
+    def get_data_version(engine=None,table=None):
+        """
+        Return a string that changes whenever Batch loads a history,
+        built from the History ledger. Used to key cached results.
+        """
+        if table is None:
+            table = get_config('OMNIANA_HISTORY_TABLE')
+        database = Plots.get_engine(engine)
+        with database.connect() as connection:
+            return Plots.read_data_version(connection,table)
+
+    @staticmethod
+    def read_data_version(connection,table):
+        """get_data_version on an open connection, inside a transaction it sees its own writes"""
+        ledger = nessus_models.history_table(table)
+        newest, count = connection.execute(sa.select([sa.func.max(ledger.c.history_id),
+            sa.func.count(ledger.c.history_id)])).first()
+        return '%s-%s' % (newest or 0, count)
+
+    @staticmethod
+    def get_dashboard_summary(engine=None,table=None,history_table=None,summary_table=None):
+        """
+        Return the risk card counts of the current data version, a dict of
+        risk to distinct Plugin ID and Host pairs, from the DashboardSummary
+        row Batch writes at the end of each load. A version without one
+        (a database loaded before the table existed) is counted here once.
+        """
+        if table is None:
+            table = get_config('OMNIANA_LATEST_TABLE')
+        if history_table is None:
+            history_table = get_config('OMNIANA_HISTORY_TABLE')
+        if summary_table is None:
+            summary_table = get_config('OMNIANA_SUMMARY_TABLE')
+        database = Plots.get_engine(engine)
+        summary = nessus_models.summary_table(summary_table)
+        with database.connect() as connection:
+            version = Plots.read_data_version(connection,history_table)
+            rows = connection.execute(sa.select([summary.c['Risk'],summary.c.plugin_hosts])
+                .where(summary.c.data_version == version)).fetchall()
+        if rows:
+            return dict(rows)
+
+        try:
+            with database.begin() as connection:
+                return Batch.refresh_summary(connection,table,history_table,summary_table)
+        except sa.exc.IntegrityError:
+            # another worker wrote it first
+            return Plots.get_dashboard_summary(engine,table,history_table,summary_table)
 
     @staticmethod
     def get_figure_overall_vuln_trend(engine=None):
@@ -66,18 +543,8 @@ class Plots:
         Return the parameters for plotly plot
         for the overall vulnerability trend
         """
-        
-        query = """
-        SELECT 
-        history_date,
-        scan_name,
-        Risk,
-        COUNT(*) AS count
-        FROM vulnerabilities 
-        GROUP BY history_date,Risk 
-        ORDER BY history_date,Risk
-        """
-        
+        query = Plots.trend_query('findings')
+
         title = "Server CVE Count Trend"
 
         return Plots.vuln_trend(query,title,engine=engine)
@@ -88,33 +555,27 @@ class Plots:
         Return the parameters for plotly plot
         for the overall vulnerability trend
         """
-        
-        query = """
-        SELECT 
-        history_date,
-        scan_name,
-        Risk,
-        COUNT(*) AS count
-        FROM (
-            SELECT DISTINCT 
-            \"Plugin ID\",
-            Host,
-            Risk,
-            scan_name,
-            history_date 
-            FROM Vulnerabilities
-            ) as i 
-        GROUP BY history_date,Risk 
-        ORDER BY history_date,Risk
-        """
+        query = Plots.trend_query('plugin_hosts')
 
         title = "Server Plugin Count Trend"
 
         return Plots.vuln_trend(query,title,engine=engine)
 
+    @staticmethod
+    def trend_query(column,table=None):
+        """week, Risk and the sum of a VulnerabilityTrend count column over the scans as count"""
+        if table is None:
+            table = get_config('OMNIANA_TREND_TABLE')
+        trend = nessus_models.trend_table(table)
+        return sa.select([trend.c.week,trend.c['Risk'],sa.func.sum(trend.c[column]).label('count')]) \
+            .group_by(trend.c.week,trend.c['Risk']).order_by(trend.c.week,trend.c['Risk'])
+
     @staticmethod
     def vuln_trend(query,title,engine=None):
         """
+        query reads week, Risk and count from the VulnerabilityTrend rollup,
+        one row per week and risk summed over the scans
+
         Returns:
         figure: plotly object
         """
@@ -124,8 +585,7 @@ class Plots:
         else:
             database = engine
         df = pd.read_sql_query(query,database)
-        df['Date'] = pd.to_datetime(df['history_date'],unit='s') - pd.to_timedelta(7, unit='d')
-        df_weekly = df.groupby(['Risk', pd.Grouper(key='Date', freq='W-MON')])['count'].sum().reset_index().sort_values('Date')
+        df['Date'] = pd.to_datetime(df['week'])
 
         #risks = df['Risk'].unique().tolist()
         risks = ["Critical", "High", "Medium", "Low", "None"]
@@ -146,8 +606,7 @@ class Plots:
 
         for risk in risks:
             if risk not in ignored_risks:
-                df_temp = pd.DataFrame(df[df['Risk']==risk]
-                    .groupby(['scan_name', pd.Grouper(key='Date', freq='W-MON')])['count'].last().reset_index()).groupby('Date').sum().reset_index()
+                df_temp = df[df['Risk']==risk].sort_values('Date').reset_index(drop=True)
                 df_temp['Date'] = df_temp['Date'] + pd.to_timedelta(6,unit='d')#End of week
                 name = risk
                 if risk == "None" or not name:
@@ -179,17 +638,46 @@ class Batch:
     def run_batch(csv_path='./data/', database=None,remove_csv=False, engine=None,
         nessus_server=None, nessus_username=None, nessus_password=None,
         nessus_folder_exclude=None, nessus_scan_exclude=None, nessus_table=None,
-        nessus_history_table=None):
+        nessus_history_table=None, nessus_export_workers=None, nessus_pool_size=None,
+        nessus_retries=None, nessus_export_batch_size=None, nessus_async=None,
+        nessus_stream=None, nessus_chunk_size=None):
         """
         ETL Pipeline -
         Extract - data from Nessus API
         Transform - add additional date columns
         Load - into sqlite database
 
+        All missing scan histories are submitted to the scanner up front and
+        polled together, see Nessus.scans_export_batch. Every export that turns
+        ready is downloaded and loaded on a pool of nessus_export_workers
+        threads. A failing export is reported and skipped without stopping the
+        rest of the run.
+
+        The scans are listed with a single request. A scan whose Nessus
+        last_modification_date still matches the one stored in ScanState at
+        its last complete load is skipped without fetching its histories.
+
+        With nessus_async the exports are polled and downloaded by AsyncNessus
+        on a single event loop, the worker pool then only transforms and loads.
+
+        With nessus_stream the export body is parsed chunk by chunk straight
+        from the HTTP response and no csv is written. Memory use is then bound
+        by nessus_chunk_size rows instead of the export size.
+
         Parameters:
         config_file (str): location of webapp config
         csv_path (str): location to save temporary csvs
         remove_csv (bool): delete temporary csv files once they're loaded into db
+        nessus_export_workers (int): number of exports to download and load at once
+        nessus_export_batch_size (int): number of exports the scanner prepares at once
+        nessus_async (bool): export with the asyncio client instead of polling threads
+        nessus_stream (bool): load exports from the HTTP response without temporary csvs
+        nessus_chunk_size (int): rows parsed and inserted at a time
+        nessus_pool_size (int): size of the keep-alive connection pool to the scanner
+        nessus_retries (int): retries for failed connections and 5xx responses
+
+        Returns:
+        failed (list): jobs that could not be exported or loaded
         """
         if not nessus_server:
             server = current_app.config['NESSUS_SERVER']
@@ -226,35 +714,99 @@ class Batch:
         else:
             history_table = nessus_history_table
 
+        latest_table = get_config('OMNIANA_LATEST_TABLE')
+        plugin_table = get_config('OMNIANA_PLUGIN_TABLE')
+        trend_table = get_config('OMNIANA_TREND_TABLE')
+        mskb_table = get_config('OMNIANA_MSKB_TABLE')
+        cve_table = get_config('OMNIANA_CVE_TABLE')
+        summary_table = get_config('OMNIANA_SUMMARY_TABLE')
+        lifecycle_table = get_config('OMNIANA_LIFECYCLE_TABLE')
+        scan_state_table = get_config('OMNIANA_SCAN_STATE_TABLE')
+        keep_history = get_config('OMNIANA_KEEP_HISTORY_FINDINGS')
+        snapshot_path = get_config('OMNIANA_SNAPSHOT_PATH')
+
+        if not nessus_export_workers:
+            export_workers = current_app.config['NESSUS_EXPORT_WORKERS']
+        else:
+            export_workers = nessus_export_workers
+        export_workers = max(1, int(export_workers))
+
+        if not nessus_export_batch_size:
+            export_batch_size = current_app.config['NESSUS_EXPORT_BATCH_SIZE']
+        else:
+            export_batch_size = nessus_export_batch_size
+
+        if nessus_async is None:
+            use_async = current_app.config['NESSUS_ASYNC']
+        else:
+            use_async = nessus_async
+
+        if nessus_stream is None:
+            stream = current_app.config['NESSUS_STREAM_INGEST']
+        else:
+            stream = nessus_stream
+        if use_async and stream:
+            # AsyncNessus always writes the export to a file
+            print("Streaming ingest is not available with the async client, using csv files")
+            stream = False
+
+        if not nessus_chunk_size:
+            chunk_size = current_app.config['NESSUS_CHUNK_SIZE']
+        else:
+            chunk_size = nessus_chunk_size
+        chunk_size = int(chunk_size)
+
+        if not nessus_pool_size:
+            pool_size = current_app.config['NESSUS_HTTP_POOL_SIZE']
+        else:
+            pool_size = nessus_pool_size
+        # Every worker needs its own connection or the pool blocks
+        pool_size = max(int(pool_size), export_workers)
+
+        if nessus_retries is None:
+            retries = current_app.config['NESSUS_HTTP_RETRIES']
+        else:
+            retries = nessus_retries
+
         if not engine:
             if not database:
                 database = current_app.config['NESSUS_SQLALCHEMY_BINDS']
             #engine = create_engine('sqlite:///'+database, echo=False)
             engine = db.get_engine(bind=database)
 
-        history_df = pd.DataFrame(columns=['history_id'])
-        # history table check
-        if engine.dialect.has_table(engine, history_table):
-            history_df = pd.read_sql_query("SELECT * FROM " + history_table,engine)
-
-        history_list = history_df['history_id'].tolist()
+        bulkload.tune_engine(engine)
+        # create the tables, or bring an older database up to date
+        nessus_models.upgrade_schema(engine,vulnerabilities=table,history=history_table,
+            latest=latest_table,plugins=plugin_table,trend=trend_table,mskb=mskb_table,cve=cve_table,
+            summary=summary_table,lifecycle=lifecycle_table,scan_state=scan_state_table)
+        history_list = Batch.get_loaded_histories(engine,history_table)
+        scan_states = Batch.get_scan_states(engine,scan_state_table)
 
-        nessus = Nessus(server,username,password)
+        nessus = Nessus(server,username,password,pool_size=pool_size,retries=int(retries))
 
         folders = nessus.get_scan_folders()
+        # one request for the scans of every folder
+        all_scans = nessus.get_scans()
 
+        jobs = []
+        checked = {}
         for folder in folders:
             folder_id = folder[0]
             folder_name = folder[1]
 
             if folder_name not in folder_exclude:
                 print(folder_name)
-                scans = nessus.get_scan_ids(folder_id)
+                scans = [scan for scan in all_scans if scan[2] == folder_id]
                 for scan in scans:
                     scan_id = scan[0]
                     scan_name = scan[1]
+                    modified = scan[3]
                     if scan_name not in scan_exclude:
+                        if modified is not None and scan_states.get(scan_id) == modified:
+                            print("  " + scan_name + " - unchanged")
+                            continue
                         print("  " + scan_name)
+                        checked[scan_id] = (scan_name,modified)
                         scan_name_folder = scan_name.replace(' ','_')
                         scan_name_folder_path = os.path.join(csv_path,scan_name_folder).replace('\\','/')
                         if not os.path.exists(scan_name_folder_path):
@@ -269,33 +821,601 @@ class Batch:
                             if history_id not in history_list:
                                 save_path = os.path.join(csv_path,scan_name_folder,history_date_formatted+'.csv')
                                 save_path = save_path.replace('\\','/')
-                                nessus.scans_export(scan_id,history_id,save_path)
-
-                                df = Batch.transform_df(save_path,scan_id,scan_name,history_id,history_date)
-                                Batch.load_df_database(df,engine,table)
-
-                                history_df = history_df.append([{'history_id':history_id}])
-                                history_df.to_sql(history_table, con=engine,if_exists='replace',index=False)
+                                jobs.append(ExportJob(scan_id,scan_name,history_id,history_date,save_path))
                             else:
                                 #print("      Skipping - already loaded into database")
                                 pass
-        
-        return
+
+        # Database writes are serialized, only the downloads run in parallel
+        load_lock = threading.Lock()
+        failed = []
+
+        load_stats = {'rows':0, 'seconds':0.0}
+        known_plugins = Batch.get_known_plugins(engine,plugin_table)
+
+        def write(df, finish=None):
+            with load_lock:
+                with engine.begin() as connection:
+                    n, s, plugin_dates = Batch.load_findings(df,connection,table,plugin_table,known_plugins)
+                    if finish is not None:
+                        finish(connection)
+                # only once committed
+                known_plugins.update(plugin_dates)
+            return n, s
+
+        def load(job, chunks):
+            rows = 0
+            seconds = 0.0
+            # A previous run may have died part way through this history
+            with load_lock:
+                Batch.delete_history_rows(engine,table,job.history_id)
+            snapshot = None
+            if snapshot_path and snapshots.available():
+                snapshot = snapshots.SnapshotWriter(snapshot_path,job.scan_id,job.history_id)
+            try:
+                # Hold back the last chunk so it commits together with the ledger row
+                previous = None
+                for df in chunks:
+                    if snapshot is not None:
+                        snapshot.write(df)
+                    if previous is not None:
+                        n, s = write(previous)
+                        rows, seconds = rows + n, seconds + s
+                    previous = df
+
+                def finish(connection):
+                    Batch.record_history(connection,history_table,job)
+                    Batch.refresh_latest(connection,table,latest_table,history_table,job)
+                    Batch.refresh_trend(connection,table,trend_table,job)
+                    Batch.refresh_links(connection,table,mskb_table,cve_table,job)
+                    Batch.refresh_lifecycle(connection,table,lifecycle_table,history_table,job)
+                    if not keep_history:
+                        Batch.prune_history_findings(connection,table,latest_table,history_table,
+                            [mskb_table,cve_table],job)
+
+                n, s = write(previous,finish)
+                rows, seconds = rows + n, seconds + s
+            except Exception:
+                if snapshot is not None:
+                    snapshot.abort()
+                raise
+            # Readers fall back to the database until the snapshot is there
+            if snapshot is not None:
+                snapshot.commit()
+            history_list.add(job.history_id)
+            with load_lock:
+                load_stats['rows'] = load_stats['rows'] + rows
+                load_stats['seconds'] = load_stats['seconds'] + seconds
+            print("      " + str(job.history_id) + ": inserted " + str(rows) + " rows" +
+                Batch.format_rate(rows,seconds))
+
+        jobs_by_key = {(job.scan_id,job.history_id):job for job in jobs}
+
+        if use_async:
+            # AsyncNessus downloads the files itself
+            exports = Batch.async_exports([(job.scan_id,job.history_id,job.save_path) for job in jobs],
+                server,username,password,pool_size=max(pool_size,int(export_batch_size)),
+                retries=int(retries),max_outstanding=int(export_batch_size))
+        else:
+            exports = nessus.scans_export_batch([(job.scan_id,job.history_id) for job in jobs],
+                max_outstanding=int(export_batch_size))
+
+        with ThreadPoolExecutor(max_workers=export_workers) as executor:
+            futures = {}
+            for scan_id, history_id, file_id, error in exports:
+                job = jobs_by_key[(scan_id,history_id)]
+                if error is not None:
+                    print("Failed " + job.scan_name + " - " + str(job.history_id) + ": " + str(error))
+                    failed.append(job)
+                    continue
+                if use_async:
+                    file_id = None
+                futures[executor.submit(Batch.run_export_job,nessus,job,file_id,load,
+                    stream=stream,chunk_size=chunk_size)] = job
+
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                    print("Loaded " + job.scan_name + " - " + str(job.history_id))
+                except Exception as e:
+                    print("Failed " + job.scan_name + " - " + str(job.history_id) + ": " + str(e))
+                    failed.append(job)
+
+        nessus.close()
+
+        # a scan with a failed history is listed again next time
+        failed_scans = set(job.scan_id for job in failed)
+        Batch.record_scan_states(engine,scan_state_table,
+            {scan_id:state for scan_id, state in checked.items() if scan_id not in failed_scans})
+
+        if len(failed) < len(jobs):
+            # counted once for the final data version, Plots.get_dashboard_summary
+            # counts the versions in between if a page is loaded meanwhile
+            with engine.begin() as connection:
+                Batch.refresh_summary(connection,latest_table,history_table,summary_table)
+
+        if get_latest_dataset_path() and snapshots.available() and history_list:
+            # the web workers switch to the new version on their next read,
+            # until then they read the database. Also published when the
+            # dataset was just enabled and nothing new was loaded.
+            version = Plots.get_data_version(engine,history_table)
+            if len(failed) < len(jobs) or snapshots.open_dataset(get_latest_dataset_path(),version) is None:
+                Plots.publish_latest_dataset(engine,version=version)
+
+        print(str(len(jobs)-len(failed)) + "/" + str(len(jobs)) + " histories loaded, " +
+            str(load_stats['rows']) + " rows" + Batch.format_rate(load_stats['rows'],load_stats['seconds']))
+        return failed
+
     @staticmethod
-    def transform_df(save_path,scan_id,scan_name,history_id,history_date):
-        df = pd.read_csv(save_path)
-        
+    def run_export_job(nessus,job,file_id,load,stream=False,chunk_size=50000):
+        """
+        Download, transform and load a single ready scan export.
+        Runs on a worker thread of Batch.run_batch.
+
+        Parameters:
+        nessus (Nessus): shared api client
+        job (ExportJob): the scan history to export
+        file_id (int): the ready export file on the scanner, None if it was already downloaded
+        load (function): callback taking (job, chunks) to write an iterable of frames
+        stream (bool): parse the HTTP response directly instead of saving a csv
+        chunk_size (int): rows per frame when streaming
+        """
+        if stream:
+            with nessus.scans_export_stream(job.scan_id,file_id) as response:
+                chunks = Batch.transform_chunks(response.raw,job.scan_id,job.scan_name,
+                    job.history_id,job.history_date,chunk_size=chunk_size)
+                load(job,chunks)
+            return job
+
+        if file_id is not None:
+            nessus.scans_export_download(job.scan_id,file_id,job.save_path)
+        chunks = Batch.transform_chunks(job.save_path,job.scan_id,job.scan_name,
+            job.history_id,job.history_date,chunk_size=chunk_size)
+        load(job,chunks)
+        return job
+
+    @staticmethod
+    def async_exports(exports,server,username,password,pool_size=100,retries=3,max_outstanding=50):
+        """
+        Drive AsyncNessus.scans_export_batch from synchronous code.
+        The event loop only runs while the caller waits for the next result.
+
+        Parameters:
+        exports (list): tuples (scan_id, history_id, filename)
+
+        Yields:
+        (scan_id, history_id, filename, error) as each export is downloaded
+        """
+        loop = asyncio.new_event_loop()
+        nessus = AsyncNessus(server,username,password,pool_size=pool_size,retries=retries)
+        results = nessus.scans_export_batch(exports,max_outstanding=max_outstanding)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.run_until_complete(nessus.close())
+            loop.close()
+
+    @staticmethod
+    def transform_df(save_path,scan_id,scan_name,history_id,history_date,chunk_size=50000):
+        chunks = list(Batch.transform_chunks(save_path,scan_id,scan_name,history_id,history_date,
+            chunk_size=chunk_size))
+        if not chunks:
+            return pd.DataFrame(columns=list(EXPORT_DTYPES) + ['scan_id','scan_name','history_id','history_date'])
+        return pd.concat(chunks,ignore_index=True)
+
+    @staticmethod
+    def transform_chunks(source,scan_id,scan_name,history_id,history_date,chunk_size=50000):
+        """
+        Parse an export incrementally.
+        Only the EXPORT_DTYPES columns are parsed, with their explicit dtypes,
+        and 'None' risk rows are dropped from each chunk before it is passed on.
+        The row counts and peak chunk memory are printed once the file is read.
+
+        Parameters:
+        source: path or file-like object (e.g. a streaming response's raw body)
+        chunk_size (int): rows parsed at a time
+
+        Returns:
+        chunks (generator): transformed DataFrames of at most chunk_size rows
+        """
+        rows_read = 0
+        rows_kept = 0
+        peak_memory = 0
+        reader = pd.read_csv(source,chunksize=chunk_size,dtype=EXPORT_DTYPES,
+            usecols=lambda column: column in EXPORT_DTYPES)
+        for df in reader:
+            rows_read = rows_read + len(df)
+            peak_memory = max(peak_memory, df.memory_usage(deep=True).sum())
+            df = Batch.transform_chunk(df,scan_id,scan_name,history_id,history_date)
+            rows_kept = rows_kept + len(df)
+            if len(df):
+                yield df
+
+        print("      " + str(history_id) + ": kept " + str(rows_kept) + "/" + str(rows_read) +
+            " rows, peak chunk memory " + str(round(peak_memory / 2**20,1)) + " MB")
+
+    @staticmethod
+    def transform_chunk(df,scan_id,scan_name,history_id,history_date):
+        # drop all 'info' - None columns, before anything is added to them,
+        # and rows without a plugin, which can not be stored
+        df = df[(df.Risk != 'None') & df.Risk.notnull() & df['Plugin ID'].notnull()].copy()
+        df['Plugin ID'] = df['Plugin ID'].astype('int64')
+
+        for column in EXPORT_FLAG_COLUMNS:
+            if column in df:
+                df[column] = df[column].astype(str).str.lower() == 'true'
+
+        for column in EXPORT_DATE_COLUMNS:
+            if column in df:
+                df[column] = pd.to_datetime(df[column],format='%Y/%m/%d',errors='coerce').dt.date
+
         df['scan_id'] = scan_id
         df['scan_name'] = scan_name
         df['history_id'] = history_id
         df['history_date'] = history_date
-
-        # drop all 'info' - None columns
-        df = df[df.Risk != 'None']
-        df = df[df.Risk != None]
+        df['fingerprint'] = Batch.fingerprint(df)
 
         return df
+
+    @staticmethod
+    def fingerprint(df):
+        """
+        Return a deterministic signed 64 bit hash of the FINGERPRINT_COLUMNS
+        of every row, the same for a finding in every history and process,
+        so findings can be deduplicated, joined and diffed on one integer
+        """
+        key = pd.DataFrame({
+            'Plugin ID':df['Plugin ID'].fillna(-1).astype('int64'),
+            'Host':df['Host'].fillna('').astype(str),
+            'Port':df['Port'].fillna(-1).astype('int64'),
+        },columns=FINGERPRINT_COLUMNS)
+        # hash_pandas_object uses a fixed key, the values do not depend on the process
+        return pd.util.hash_pandas_object(key,index=False).values.view('int64')
     @staticmethod
     def load_df_database(df,database,table):
-        df.to_sql(table, con=database,if_exists='append',index=False)
+        """
+        Bulk insert a frame, see app.utils.bulkload
+
+        Returns:
+        (rows, seconds): rows inserted and time taken
+        """
+        return bulkload.load_dataframe(df,database,table)
+
+    @staticmethod
+    def load_findings(df,connection,table,plugin_table,known_plugins):
+        """
+        Split a transformed frame into the Plugins dimension and the findings table.
+        A plugin's row is written when it is new or the frame's history is newer
+        than the one that last wrote it (known_plugins, plugin id to history_date),
+        so names, solutions and exploit flags follow the newest history.
+
+        Returns:
+        (rows, seconds, plugin_dates): findings inserted, time taken and the
+        history_date of every plugin row written
+        """
+        if df is None or not len(df):
+            return 0, 0.0, {}
+
+        plugins = df[['Plugin ID'] + PLUGIN_COLUMNS + ['history_date']].drop_duplicates(subset=['Plugin ID'])
+        known = plugins['Plugin ID'].isin(known_plugins)
+        # rows written before history_date was stored have none, any history replaces them
+        stored = plugins['Plugin ID'].map(known_plugins).astype('float64').fillna(-1)
+        plugins = plugins[~known | (plugins['history_date'] > stored)]
+
+        replaced = plugins['Plugin ID'][plugins['Plugin ID'].isin(known_plugins)].tolist()
+        dimension = nessus_models.plugins_table(plugin_table)
+        for start in range(0,len(replaced),500):
+            connection.execute(dimension.delete().where(dimension.c['Plugin ID'].in_(replaced[start:start + 500])))
+        _, plugin_seconds = Batch.load_df_database(plugins,connection,plugin_table)
+
+        findings = df.drop(columns=PLUGIN_COLUMNS)
+        rows, seconds = Batch.load_df_database(findings,connection,table)
+        return rows, seconds + plugin_seconds, dict(zip(plugins['Plugin ID'].tolist(),plugins['history_date'].tolist()))
+
+    @staticmethod
+    def get_known_plugins(database,plugin_table):
+        """
+        Returns:
+        plugin_dates (dict): id of every plugin in the Plugins dimension to the
+        history_date of the history that wrote its row
+        """
+        plugins = nessus_models.plugins_table(plugin_table)
+        with database.connect() as connection:
+            return dict(connection.execute(sa.select([plugins.c['Plugin ID'],plugins.c.history_date])).fetchall())
+
+    @staticmethod
+    def format_rate(rows,seconds):
+        if seconds <= 0:
+            return ""
+        return " in " + str(round(seconds,2)) + "s (" + str(int(rows / seconds)) + " rows/s)"
+
+    @staticmethod
+    def get_loaded_histories(database,table):
+        """
+        Returns:
+        history_ids (set): ids of every history in the ledger
+        """
+        ledger = nessus_models.history_table(table)
+        with database.connect() as connection:
+            return set(row[0] for row in connection.execute(sa.select([ledger.c.history_id])))
+
+    @staticmethod
+    def get_scan_states(database,table):
+        """
+        Returns:
+        states (dict): scan_id to the last_modification_date of its last complete load
+        """
+        states = nessus_models.scan_state_table(table)
+        with database.connect() as connection:
+            return dict(connection.execute(sa.select([states.c.scan_id,states.c.last_modification_date])).fetchall())
+
+    @staticmethod
+    def record_scan_states(database,table,scans):
+        """
+        Store the last_modification_date of scans whose histories are all loaded
+
+        Parameters:
+        scans (dict): scan_id to (scan_name, last_modification_date)
+        """
+        if not scans:
+            return
+        states = nessus_models.scan_state_table(table)
+        with database.begin() as connection:
+            connection.execute(states.delete().where(states.c.scan_id.in_(list(scans))))
+            connection.execute(states.insert(),[{'scan_id':scan_id,'scan_name':scan_name,
+                'last_modification_date':modified} for scan_id, (scan_name, modified) in scans.items()])
+        return
+
+    @staticmethod
+    def record_history(connection,table,job):
+        """
+        Add a loaded history to the ledger, call inside the load's transaction
+        """
+        connection.execute(nessus_models.history_table(table).insert(),
+            history_id=job.history_id,scan_id=job.scan_id,history_date=job.history_date)
+        return
+
+    @staticmethod
+    def refresh_latest(connection,table,latest_table,history_table,job):
+        """
+        Swap a scan's rows in LatestVulnerabilities for a newly loaded
+        history, unless a newer history of that scan is already there.
+        Call inside the load's transaction so readers never see a half swap.
+        """
+        newest = connection.execute(text("""
+            SELECT MAX(history_date) FROM (
+                SELECT history_date FROM "{history}" WHERE scan_id = :scan_id AND history_id != :history_id
+                UNION ALL
+                SELECT history_date FROM "{latest}" WHERE scan_id = :scan_id
+            ) dates
+            """.format(history=history_table,latest=latest_table)),
+            scan_id=job.scan_id,history_id=job.history_id).scalar()
+        if newest is not None and newest > job.history_date:
+            return False
+
+        connection.execute(text('DELETE FROM "{latest}" WHERE scan_id = :scan_id'.format(latest=latest_table)),
+            scan_id=job.scan_id)
+        # columns by name, a migration may leave the two tables in a different order
+        findings = nessus_models.vulnerabilities_table(table)
+        latest = nessus_models.latest_table(latest_table)
+        names = [column.name for column in latest.c]
+        connection.execute(latest.insert().from_select(names,sa.select([findings.c[name] for name in names])
+            .where(findings.c.history_id == job.history_id)))
+        return True
+
+    @staticmethod
+    def refresh_trend(connection,table,trend_table,job):
+        """
+        Roll a newly loaded history up into VulnerabilityTrend: its finding
+        and distinct plugin/host counts per risk replace those of the scan's
+        week unless a newer history of that week is already counted.
+        Call inside the load's transaction.
+        """
+        trend = nessus_models.trend_table(trend_table)
+        week = nessus_models.trend_week(job.history_date)
+
+        findings = nessus_models.vulnerabilities_table(table)
+        rows = findings.c.history_id == job.history_id
+        totals = sa.select([findings.c['Risk'],sa.func.count().label('findings')]) \
+            .where(rows).group_by(findings.c['Risk']).alias('totals')
+        pairs = sa.select([findings.c['Plugin ID'],findings.c['Host'],findings.c['Risk']]) \
+            .where(rows).distinct().alias('pairs')
+        distinct = sa.select([pairs.c['Risk'],sa.func.count().label('plugin_hosts')]) \
+            .group_by(pairs.c['Risk']).alias('distinct_pairs')
+        counts = connection.execute(sa.select([totals.c['Risk'],totals.c.findings,distinct.c.plugin_hosts])
+            .select_from(totals.join(distinct,distinct.c['Risk'] == totals.c['Risk']))).fetchall()
+
+        counted = dict(connection.execute(sa.select([trend.c['Risk'],trend.c.history_date])
+            .where(trend.c.scan_id == job.scan_id).where(trend.c.week == week)).fetchall())
+
+        for risk, findings, plugin_hosts in counts:
+            if risk in counted:
+                if counted[risk] > job.history_date:
+                    continue
+                connection.execute(trend.delete().where(trend.c.scan_id == job.scan_id)
+                    .where(trend.c.week == week).where(trend.c['Risk'] == risk))
+            connection.execute(trend.insert(),scan_id=job.scan_id,week=week,Risk=risk,
+                scan_name=job.scan_name,history_id=job.history_id,history_date=job.history_date,
+                findings=findings,plugin_hosts=plugin_hosts)
+        return
+
+    @staticmethod
+    def refresh_links(connection,table,mskb_table,cve_table,job):
+        """
+        Split the MSKB and CVE columns of a newly loaded history into the
+        FindingMSKB and FindingCVE link tables, one row per KB or CVE of a
+        finding. Call inside the load's transaction.
+        """
+        findings = nessus_models.vulnerabilities_table(table)
+        for name, link_table in (('MSKB',mskb_table),('CVE',cve_table)):
+            rows = connection.execute(sa.select([findings.c.id,findings.c['Host'],findings.c[name]])
+                .where(findings.c.history_id == job.history_id).where(findings.c[name] != None)
+                .order_by(findings.c.id)).fetchall()
+            links = pd.DataFrame([(finding_id,job.history_id,host,link) for finding_id, host, value in rows
+                for link in nessus_models.split_links(value)],
+                columns=['finding_id','history_id','Host',name])
+            Batch.load_df_database(links,connection,link_table)
+        return
+
+    @staticmethod
+    def refresh_lifecycle(connection,table,lifecycle_table,history_table,job):
+        """
+        Fold a newly loaded history into the FindingLifecycle intervals of
+        its scan. Only the intervals around the history's date can change:
+        those ending at the scan's previous history (extended, or fixed at
+        this one), starting at its next one (moved back) and spanning it
+        (split when the finding is missing). Histories may load in any order.
+        Call inside the load's transaction, after record_history.
+        """
+        findings = nessus_models.vulnerabilities_table(table)
+        lifecycle = nessus_models.lifecycle_table(lifecycle_table)
+        ledger = nessus_models.history_table(history_table)
+        date = job.history_date
+        key_columns = ['Host','Plugin ID','Port']
+
+        dates = dict(connection.execute(sa.select([ledger.c.history_date,ledger.c.history_id])
+            .where(ledger.c.scan_id == job.scan_id)).fetchall())
+        previous = max([d for d in dates if d < date],default=None)
+        following = min([d for d in dates if d > date],default=None)
+
+        # findings and intervals are matched on their fingerprint
+        keys = [findings.c.fingerprint] + [findings.c[name] for name in key_columns]
+        # a finding reported at several risks keeps its most severe one
+        most_severe = sa.func.max(Batch.severity(findings.c['Risk']))
+        present = {}
+        for row in connection.execute(sa.select(keys + [most_severe])
+            .where(findings.c.history_id == job.history_id).group_by(*keys)):
+            present[row[0]] = tuple(row[1:-1]) + (Batch.risk_level(row[-1]),)
+
+        query = sa.select([lifecycle]).where(lifecycle.c.scan_id == job.scan_id)
+        if previous is not None:
+            query = query.where(lifecycle.c.last_seen >= previous)
+        if following is not None:
+            query = query.where(lifecycle.c.first_seen <= following)
+        affected = {}
+        for row in connection.execute(query):
+            affected.setdefault(row['fingerprint'],[]).append(dict(row))
+        ids = [i['id'] for spans in affected.values() for i in spans]
+
+        intervals = []
+        split = {}
+        for key in set(affected) | set(present):
+            spans = affected.get(key,[])
+            span = next((i for i in spans if i['first_seen'] < date < i['last_seen']),None)
+            before = next((i for i in spans if previous is not None and i['last_seen'] == previous),None)
+            after = next((i for i in spans if following is not None and i['first_seen'] == following),None)
+            if span is not None:
+                if key not in present:
+                    spans.remove(span)
+                    split[key] = dict(span,last_seen=previous,fixed_at=date)
+                    spans.append(split[key])
+                    spans.append(dict(span,first_seen=following))
+            elif key in present:
+                if before is not None and after is not None:
+                    spans.remove(after)
+                    before.update(last_seen=after['last_seen'],fixed_at=after['fixed_at'],Risk=after['Risk'])
+                elif before is not None:
+                    before.update(last_seen=date,Risk=present[key][-1])
+                elif after is not None:
+                    after['first_seen'] = date
+                else:
+                    spans.append(dict(zip(key_columns + ['Risk'],present[key]),scan_id=job.scan_id,
+                        fingerprint=key,first_seen=date,last_seen=date,fixed_at=following))
+            elif before is not None:
+                before['fixed_at'] = date
+            intervals.extend(spans)
+
+        # the part of a split interval before this history takes the risk seen
+        # at its new last_seen, kept as it was if those findings were pruned
+        keys = list(split)
+        for start in range(0,len(keys),500):
+            for key, level in connection.execute(sa.select([findings.c.fingerprint,most_severe])
+                .where(findings.c.history_id == dates[previous])
+                .where(findings.c.fingerprint.in_(keys[start:start + 500]))
+                .group_by(findings.c.fingerprint)):
+                split[key]['Risk'] = Batch.risk_level(level)
+
+        # rewritten rather than updated row by row
+        for start in range(0,len(ids),500):
+            connection.execute(lifecycle.delete().where(lifecycle.c.id.in_(ids[start:start + 500])))
+        columns = ['scan_id','fingerprint'] + key_columns + ['Risk','first_seen','last_seen','fixed_at']
+        df = pd.DataFrame(intervals,columns=columns)
+        # open intervals have no fixed_at, keep the column integer
+        df['fixed_at'] = df['fixed_at'].astype('Int64')
+        Batch.load_df_database(df,connection,lifecycle_table)
+        return
+
+    @staticmethod
+    def prune_history_findings(connection,table,latest_table,history_table,link_tables,job):
+        """
+        Delete the findings, and their MSKB/CVE links, of every history of
+        the job's scan but the one in LatestVulnerabilities. Their trend,
+        lifecycle and snapshots are kept. Used when OMNIANA_KEEP_HISTORY_FINDINGS
+        is off, call inside the load's transaction after the refreshes.
+        """
+        superseded = text("""
+            SELECT history_id FROM "{history}" WHERE scan_id = :scan_id
+            AND history_id NOT IN (SELECT history_id FROM "{latest}" WHERE scan_id = :scan_id)
+            """.format(history=history_table,latest=latest_table))
+        for name in link_tables + [table]:
+            connection.execute(text('DELETE FROM "{table}" WHERE history_id IN ({superseded})'
+                .format(table=name,superseded=superseded.text)),scan_id=job.scan_id)
+        return
+
+    @staticmethod
+    def refresh_summary(connection,latest_table,history_table,summary_table):
+        """
+        Count the dashboard risk cards of LatestVulnerabilities and store them
+        as the DashboardSummary of the current data version, replacing those
+        of older versions. Batch.run_batch calls it once after its loads,
+        Plots.get_dashboard_summary when a version has no summary yet.
+
+        Returns:
+        counts (dict): risk to distinct Plugin ID and Host pairs, a pair
+        is counted at its most severe risk
+        """
+        latest = nessus_models.latest_table(latest_table)
+        summary = nessus_models.summary_table(summary_table)
+        pairs = sa.select([sa.func.max(Batch.severity(latest.c['Risk'])).label('severity')]) \
+            .group_by(latest.c['Plugin ID'],latest.c['Host']).alias('pairs')
+        counts = dict(connection.execute(sa.select([pairs.c.severity,sa.func.count()])
+            .group_by(pairs.c.severity)).fetchall())
+        counts = {risk:counts.get(level,0) for level, risk in enumerate(RISK_LEVELS)}
+
+        version = Plots.read_data_version(connection,history_table)
+        connection.execute(summary.delete())
+        connection.execute(summary.insert(),[{'data_version':version,'Risk':risk,'plugin_hosts':n}
+            for risk, n in counts.items()])
+        return counts
+
+    @staticmethod
+    def severity(risk):
+        """
+        SQL expression of a Risk column's index in RISK_LEVELS, -1 for
+        anything else. max() of it is the most severe risk, max() of the
+        column itself would be the last one in alphabetical order.
+        """
+        return sa.case([(risk == name, level) for level, name in enumerate(RISK_LEVELS)],else_=-1)
+
+    @staticmethod
+    def risk_level(level):
+        """The Risk of a severity() level"""
+        if level is None or level < 0:
+            return None
+        return RISK_LEVELS[level]
+
+    @staticmethod
+    def delete_history_rows(database,table,history_id):
+        """
+        Remove every finding of a history, used before (re)loading it
+        """
+        with database.begin() as connection:
+            connection.execute(text('DELETE FROM "' + table + '" WHERE history_id = :history_id'),
+                history_id=history_id)
         return
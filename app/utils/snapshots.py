@@ -0,0 +1,185 @@
+"""
+Columnar snapshots of loaded scan histories.
+
+When OMNIANA_SNAPSHOT_PATH is set every loaded history is also written
+as an uncompressed Arrow IPC file, <root>/<scan_id>/<history_id>.arrow,
+holding the columns of the Vulnerabilities table. Reading a set of
+histories memory maps those files and converts only the requested
+columns, the buffers are used in place without being decoded or copied,
+which is much cheaper than decoding the same rows from SQLite. The files
+are left uncompressed for that, a compressed column has to be inflated
+into memory on every read.
+
+The latest findings of every data version are published the same way
+as a single Arrow file that all web workers share, see publish_dataset.
+
+Requires pyarrow, available() is False without it and callers fall back
+to the database.
+"""
+import os
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# The columns of the findings table, plugin text lives in the Plugins table
+COLUMNS = ['Plugin ID', 'CVE', 'CVSS', 'Risk', 'Host', 'Protocol', 'Port', 'Plugin Output',
+    'MSKB', 'scan_id', 'scan_name', 'history_id', 'history_date']
+
+_TYPES = {'Plugin ID': 'int64', 'CVSS': 'float64', 'Port': 'int64', 'scan_id': 'int64',
+    'history_id': 'int64', 'history_date': 'int64'}
+
+
+def available():
+    return pa is not None
+
+
+def schema():
+    types = {'int64': pa.int64(), 'float64': pa.float64()}
+    return pa.schema([(name, types[_TYPES[name]] if name in _TYPES else pa.string())
+        for name in COLUMNS])
+
+
+def snapshot_path(root, scan_id, history_id):
+    return os.path.join(root, str(scan_id), '%s.arrow' % history_id)
+
+
+class SnapshotWriter:
+    """
+    Write the frames of one history to its snapshot as they are loaded.
+    The file only appears under its final name on commit(), a history
+    that fails part way leaves nothing behind.
+    """
+
+    def __init__(self, root, scan_id, history_id):
+        self.path = snapshot_path(root, scan_id, history_id)
+        self.tmp_path = self.path + '.tmp'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.schema = schema()
+        self.sink = pa.OSFile(self.tmp_path, 'wb')
+        self.writer = pa.RecordBatchFileWriter(self.sink, self.schema)
+
+    def write(self, df):
+        if df is None or not len(df):
+            return
+        table = pa.Table.from_pandas(df[COLUMNS], schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+    def commit(self):
+        self.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def read_histories(root, histories, columns=None):
+    """
+    Read the snapshots of (scan_id, history_id) pairs into one frame.
+
+    Parameters:
+    columns (list): names from COLUMNS to read, all of them by default
+
+    Returns:
+    df (DataFrame): rows of every history that has a snapshot
+    missing (list): the (scan_id, history_id) pairs without one
+    """
+    if columns is None:
+        columns = COLUMNS
+    tables = []
+    missing = []
+    for scan_id, history_id in histories:
+        path = snapshot_path(root, scan_id, history_id)
+        if not os.path.exists(path):
+            missing.append((scan_id, history_id))
+            continue
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        tables.append(pa.Table.from_arrays([table.column(name) for name in columns], names=columns))
+
+    if not tables:
+        return pd.DataFrame(columns=columns), missing
+    return pa.concat_tables(tables).to_pandas(), missing
+
+
+# The latest findings are also published as one uncompressed Arrow IPC file
+# per data version. Every web worker memory maps the same file read-only,
+# so the operating system keeps a single copy of it in memory however many
+# workers there are. A new version is written under a temporary name and
+# renamed into place, workers switch to it on their next read.
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def dataset_path(root, version):
+    return os.path.join(root, 'latest-%s.arrow' % version)
+
+
+def publish_dataset(root, version, df):
+    """Write df as the dataset of version and remove older versions"""
+    os.makedirs(root, exist_ok=True)
+    path = dataset_path(root, version)
+    tmp_path = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.OSFile(tmp_path, 'wb')
+    writer = pa.RecordBatchFileWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    sink.close()
+    os.replace(tmp_path, path)
+
+    # Workers that still map an older file keep reading it until they switch
+    published = os.path.getmtime(path)
+    for name in os.listdir(root):
+        other = os.path.join(root, name)
+        if name.startswith('latest-') and name.endswith('.arrow') and other != path:
+            try:
+                if os.path.getmtime(other) <= published:
+                    os.remove(other)
+            except OSError:
+                pass
+    return path
+
+
+def open_dataset(root, version):
+    """
+    Return the dataset of version as a memory mapped pyarrow Table,
+    None if it has not been published
+    """
+    with _datasets_lock:
+        current = _datasets.get(root)
+        if current is not None and current[0] == version:
+            return current[1]
+        path = dataset_path(root, version)
+        if not os.path.exists(path):
+            return None
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        _datasets[root] = (version, table)
+        return table
+
+
+def dataset_frame(table, columns):
+    """The columns of a dataset Table as a DataFrame"""
+    return pa.Table.from_arrays([table.column(name) for name in columns], names=columns).to_pandas()
+
+
+def dataset_batches(table, columns, batch_size):
+    """
+    Yield the columns of a dataset Table as lists of at most batch_size row
+    dicts, decoded one record batch at a time straight from the mapped file
+    """
+    selected = pa.Table.from_arrays([table.column(name) for name in columns], names=columns)
+    for batch in selected.to_batches(max_chunksize=batch_size):
+        values = batch.to_pydict()
+        yield [dict(zip(columns, row)) for row in zip(*[values[name] for name in columns])]
@@ -1,13 +1,15 @@
 from flask import Blueprint, redirect, render_template, current_app, abort
-from flask import request, url_for, flash, send_from_directory, jsonify, render_template_string, make_response
+from flask import request, url_for, flash, send_from_directory, jsonify, render_template_string, make_response, Response
 from flask_user import current_user, login_required, roles_accepted
 
 from app import db
 from app.models.user_models import UserProfileForm, User, UsersRoles, Role
 from app.utils.forms import ConfirmationForm
 from app.utils.nessus import Plots
+from app.utils import cache, datatables, jsonstream, http_cache
 import uuid, json, os
 from datetime import datetime,timedelta
+from functools import wraps
 
 import plotly
 
@@ -17,12 +19,58 @@ import numpy as np
 # When using a Flask app factory we must use a blueprint to avoid needing 'app' for '@app.route'
 nessus_blueprint = Blueprint('nessus', __name__, template_folder='templates')
 
+@nessus_blueprint.after_request
+def compress_response(response):
+    return http_cache.compress(response, http_cache.negotiate_encoding(request.accept_encodings))
+
+# The parameters that change a full data response, the filters of the
+# plugin breakdown and the export's format and search
+CONDITIONAL_PARAMS = ['cvss','risk','daysold','exploit','cve','format','search']
+
+def conditional(view_function):
+    """
+    Give a data endpoint a strong ETag from the data version and the
+    request's CONDITIONAL_PARAMS, answer a matching If-None-Match with
+    304 without running the view. DataTables server-side requests are
+    passed through, their draw counter and cache buster differ on every
+    request.
+    """
+    @wraps(view_function)
+    def decorated_view_function(*args, **kwargs):
+        if not current_user.is_authenticated or datatables.is_server_side(request.args):
+            return view_function(*args, **kwargs)
+        params = {name: request.args.get(name) for name in CONDITIONAL_PARAMS if name in request.args}
+        # daysold filters move with the date
+        params['today'] = datetime.now().strftime("%Y-%m-%d")
+        data_version = Plots.get_data_version()
+        encoding = http_cache.negotiate_encoding(request.accept_encodings)
+        # a small body is sent plain even when the client accepts gzip
+        candidates = [http_cache.etag_for(data_version, request.path, params, e)
+            for e in dict.fromkeys([encoding, None])]
+        etag = next((candidate for candidate in candidates if request.if_none_match.contains(candidate)), None)
+        if etag is not None:
+            response = Response(status=304)
+        else:
+            # compressed here, the ETag names the encoding actually sent
+            response = http_cache.compress(make_response(view_function(*args, **kwargs)), encoding)
+            etag = http_cache.etag_for(data_version, request.path, params,
+                response.headers.get('Content-Encoding'))
+        response.set_etag(etag)
+        # private as every view needs a login, no-cache to revalidate on every use
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_view_function
+
 # The User page is accessible to authenticated users (users that have logged in)
 @nessus_blueprint.route('/nessus')
 def main_page():
     if not current_user.is_authenticated:
         return redirect(url_for('user.login'))
-    
+    ids, figuresJSON, vulns = cache.get_or_create('nessus',
+        cache.make_key(Plots.get_data_version()),main_page_data)
+    return render_template('pages/nessus/nessus_base.html',ids=ids, figuresJSON=figuresJSON,vulns=vulns)
+
+def main_page_data():
     figures = []
     vuln_trend_overall = Plots.get_figure_overall_vuln_trend()
     vuln_trend_plugin = Plots.get_figure_plugin_vuln_trend()
@@ -33,14 +81,53 @@ def main_page():
 
     figuresJSON = json.dumps(figures,cls=plotly.utils.PlotlyJSONEncoder)
     #return render_template('index.html', ids=ids, figuresJSON=figuresJSON)
-    df = Plots.get_latest_vulnerabilities_data()
-    # 'Plugin ID', 'CVE', 'CVSS', 'Risk', 'Host', 'Protocol', 'Port', 'Name', 'Synopsis',
-    # 'Description', 'Solution', 'See Also', 'Scan',
-    # 'Plugin Publication Date',Metasploit, Core Impact, CANVAS,'Plugin Output'
-    df = df.sort_values('Risk').drop_duplicates(subset=['Plugin ID','Host'],keep='first')
-    vulns = df.groupby('Risk').count()['Plugin ID'].tolist()
-    vulns = [vulns[i] for i in [0,1,3,2]] #reorder
-    return render_template('pages/nessus/nessus_base.html',ids=ids, figuresJSON=figuresJSON,vulns=vulns)
+    # written by the ingest, see Batch.refresh_summary
+    counts = Plots.get_dashboard_summary()
+    vulns = [counts.get(risk,0) for risk in ['Critical','High','Medium','Low']]
+    return ids, figuresJSON, vulns
+
+# Columns sent to the tables and the ones their search box looks in
+BREAKDOWN_TABLE_COLUMNS = ['Plugin ID','CVE','CVSS','Risk','Host','Synopsis','Scan','MSKB',
+    'Plugin Publication Date','Exploitable']
+BREAKDOWN_SEARCH_COLUMNS = ['Plugin ID','CVE','Risk','Host','Synopsis','Scan','MSKB']
+PLUGIN_TABLE_COLUMNS = ['Plugin ID','CVSS','Risk','Host','Synopsis','Solution','Plugin Output',
+    'Scan','MSKB','Plugin Publication Date','Exploitable']
+PLUGIN_SEARCH_COLUMNS = ['Plugin ID','Risk','Host','Synopsis','Solution','Plugin Output','Scan']
+
+def wants_stream():
+    """Full responses are streamed from the database when enabled, NDJSON and CSV always are"""
+    return current_app.config.get('OMNIANA_STREAM_RESPONSES', False) or request.args.get('format') in ('ndjson','csv')
+
+def export_filters(search_columns, per_mskb=False):
+    """Where clauses of the search box a table's export button sends as ?search="""
+    return Plots.search_filter(request.args.get('search'),search_columns,per_mskb=per_mskb)
+
+def stream_response(batches, columns, filename):
+    """
+    Stream batches of row dicts (see Plots.iter_latest_vulnerabilities)
+    as a JSON array, as NDJSON with ?format=ndjson or as a CSV download
+    with ?format=csv, the export of the tables' Excel button
+    """
+    if request.args.get('format') == 'ndjson':
+        return Response(jsonstream.ndjson(batches), mimetype='application/x-ndjson')
+    if request.args.get('format') == 'csv':
+        return Response(jsonstream.csv(batches, columns), mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=%s.csv' % filename})
+    return Response(jsonstream.json_array(batches), mimetype='application/json')
+
+def page_response(namespace, params, columns, create_page):
+    """
+    Answer a DataTables server-side request, create_page(page) returns
+    (records_total, records_filtered, df) and is cached per data version
+    """
+    page = datatables.parse_request(request.args, columns)
+    params = dict(params, start=page.start, length=page.length, search=page.search,
+        order=','.join('%s %s' % (name, 'asc' if ascending else 'desc') for name, ascending in page.order))
+    records_total, records_filtered, data = cache.get_or_create(namespace + '-page',
+        cache.make_key(Plots.get_data_version(),params),
+        lambda: create_page(page))
+    return Response(datatables.make_response_body(page,records_total,records_filtered,data),
+        mimetype='application/json')
 
 @nessus_blueprint.route('/nessus-breakdown')
 def breakdown_page():
@@ -49,16 +136,30 @@ def breakdown_page():
     return render_template('pages/nessus/nessus_breakdown.html')
 
 @nessus_blueprint.route('/nessus-breakdown-data')
+@conditional
 def breakdown_data():
     if not current_user.is_authenticated:
         return redirect(url_for('user.login'))
-    df = Plots.get_latest_vulnerabilities_data()
-    # 'Plugin ID', 'CVE', 'CVSS', 'Risk', 'Host', 'Protocol', 'Port', 'Name', 'Synopsis',
-    # 'Description', 'Solution', 'See Also', 'Scan',
-    # 'Plugin Publication Date',Metasploit, Core Impact, CANVAS,MSKB
-    df['Exploitable'] = (df['Metasploit']==True) | (df['Core Impact']==True) |(df['CANVAS']==True)
-    df = df[['Plugin ID','CVE','CVSS','Risk','Host','Synopsis','Scan','MSKB','Plugin Publication Date','Exploitable']]
-    return make_response(df.to_json(orient="records"))
+    if datatables.is_server_side(request.args):
+        return page_response('nessus-breakdown-data', {}, BREAKDOWN_TABLE_COLUMNS, breakdown_page_json)
+    if wants_stream():
+        return stream_response(Plots.iter_latest_vulnerabilities(BREAKDOWN_TABLE_COLUMNS,
+            where=export_filters(BREAKDOWN_SEARCH_COLUMNS),
+            batch_size=current_app.config['OMNIANA_STREAM_BATCH_SIZE']),
+            BREAKDOWN_TABLE_COLUMNS,'nessus-breakdown')
+    data = cache.get_or_create('nessus-breakdown-data',
+        cache.make_key(Plots.get_data_version()),breakdown_json)
+    return Response(data, mimetype='application/json')
+
+def breakdown_json():
+    df = Plots.get_latest_vulnerabilities_data(columns=BREAKDOWN_TABLE_COLUMNS)
+    return df.to_json(orient="records")
+
+def breakdown_page_json(page):
+    records_total, records_filtered, df = Plots.get_latest_vulnerabilities_page(BREAKDOWN_TABLE_COLUMNS,
+        start=page.start,length=page.length,order=page.order,
+        search=page.search,search_columns=BREAKDOWN_SEARCH_COLUMNS)
+    return records_total, records_filtered, df.to_json(orient="records")
 
 @nessus_blueprint.route('/nessus-mskb')
 def breakdown_mskb_page():
@@ -67,49 +168,31 @@ def breakdown_mskb_page():
     return render_template('pages/nessus/nessus_mskb.html')
 
 @nessus_blueprint.route('/nessus-mskb-data')
+@conditional
 def breakdown_mskb_data():
     if not current_user.is_authenticated:
         return redirect(url_for('user.login'))
-    df = Plots.get_latest_vulnerabilities_data()
-
-    def explode(df, lst_cols, fill_value='', preserve_index=False):
-        # make sure `lst_cols` is list-alike
-        if (lst_cols is not None
-            and len(lst_cols) > 0
-            and not isinstance(lst_cols, (list, tuple, np.ndarray, pd.Series))):
-            lst_cols = [lst_cols]
-        # all columns except `lst_cols`
-        idx_cols = df.columns.difference(lst_cols)
-        # calculate lengths of lists
-        lens = df[lst_cols[0]].str.len()
-        # preserve original index values
-        idx = np.repeat(df.index.values, lens)
-        # create "exploded" DF
-        res = (pd.DataFrame({
-                    col:np.repeat(df[col].values, lens)
-                    for col in idx_cols},
-                    index=idx)
-                 .assign(**{col:np.concatenate(df.loc[lens>0, col].values)
-                                for col in lst_cols}))
-        # append those rows that have empty lists
-        if (lens == 0).any():
-            # at least one list in cells is empty
-            res = (res.append(df.loc[lens==0, idx_cols], sort=False)
-                      .fillna(fill_value))
-        # revert the original index order
-        res = res.sort_index()
-        # reset index if requested
-        if not preserve_index:
-            res = res.reset_index(drop=True)
-        return res
-
-    df['Exploitable'] = (df['Metasploit']==True) | (df['Core Impact']==True) |(df['CANVAS']==True)
-
-    df = df[['Plugin ID','CVE','CVSS','Risk','Host','Synopsis','Scan','MSKB','Plugin Publication Date','Exploitable']]
-    df.dropna(subset=['MSKB'],inplace=True)
-    df = explode(df.assign(MSKB=df.MSKB.str.split(';')),'MSKB')
-    df = df.drop_duplicates(subset=['Host','MSKB'])
-    return make_response(df.to_json(orient="records"))
+    # one row per Host and KB, read from the FindingMSKB links built at ingest
+    if datatables.is_server_side(request.args):
+        return page_response('nessus-mskb-data', {}, BREAKDOWN_TABLE_COLUMNS, breakdown_mskb_page_json)
+    if wants_stream():
+        return stream_response(Plots.iter_latest_vulnerabilities(BREAKDOWN_TABLE_COLUMNS,per_mskb=True,
+            where=export_filters(BREAKDOWN_SEARCH_COLUMNS,per_mskb=True),
+            batch_size=current_app.config['OMNIANA_STREAM_BATCH_SIZE']),
+            BREAKDOWN_TABLE_COLUMNS,'nessus-mskb')
+    data = cache.get_or_create('nessus-mskb-data',
+        cache.make_key(Plots.get_data_version()),breakdown_mskb_json)
+    return Response(data, mimetype='application/json')
+
+def breakdown_mskb_json():
+    df = Plots.get_latest_vulnerabilities_data(columns=BREAKDOWN_TABLE_COLUMNS,per_mskb=True)
+    return df.to_json(orient="records")
+
+def breakdown_mskb_page_json(page):
+    records_total, records_filtered, df = Plots.get_latest_vulnerabilities_page(BREAKDOWN_TABLE_COLUMNS,
+        start=page.start,length=page.length,order=page.order,
+        search=page.search,search_columns=BREAKDOWN_SEARCH_COLUMNS,per_mskb=True)
+    return records_total, records_filtered, df.to_json(orient="records")
 
 
 @nessus_blueprint.route('/nessus-breakdown-plugin')
@@ -120,42 +203,63 @@ def breakdown_plugin_page():
     return render_template('pages/nessus/nessus_breakdown_plugin.html')
 
 @nessus_blueprint.route('/nessus-breakdown-plugin-data')
+@conditional
 def breakdown_plugin_data():
     if not current_user.is_authenticated:
         return redirect(url_for('user.login'))
-    df = Plots.get_latest_vulnerabilities_data()
-    # 'Plugin ID', 'CVE', 'CVSS', 'Risk', 'Host', 'Protocol', 'Port', 'Name', 'Synopsis',
-    # 'Description', 'Solution', 'See Also', 'Scan',
-    # 'Plugin Publication Date',Metasploit, Core Impact, CANVAS, MSKB
-    #df = df.sort_values('Risk').drop_duplicates(subset=['Plugin ID','Host'],keep='first')
-    #df = df[['Plugin ID','CVSS','Risk','Host','Synopsis','Solution','Scan']]
 
     cvss = request.args.get('cvss', default = -1, type = int)
     risk = request.args.get('risk', default = None, type = str)
     daysold = request.args.get('daysold',default = -1, type = int)
     exploit = request.args.get('exploit',default = 0, type = int)
+    cve = request.args.get('cve', default = None, type = str)
 
-    if exploit != 0:
-        df = df[(df['Metasploit']==True) | (df['Core Impact']==True) |(df['CANVAS']==True)]
-        
-    df = df.sort_values('Risk').drop_duplicates(subset=['Plugin ID','Host'],keep='first')
-    
-    if cvss != -1 and cvss>0 and cvss<=10:
-        df = df[df.CVSS >= cvss]
-    if risk:
-        risk_arr = risk.split('-')
-        #df = df[df.isin({'Risk':risk_arr})].dropna(subset=['Risk'])
-        df = df[df['Risk'].isin(risk_arr)]
+    params = {'cvss':cvss,'risk':risk,'daysold':daysold,'exploit':exploit,'cve':cve}
     if daysold >= 0:
-        current_date = datetime.now()
-        new_date = current_date - timedelta(days=daysold)
-        date = new_date.strftime("%Y/%m/%d")
-        df = df[(df['Plugin Publication Date']<date)]
+        # the cutoff moves with the date
+        params['today'] = datetime.now().strftime("%Y-%m-%d")
+    if datatables.is_server_side(request.args):
+        return page_response('nessus-breakdown-plugin-data', params, PLUGIN_TABLE_COLUMNS,
+            lambda page: breakdown_plugin_page_json(page,cvss,risk,daysold,exploit,cve))
+    if wants_stream():
+        batches = Plots.iter_latest_vulnerabilities(PLUGIN_TABLE_COLUMNS,
+            where=Plots.breakdown_filters(cvss,risk,daysold,exploit,cve) + export_filters(PLUGIN_SEARCH_COLUMNS),
+            distinct_plugin_host=True,batch_size=current_app.config['OMNIANA_STREAM_BATCH_SIZE'])
+        return stream_response(escape_plugin_output(batches),PLUGIN_TABLE_COLUMNS,'nessus-breakdown-plugin')
+    data = cache.get_or_create('nessus-breakdown-plugin-data',
+        cache.make_key(Plots.get_data_version(),params),
+        lambda: breakdown_plugin_json(cvss,risk,daysold,exploit,cve))
+    return Response(data, mimetype='application/json')
+
+def breakdown_plugin_json(cvss=-1,risk=None,daysold=-1,exploit=0,cve=None):
+    # the url filters and the Plugin ID/Host dedup run in the database
+    df = Plots.get_latest_vulnerabilities_data(columns=PLUGIN_TABLE_COLUMNS,
+        where=Plots.breakdown_filters(cvss,risk,daysold,exploit,cve),distinct_plugin_host=True)
     df['Plugin Output'] = df['Plugin Output'].str.replace('javascript:alert', 'javascript[colon]alert', regex=False)
-    df['Exploitable'] = (df['Metasploit']==True) | (df['Core Impact']==True) |(df['CANVAS']==True)
-    df = df[['Plugin ID','CVSS','Risk','Host','Synopsis','Solution','Plugin Output','Scan','MSKB','Plugin Publication Date','Exploitable']]
 
-    return make_response(df.to_json(orient="records"))
+    return df.to_json(orient="records")
+
+def escape_plugin_output(batches):
+    for batch in batches:
+        for row in batch:
+            if row['Plugin Output']:
+                row['Plugin Output'] = row['Plugin Output'].replace('javascript:alert', 'javascript[colon]alert')
+        yield batch
+
+def breakdown_plugin_page_json(page,cvss=-1,risk=None,daysold=-1,exploit=0,cve=None):
+    records_total, records_filtered, df = Plots.get_latest_vulnerabilities_page(PLUGIN_TABLE_COLUMNS,
+        start=page.start,length=page.length,order=page.order,
+        search=page.search,search_columns=PLUGIN_SEARCH_COLUMNS,
+        where=Plots.breakdown_filters(cvss,risk,daysold,exploit,cve),distinct_plugin_host=True)
+    df['Plugin Output'] = df['Plugin Output'].str.replace('javascript:alert', 'javascript[colon]alert', regex=False)
+    return records_total, records_filtered, df.to_json(orient="records")
+
+@nessus_blueprint.route('/nessus-cache-stats')
+@roles_accepted('admin')
+def cache_stats():
+    stats = cache.cache_stats()
+    stats['data_version'] = Plots.get_data_version()
+    return jsonify(stats)
 
 
 # The Admin page is accessible to users with the 'admin' role
@@ -42,6 +42,7 @@ fi
 set -e
 echo 'Performing any database migrations.'
 python manage.py db upgrade
+python manage.py nessus-db-upgrade
 
 if [ ! -f ~/.hasrun ]; then
   echo 'Setting up initial roles and users if they do not exist.'
@@ -5,15 +5,16 @@ Use "python manage.py runserver" to start the development web server on localhos
 Use "python manage.py runserver --help" for additional runserver options.
 """
 
-from flask import Flask
+from flask import Flask, current_app
 #from flask_migrate import MigrateCommand
 from flask.cli import FlaskGroup
 
 import click
 
-from app import create_app
+from app import create_app, db
 
 from app.commands import user
+from app.models import nessus_models
 
 
 @click.group(cls=FlaskGroup, create_app=create_app)
@@ -72,5 +73,24 @@ def reset_password(email, password, secure):
 
 
 
+@cli.command(help='Create or upgrade the tables of the Nessus database')
+@click.argument('revision', required=False, default='head')
+def nessus_db_upgrade(revision):
+    engine = db.get_engine(bind=current_app.config['NESSUS_SQLALCHEMY_BINDS'])
+    nessus_models.upgrade_schema(engine, revision,
+        vulnerabilities=current_app.config['OMNIANA_NESSUS_TABLE'],
+        history=current_app.config['OMNIANA_HISTORY_TABLE'],
+        latest=current_app.config['OMNIANA_LATEST_TABLE'],
+        plugins=current_app.config['OMNIANA_PLUGIN_TABLE'],
+        trend=current_app.config['OMNIANA_TREND_TABLE'],
+        mskb=current_app.config['OMNIANA_MSKB_TABLE'],
+        cve=current_app.config['OMNIANA_CVE_TABLE'],
+        summary=current_app.config['OMNIANA_SUMMARY_TABLE'],
+        lifecycle=current_app.config['OMNIANA_LIFECYCLE_TABLE'],
+        scan_state=current_app.config['OMNIANA_SCAN_STATE_TABLE'])
+
+
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,71 @@
+from __future__ import with_statement
+
+import logging
+
+from sqlalchemy import engine_from_config
+from sqlalchemy import pool
+
+from alembic import context
+
+from app import settings
+from app.models.nessus_models import nessus_metadata
+
+# this is the Alembic Config object, it is built in code by
+# app.models.nessus_models.upgrade_schema rather than read from an .ini file
+config = context.config
+logger = logging.getLogger('alembic.env')
+
+target_metadata = nessus_metadata
+
+# The table names are configurable (OMNIANA_*_TABLE), the revisions read them from here
+config.attributes.setdefault('nessus_tables', {
+    'vulnerabilities': settings.OMNIANA_NESSUS_TABLE,
+    'history': settings.OMNIANA_HISTORY_TABLE,
+    'latest': settings.OMNIANA_LATEST_TABLE,
+    'plugins': settings.OMNIANA_PLUGIN_TABLE,
+    'trend': settings.OMNIANA_TREND_TABLE,
+    'mskb': settings.OMNIANA_MSKB_TABLE,
+    'cve': settings.OMNIANA_CVE_TABLE,
+    'summary': settings.OMNIANA_SUMMARY_TABLE,
+    'lifecycle': settings.OMNIANA_LIFECYCLE_TABLE,
+    'scan_state': settings.OMNIANA_SCAN_STATE_TABLE,
+})
+
+# Kept apart from the main database's alembic_version in case both binds share a database
+VERSION_TABLE = 'alembic_version_nessus'
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    The revisions inspect and convert existing data, so there is no
+    offline (sql script) mode for this environment.
+
+    """
+    connection = config.attributes.get('connection')
+    if connection is None:
+        connectable = engine_from_config(
+            config.get_section(config.config_ini_section),
+            prefix='sqlalchemy.',
+            poolclass=pool.NullPool,
+        )
+        with connectable.connect() as connection:
+            config.attributes['connection'] = connection
+            run_migrations_online()
+        return
+
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        version_table=VERSION_TABLE,
+        render_as_batch=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    raise RuntimeError('The nessus migrations can only run online')
+else:
+    run_migrations_online()
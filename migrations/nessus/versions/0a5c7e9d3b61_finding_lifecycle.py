@@ -0,0 +1,101 @@
+"""finding lifecycle intervals
+
+Adds FindingLifecycle, the first_seen/last_seen/fixed_at intervals of
+every (scan, Host, Plugin ID, Port), and fills it by replaying the
+histories already in Vulnerabilities scan by scan. Ingest folds every
+history it loads into it from then on.
+
+Revision ID: 0a5c7e9d3b61
+Revises: f4d6a8b2c173
+Create Date: 2026-10-18 18:12:30.655281
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a5c7e9d3b61'
+down_revision = 'f4d6a8b2c173'
+branch_labels = None
+depends_on = None
+
+
+# Risk levels from least to most severe
+RISK_LEVELS = ['None', 'Low', 'Medium', 'High', 'Critical']
+
+
+def replay(histories):
+    """Intervals of (date, {key: risk}) histories in date order"""
+    closed = []
+    open_ = {}
+    for date, present in histories:
+        for key, interval in list(open_.items()):
+            if key not in present:
+                interval['fixed_at'] = date
+                closed.append(open_.pop(key))
+        for key, risk in present.items():
+            if key in open_:
+                open_[key].update(last_seen=date, Risk=risk)
+            else:
+                open_[key] = {'Host': key[0], 'Plugin ID': key[1], 'Port': key[2], 'Risk': risk,
+                    'first_seen': date, 'last_seen': date, 'fixed_at': None}
+    return closed + list(open_.values())
+
+
+def upgrade():
+    tables = context.config.attributes['nessus_tables']
+    lifecycle = tables['lifecycle']
+    findings = tables['vulnerabilities']
+    history = tables['history']
+
+    op.create_table(lifecycle,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('scan_id', sa.Integer(), nullable=True),
+        sa.Column('Host', sa.String(255), nullable=True),
+        sa.Column('Plugin ID', sa.Integer(), nullable=True),
+        sa.Column('Port', sa.Integer(), nullable=True),
+        sa.Column('Risk', sa.String(16), nullable=True),
+        sa.Column('first_seen', sa.Integer(), nullable=True),
+        sa.Column('last_seen', sa.Integer(), nullable=True),
+        sa.Column('fixed_at', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_%s_finding' % lifecycle, lifecycle, ['scan_id', 'Host', 'Plugin ID', 'Port'])
+    op.create_index('ix_%s_last_seen' % lifecycle, lifecycle, ['scan_id', 'last_seen'])
+    op.create_index('ix_%s_first_seen' % lifecycle, lifecycle, ['first_seen'])
+    op.create_index('ix_%s_fixed_at' % lifecycle, lifecycle, ['fixed_at'])
+
+    bind = op.get_bind()
+    target = sa.table(lifecycle, sa.column('scan_id'), sa.column('Host'), sa.column('Plugin ID'),
+        sa.column('Port'), sa.column('Risk'), sa.column('first_seen'), sa.column('last_seen'),
+        sa.column('fixed_at'))
+    scans = [row[0] for row in bind.execute(sa.text(
+        'SELECT DISTINCT scan_id FROM "{history}"'.format(history=history)))]
+    for scan_id in scans:
+        ledger = bind.execute(sa.text(
+            'SELECT history_id, history_date FROM "{history}" WHERE scan_id = :scan_id ORDER BY history_date'
+            .format(history=history)), scan_id=scan_id).fetchall()
+        histories = []
+        # a finding reported at several risks keeps its most severe one
+        severity = 'CASE "Risk" %s ELSE -1 END' % ' '.join(
+            "WHEN '%s' THEN %d" % (risk, level) for level, risk in enumerate(RISK_LEVELS))
+        for history_id, history_date in ledger:
+            rows = bind.execute(sa.text(
+                'SELECT "Host", "Plugin ID", "Port", MAX({severity}) FROM "{findings}" WHERE history_id = :history_id '
+                'GROUP BY "Host", "Plugin ID", "Port"'.format(severity=severity, findings=findings)),
+                history_id=history_id)
+            histories.append((history_date, {(host, plugin_id, port): RISK_LEVELS[level] if level >= 0 else None
+                for host, plugin_id, port, level in rows}))
+        intervals = [dict(interval, scan_id=scan_id) for interval in replay(histories)]
+        if intervals:
+            op.bulk_insert(target, intervals)
+
+
+def downgrade():
+    lifecycle = context.config.attributes['nessus_tables']['lifecycle']
+    op.drop_index('ix_%s_fixed_at' % lifecycle, table_name=lifecycle)
+    op.drop_index('ix_%s_first_seen' % lifecycle, table_name=lifecycle)
+    op.drop_index('ix_%s_last_seen' % lifecycle, table_name=lifecycle)
+    op.drop_index('ix_%s_finding' % lifecycle, table_name=lifecycle)
+    op.drop_table(lifecycle)
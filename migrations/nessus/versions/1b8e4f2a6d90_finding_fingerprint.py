@@ -0,0 +1,76 @@
+"""finding fingerprint
+
+Adds the 64 bit fingerprint of Plugin ID, Host and Port to the findings
+tables and FindingLifecycle, indexed, and computes it for the rows
+already there. FindingLifecycle is indexed on scan_id and fingerprint
+instead of the three columns.
+
+Revision ID: 1b8e4f2a6d90
+Revises: 0a5c7e9d3b61
+Create Date: 2026-10-18 19:03:44.871926
+
+"""
+from alembic import context, op
+import pandas as pd
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b8e4f2a6d90'
+down_revision = '0a5c7e9d3b61'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 50000
+
+
+def fingerprint(df):
+    # the same hash as Batch.fingerprint
+    key = pd.DataFrame({
+        'Plugin ID': df['Plugin ID'].fillna(-1).astype('int64'),
+        'Host': df['Host'].fillna('').astype(str),
+        'Port': df['Port'].fillna(-1).astype('int64'),
+    }, columns=['Plugin ID', 'Host', 'Port'])
+    return pd.util.hash_pandas_object(key, index=False).values.view('int64')
+
+
+def fill_fingerprints(table):
+    bind = op.get_bind()
+    query = sa.text('SELECT id, "Plugin ID", "Host", "Port" FROM "{table}" WHERE id > :last ORDER BY id LIMIT {batch}'
+        .format(table=table, batch=BATCH_SIZE))
+    update = sa.text('UPDATE "{table}" SET fingerprint = :fingerprint WHERE id = :id'.format(table=table))
+    last = 0
+    while True:
+        df = pd.read_sql_query(query, bind, params={'last': last})
+        if not len(df):
+            break
+        last = int(df['id'].iloc[-1])
+        bind.execute(update, [{'id': int(i), 'fingerprint': int(f)} for i, f in zip(df['id'], fingerprint(df))])
+
+
+def upgrade():
+    tables = context.config.attributes['nessus_tables']
+    lifecycle = tables['lifecycle']
+
+    for table in (tables['vulnerabilities'], tables['latest'], lifecycle):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('fingerprint', sa.BigInteger(), nullable=True))
+        fill_fingerprints(table)
+    for table in (tables['vulnerabilities'], tables['latest']):
+        op.create_index('ix_%s_fingerprint' % table, table, ['fingerprint'])
+
+    op.drop_index('ix_%s_finding' % lifecycle, table_name=lifecycle)
+    op.create_index('ix_%s_finding' % lifecycle, lifecycle, ['scan_id', 'fingerprint'])
+
+
+def downgrade():
+    tables = context.config.attributes['nessus_tables']
+    lifecycle = tables['lifecycle']
+
+    op.drop_index('ix_%s_finding' % lifecycle, table_name=lifecycle)
+    op.create_index('ix_%s_finding' % lifecycle, lifecycle, ['scan_id', 'Host', 'Plugin ID', 'Port'])
+    for table in (tables['vulnerabilities'], tables['latest']):
+        op.drop_index('ix_%s_fingerprint' % table, table_name=table)
+    for table in (tables['vulnerabilities'], tables['latest'], lifecycle):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('fingerprint')
@@ -0,0 +1,33 @@
+"""scan state
+
+Adds the ScanState table, the last_modification_date of every scan as of
+its last complete load. It starts empty, the next run checks every scan.
+
+Revision ID: 2c9f1a7e5b48
+Revises: 1b8e4f2a6d90
+Create Date: 2026-10-18 19:47:15.302668
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c9f1a7e5b48'
+down_revision = '1b8e4f2a6d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(context.config.attributes['nessus_tables']['scan_state'],
+        sa.Column('scan_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('scan_name', sa.String(255), nullable=True),
+        sa.Column('last_modification_date', sa.Integer(), nullable=True),
+        sa.Column('checked_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('scan_id')
+    )
+
+
+def downgrade():
+    op.drop_table(context.config.attributes['nessus_tables']['scan_state'])
@@ -0,0 +1,31 @@
+"""plugin history date
+
+Stores on every Plugins row the history_date of the history that wrote
+it, so a newer history replaces a plugin's name, solution and exploit
+flags. Existing rows have none and are replaced by the next history that
+reports the plugin.
+
+Revision ID: 3e5a0c8d7f12
+Revises: 2c9f1a7e5b48
+Create Date: 2026-10-19 10:14:52.907361
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e5a0c8d7f12'
+down_revision = '2c9f1a7e5b48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table(context.config.attributes['nessus_tables']['plugins']) as batch_op:
+        batch_op.add_column(sa.Column('history_date', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table(context.config.attributes['nessus_tables']['plugins']) as batch_op:
+        batch_op.drop_column('history_date')
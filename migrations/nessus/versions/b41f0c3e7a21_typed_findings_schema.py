@@ -0,0 +1,177 @@
+"""typed findings schema with indexes
+
+Replaces the tables pandas created implicitly (all TEXT/REAL, no keys)
+with typed and indexed ones. Existing data is converted in place: each
+old table is renamed, its rows are copied into the new table with
+casts, and the old table is dropped. Columns that ingest no longer
+keeps are dropped. LatestVulnerabilities is rebuilt from the converted
+Vulnerabilities table.
+
+Revision ID: b41f0c3e7a21
+Revises: 
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41f0c3e7a21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INTEGER_COLUMNS = ['Plugin ID', 'Port', 'scan_id', 'history_id', 'history_date']
+FLOAT_COLUMNS = ['CVSS']
+BOOLEAN_COLUMNS = ['Metasploit', 'Core Impact', 'CANVAS']
+DATE_COLUMNS = ['Plugin Publication Date']
+
+
+def findings_columns():
+    return [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('Plugin ID', sa.Integer(), nullable=True),
+        sa.Column('CVE', sa.Text(), nullable=True),
+        sa.Column('CVSS', sa.Float(), nullable=True),
+        sa.Column('Risk', sa.String(length=16), nullable=True),
+        sa.Column('Host', sa.String(length=255), nullable=True),
+        sa.Column('Protocol', sa.String(length=16), nullable=True),
+        sa.Column('Port', sa.Integer(), nullable=True),
+        sa.Column('Name', sa.Text(), nullable=True),
+        sa.Column('Synopsis', sa.Text(), nullable=True),
+        sa.Column('Description', sa.Text(), nullable=True),
+        sa.Column('Solution', sa.Text(), nullable=True),
+        sa.Column('See Also', sa.Text(), nullable=True),
+        sa.Column('Plugin Output', sa.Text(), nullable=True),
+        sa.Column('MSKB', sa.Text(), nullable=True),
+        sa.Column('Plugin Publication Date', sa.Date(), nullable=True),
+        sa.Column('Metasploit', sa.Boolean(create_constraint=False), nullable=True),
+        sa.Column('Core Impact', sa.Boolean(create_constraint=False), nullable=True),
+        sa.Column('CANVAS', sa.Boolean(create_constraint=False), nullable=True),
+        sa.Column('scan_id', sa.Integer(), nullable=True),
+        sa.Column('scan_name', sa.String(length=255), nullable=True),
+        sa.Column('history_id', sa.Integer(), nullable=True),
+        sa.Column('history_date', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    ]
+
+
+def create_findings_table(name):
+    op.create_table(name, *findings_columns())
+    op.create_index('ix_%s_scan_history' % name, name, ['scan_id', 'history_date'])
+    op.create_index('ix_%s_history_id' % name, name, ['history_id'])
+    op.create_index('ix_%s_risk' % name, name, ['Risk'])
+    op.create_index('ix_%s_host' % name, name, ['Host'])
+    op.create_index('ix_%s_plugin_id' % name, name, ['Plugin ID'])
+    op.create_index('ix_%s_publication_date' % name, name, ['Plugin Publication Date'])
+
+
+def drop_findings_indexes(name):
+    for index in ['scan_history', 'history_id', 'risk', 'host', 'plugin_id', 'publication_date']:
+        op.drop_index('ix_%s_%s' % (name, index), table_name=name)
+
+
+def converted(column, name, dialect):
+    """Expression reading an old untyped column as the new column type"""
+    if name in INTEGER_COLUMNS:
+        return sa.cast(column, sa.Integer())
+    if name in FLOAT_COLUMNS:
+        return sa.cast(column, sa.Float())
+    if name in BOOLEAN_COLUMNS:
+        # pandas wrote the flags as text, integers or, with blanks in the
+        # export, REAL 1.0 which SQLite casts to '1.0'
+        return sa.case([(sa.func.lower(sa.cast(column, sa.Text())).in_(['1', '1.0', 'true']), sa.true())],
+            else_=sa.false())
+    if name in DATE_COLUMNS:
+        # Nessus writes 2020/04/14, the date types want 2020-04-14.
+        # SQLite has no date type and would turn CAST(... AS DATE) into a number.
+        value = sa.func.nullif(sa.func.replace(sa.cast(column, sa.Text()), '/', '-'), '')
+        if dialect == 'sqlite':
+            return value
+        return sa.cast(value, sa.Date())
+    return sa.cast(column, sa.Text())
+
+
+def convert_findings_table(bind, name):
+    old_name = name + '_untyped'
+    op.rename_table(name, old_name)
+    old = sa.Table(old_name, sa.MetaData(), autoload_with=bind)
+    create_findings_table(name)
+
+    new = sa.table(name, *[sa.column(c.name) for c in findings_columns() if isinstance(c, sa.Column)])
+    names = [c.name for c in findings_columns() if isinstance(c, sa.Column) and c.name in old.c]
+    select = sa.select([converted(old.c[n], n, bind.dialect.name) for n in names])
+    op.execute(new.insert().from_select(names, select))
+    op.drop_table(old_name)
+
+
+def upgrade():
+    tables = context.config.attributes['nessus_tables']
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing = inspector.get_table_names()
+
+    # History ledger
+    history = tables['history']
+    if history not in existing:
+        op.create_table(history,
+            sa.Column('history_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('scan_id', sa.Integer(), nullable=True),
+            sa.Column('history_date', sa.Integer(), nullable=True),
+            sa.Column('loaded_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('history_id'),
+        )
+        op.create_index('ix_%s_scan_id' % history, history, ['scan_id'])
+    elif not inspector.get_pk_constraint(history)['constrained_columns']:
+        # a bare history_id column rewritten by pandas
+        history_ids = [row[0] for row in bind.execute(
+            sa.text('SELECT DISTINCT history_id FROM "%s"' % history))]
+        op.drop_table(history)
+        ledger = op.create_table(history,
+            sa.Column('history_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('scan_id', sa.Integer(), nullable=True),
+            sa.Column('history_date', sa.Integer(), nullable=True),
+            sa.Column('loaded_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('history_id'),
+        )
+        op.create_index('ix_%s_scan_id' % history, history, ['scan_id'])
+        if history_ids:
+            op.bulk_insert(ledger, [{'history_id': int(h)} for h in history_ids])
+
+    # Vulnerabilities
+    vulnerabilities = tables['vulnerabilities']
+    if vulnerabilities in existing:
+        convert_findings_table(bind, vulnerabilities)
+    else:
+        create_findings_table(vulnerabilities)
+
+    # LatestVulnerabilities, rebuilt from the typed history
+    latest = tables['latest']
+    if latest in existing:
+        op.drop_table(latest)
+    create_findings_table(latest)
+    op.execute(sa.text("""
+        INSERT INTO "{latest}"
+        SELECT v.* FROM "{table}" v
+        JOIN (SELECT scan_id, MAX(history_date) AS latest
+            FROM "{table}" GROUP BY scan_id) dates
+        ON dates.scan_id = v.scan_id AND v.history_date = dates.latest
+        """.format(latest=latest, table=vulnerabilities)))
+
+    # Fill in the ledger rows converted from the old History table
+    op.execute(sa.text("""
+        UPDATE "{history}" SET
+        scan_id = (SELECT MAX(scan_id) FROM "{table}" v WHERE v.history_id = "{history}".history_id),
+        history_date = (SELECT MAX(history_date) FROM "{table}" v WHERE v.history_id = "{history}".history_id)
+        WHERE scan_id IS NULL
+        """.format(history=history, table=vulnerabilities)))
+
+
+def downgrade():
+    # The untyped tables pandas created can not be restored,
+    # only the indexes this revision added are removed.
+    tables = context.config.attributes['nessus_tables']
+    drop_findings_indexes(tables['vulnerabilities'])
+    drop_findings_indexes(tables['latest'])
@@ -0,0 +1,83 @@
+"""plugins dimension
+
+Moves the plugin text and exploit framework flags out of the findings
+tables into a Plugins table keyed by Plugin ID.
+
+Revision ID: c7d2a9e14b55
+Revises: b41f0c3e7a21
+Create Date: 2026-10-18 13:40:05.118260
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2a9e14b55'
+down_revision = 'b41f0c3e7a21'
+branch_labels = None
+depends_on = None
+
+
+TEXT_COLUMNS = ['Name', 'Synopsis', 'Description', 'Solution', 'See Also']
+BOOLEAN_COLUMNS = ['Metasploit', 'Core Impact', 'CANVAS']
+DATE_COLUMNS = ['Plugin Publication Date']
+
+
+def plugin_columns():
+    return [sa.Column(name, sa.Text(), nullable=True) for name in TEXT_COLUMNS] + \
+        [sa.Column(name, sa.Date(), nullable=True) for name in DATE_COLUMNS] + \
+        [sa.Column(name, sa.Boolean(create_constraint=False), nullable=True) for name in BOOLEAN_COLUMNS]
+
+
+def any_true(column):
+    # MAX() is not defined for booleans on every database
+    return sa.case([(sa.func.max(sa.case([(column == sa.true(), 1)], else_=0)) == 1, sa.true())],
+        else_=sa.false())
+
+
+def upgrade():
+    tables = context.config.attributes['nessus_tables']
+    plugins = tables['plugins']
+
+    op.create_table(plugins,
+        sa.Column('Plugin ID', sa.Integer(), autoincrement=False, nullable=False),
+        *(plugin_columns() + [sa.PrimaryKeyConstraint('Plugin ID')])
+    )
+    op.create_index('ix_%s_publication_date' % plugins, plugins, ['Plugin Publication Date'])
+
+    bind = op.get_bind()
+    findings = sa.Table(tables['vulnerabilities'], sa.MetaData(), autoload_with=bind)
+    names = TEXT_COLUMNS + DATE_COLUMNS + BOOLEAN_COLUMNS
+    select = sa.select([findings.c['Plugin ID']] +
+        [sa.func.max(findings.c[name]) for name in TEXT_COLUMNS + DATE_COLUMNS] +
+        [any_true(findings.c[name]) for name in BOOLEAN_COLUMNS]) \
+        .where(findings.c['Plugin ID'] != None) \
+        .group_by(findings.c['Plugin ID'])
+    target = sa.table(plugins, *[sa.column(name) for name in ['Plugin ID'] + names])
+    op.execute(target.insert().from_select(['Plugin ID'] + names, select))
+
+    for table in [tables['vulnerabilities'], tables['latest']]:
+        op.drop_index('ix_%s_publication_date' % table, table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            for name in names:
+                batch_op.drop_column(name)
+
+
+def downgrade():
+    tables = context.config.attributes['nessus_tables']
+    plugins = tables['plugins']
+    names = TEXT_COLUMNS + DATE_COLUMNS + BOOLEAN_COLUMNS
+
+    for table in [tables['vulnerabilities'], tables['latest']]:
+        with op.batch_alter_table(table) as batch_op:
+            for column in plugin_columns():
+                batch_op.add_column(column)
+        op.create_index('ix_%s_publication_date' % table, table, ['Plugin Publication Date'])
+        assignments = ', '.join(
+            '"{name}" = (SELECT p."{name}" FROM "{plugins}" p WHERE p."Plugin ID" = "{table}"."Plugin ID")'
+            .format(name=name, plugins=plugins, table=table) for name in names)
+        op.execute(sa.text('UPDATE "{table}" SET {assignments}'.format(table=table, assignments=assignments)))
+
+    op.drop_index('ix_%s_publication_date' % plugins, table_name=plugins)
+    op.drop_table(plugins)
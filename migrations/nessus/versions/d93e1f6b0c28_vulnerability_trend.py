@@ -0,0 +1,82 @@
+"""weekly vulnerability trend rollup
+
+Adds the VulnerabilityTrend table behind the dashboard trend charts and
+fills it from the histories already in Vulnerabilities. Ingest keeps it
+up to date from then on.
+
+Revision ID: d93e1f6b0c28
+Revises: c7d2a9e14b55
+Create Date: 2026-10-18 15:02:47.530914
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93e1f6b0c28'
+down_revision = 'c7d2a9e14b55'
+branch_labels = None
+depends_on = None
+
+
+def trend_week(history_date):
+    day = (datetime.utcfromtimestamp(history_date) - timedelta(days=7)).date()
+    return day + timedelta(days=(7 - day.weekday()) % 7)
+
+
+def upgrade():
+    tables = context.config.attributes['nessus_tables']
+    trend = tables['trend']
+    findings = tables['vulnerabilities']
+
+    op.create_table(trend,
+        sa.Column('scan_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('week', sa.Date(), nullable=False),
+        sa.Column('Risk', sa.String(16), nullable=False),
+        sa.Column('scan_name', sa.String(255), nullable=True),
+        sa.Column('history_id', sa.Integer(), nullable=True),
+        sa.Column('history_date', sa.Integer(), nullable=True),
+        sa.Column('findings', sa.Integer(), nullable=True),
+        sa.Column('plugin_hosts', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('scan_id', 'week', 'Risk')
+    )
+    op.create_index('ix_%s_week' % trend, trend, ['week'])
+
+    bind = op.get_bind()
+    counts = bind.execute(sa.text("""
+        SELECT f.scan_id, f.scan_name, f.history_id, f.history_date, f."Risk", f.findings, d.plugin_hosts
+        FROM (
+            SELECT scan_id, MAX(scan_name) AS scan_name, history_id, MAX(history_date) AS history_date,
+            "Risk", COUNT(*) AS findings
+            FROM "{findings}" GROUP BY scan_id, history_id, "Risk"
+        ) f JOIN (
+            SELECT history_id, "Risk", COUNT(*) AS plugin_hosts
+            FROM (SELECT DISTINCT history_id, "Plugin ID", "Host", "Risk" FROM "{findings}") i
+            GROUP BY history_id, "Risk"
+        ) d ON d.history_id = f.history_id AND d."Risk" = f."Risk"
+        ORDER BY f.history_date
+        """.format(findings=findings))).fetchall()
+
+    # the newest history of each scan and week wins, rows are in history_date order
+    rows = {}
+    for scan_id, scan_name, history_id, history_date, risk, n, plugin_hosts in counts:
+        if scan_id is None or history_date is None or risk is None:
+            continue
+        week = trend_week(history_date)
+        rows[(scan_id, week, risk)] = dict(scan_id=scan_id, week=week, Risk=risk, scan_name=scan_name,
+            history_id=history_id, history_date=history_date, findings=n, plugin_hosts=plugin_hosts)
+
+    if rows:
+        target = sa.table(trend, sa.column('scan_id'), sa.column('week', sa.Date()), sa.column('Risk'),
+            sa.column('scan_name'), sa.column('history_id'), sa.column('history_date'),
+            sa.column('findings'), sa.column('plugin_hosts'))
+        op.bulk_insert(target, list(rows.values()))
+
+
+def downgrade():
+    trend = context.config.attributes['nessus_tables']['trend']
+    op.drop_index('ix_%s_week' % trend, table_name=trend)
+    op.drop_table(trend)
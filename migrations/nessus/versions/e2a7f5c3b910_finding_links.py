@@ -0,0 +1,87 @@
+"""MSKB and CVE link tables
+
+Adds FindingMSKB and FindingCVE, one row per KB or CVE of a finding, and
+fills them from the findings already in Vulnerabilities. Ingest adds the
+rows of every history it loads from then on.
+
+Revision ID: e2a7f5c3b910
+Revises: d93e1f6b0c28
+Create Date: 2026-10-18 16:41:09.204117
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7f5c3b910'
+down_revision = 'd93e1f6b0c28'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 50000
+
+
+def split_links(value):
+    if not value:
+        return []
+    links = []
+    for link in value.replace(',', ';').split(';'):
+        link = link.strip()
+        if link and link not in links:
+            links.append(link)
+    return links
+
+
+def create_link_table(name, value):
+    op.create_table(name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('finding_id', sa.Integer(), nullable=True),
+        sa.Column('history_id', sa.Integer(), nullable=True),
+        sa.Column('Host', sa.String(255), nullable=True),
+        sa.Column(value, sa.String(32), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_%s_finding_id' % name, name, ['finding_id'])
+    op.create_index('ix_%s_history_id' % name, name, ['history_id'])
+    op.create_index('ix_%s_%s' % (name, value.lower()), name, [value, 'Host'])
+
+
+def fill_link_table(name, value, findings):
+    bind = op.get_bind()
+    target = sa.table(name, sa.column('finding_id'), sa.column('history_id'),
+        sa.column('Host'), sa.column(value))
+    query = sa.text(
+        'SELECT id, history_id, "Host", "{value}" FROM "{findings}" '
+        'WHERE id > :last AND "{value}" IS NOT NULL ORDER BY id LIMIT {batch}'
+        .format(value=value, findings=findings, batch=BATCH_SIZE))
+    last = 0
+    while True:
+        # read in id ranges, the inserts go through the same connection
+        rows = bind.execute(query, last=last).fetchall()
+        if not rows:
+            break
+        last = rows[-1][0]
+        links = [{'finding_id': finding_id, 'history_id': history_id, 'Host': host, value: link}
+            for finding_id, history_id, host, links in rows for link in split_links(links)]
+        if links:
+            op.bulk_insert(target, links)
+
+
+def upgrade():
+    tables = context.config.attributes['nessus_tables']
+    findings = tables['vulnerabilities']
+
+    create_link_table(tables['mskb'], 'MSKB')
+    create_link_table(tables['cve'], 'CVE')
+    fill_link_table(tables['mskb'], 'MSKB', findings)
+    fill_link_table(tables['cve'], 'CVE', findings)
+
+
+def downgrade():
+    tables = context.config.attributes['nessus_tables']
+    for name, value in ((tables['mskb'], 'MSKB'), (tables['cve'], 'CVE')):
+        op.drop_index('ix_%s_%s' % (name, value.lower()), table_name=name)
+        op.drop_index('ix_%s_history_id' % name, table_name=name)
+        op.drop_index('ix_%s_finding_id' % name, table_name=name)
+        op.drop_table(name)
@@ -0,0 +1,35 @@
+"""dashboard summary
+
+Adds the DashboardSummary table holding the risk card counts of the
+current data version. Ingest writes it, a version without a summary is
+counted on its first read, so there is nothing to fill here.
+
+Revision ID: f4d6a8b2c173
+Revises: e2a7f5c3b910
+Create Date: 2026-10-18 17:26:53.118402
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4d6a8b2c173'
+down_revision = 'e2a7f5c3b910'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    summary = context.config.attributes['nessus_tables']['summary']
+    op.create_table(summary,
+        sa.Column('data_version', sa.String(64), nullable=False),
+        sa.Column('Risk', sa.String(16), nullable=False),
+        sa.Column('plugin_hosts', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('data_version', 'Risk')
+    )
+
+
+def downgrade():
+    op.drop_table(context.config.attributes['nessus_tables']['summary'])
@@ -9,6 +9,13 @@ folder_exclude = settings.NESSUS_FOLDER_EXCLUDE
 scan_exclude = settings.NESSUS_SCAN_EXCLUDE
 nessus_table = settings.OMNIANA_NESSUS_TABLE
 nessus_history_table = settings.OMNIANA_HISTORY_TABLE
+export_workers = settings.NESSUS_EXPORT_WORKERS
+export_batch_size = settings.NESSUS_EXPORT_BATCH_SIZE
+pool_size = settings.NESSUS_HTTP_POOL_SIZE
+retries = settings.NESSUS_HTTP_RETRIES
+use_async = settings.NESSUS_ASYNC
+stream = settings.NESSUS_STREAM_INGEST
+chunk_size = settings.NESSUS_CHUNK_SIZE
 
 database = settings.NESSUS_SQLALCHEMY_PATH
 
@@ -17,4 +24,7 @@ engine = create_engine('sqlite:///'+database, echo=False)
 Batch.run_batch(engine=engine,nessus_server=server,nessus_username=username,
         nessus_password=password,nessus_folder_exclude=folder_exclude,
         nessus_scan_exclude=scan_exclude,nessus_table=nessus_table,
-        nessus_history_table=nessus_history_table)
+        nessus_history_table=nessus_history_table,nessus_export_workers=export_workers,
+        nessus_pool_size=pool_size,nessus_retries=retries,
+        nessus_export_batch_size=export_batch_size,nessus_async=use_async,
+        nessus_stream=stream,nessus_chunk_size=chunk_size)
@@ -0,0 +1,131 @@
+"""
+A scanner stand-in for Batch.run_batch and a Flask app on its database,
+shared by the tests of the Nessus pipeline and views
+"""
+import io
+
+import pandas as pd
+import sqlalchemy as sa
+
+EXPORT_HEADER = ['Plugin ID', 'CVE', 'CVSS', 'Risk', 'Host', 'Protocol', 'Port', 'Name', 'Synopsis',
+    'Description', 'Solution', 'See Also', 'Plugin Output', 'STIG Severity', 'MSKB',
+    'Plugin Publication Date', 'Metasploit', 'Core Impact', 'CANVAS']
+
+
+def export_rows(history_id):
+    """Three findings per host of a history, the info finding is dropped on load"""
+    rows = []
+    for host in range(2 + history_id % 10):
+        rows.append([1000 + host % 2, 'CVE-2020-1', 9.8, 'Critical', '10.0.0.%d' % host, 'tcp', 443, 'Bad',
+            'syn', 'desc', 'sol', 'http://x', 'out', '', 'KB1;KB2', '2020/01/02', 'true', '', 'false'])
+        rows.append([2000, '', '', 'None', '10.0.0.%d' % host, 'tcp', 0, 'Info', 's', 'd', 's', '', 'o',
+            '', '', '2019/01/01', '', '', ''])
+        rows.append([3000, 'CVE-2019-2', 5.0, 'Medium', '10.0.0.%d' % host, 'udp', 53, 'Med', 'syn3',
+            'desc3', 'sol3', '', 'out3', '', '', '2018/06/01', 'false', 'true', ''])
+    return rows
+
+
+class FakeNessus:
+    """
+    Serves the scans of FakeNessus.scans, {scan_id: (name, [(history_id,
+    history_date)], last_modification_date)}, all in folder 5, and records
+    the calls in FakeNessus.calls
+    """
+    scans = {}
+    calls = []
+    failing = set()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_scan_folders(self):
+        return [(5, 'My Scans'), (6, 'Trash')]
+
+    def get_scans(self):
+        FakeNessus.calls.append(('scans',))
+        return [(scan_id, name, 5, modified) for scan_id, (name, histories, modified) in self.scans.items()]
+
+    def get_scan_history_ids(self, scan_id):
+        FakeNessus.calls.append(('details', scan_id))
+        return self.scans[scan_id][1]
+
+    def scans_export_batch(self, exports, **kwargs):
+        for scan_id, history_id in exports:
+            FakeNessus.calls.append(('export', scan_id, history_id))
+            if history_id in self.failing:
+                yield scan_id, history_id, None, Exception('export failed')
+            else:
+                yield scan_id, history_id, history_id, None
+
+    def scans_export_download(self, scan_id, file_id, filename):
+        pd.DataFrame(export_rows(file_id), columns=EXPORT_HEADER).to_csv(filename, index=False)
+        return filename
+
+    def scans_export_stream(self, scan_id, file_id):
+        FakeNessus.calls.append(('stream', scan_id, file_id))
+        body = pd.DataFrame(export_rows(file_id), columns=EXPORT_HEADER).to_csv(index=False)
+        return StreamedExport(body.encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class StreamedExport:
+    """A streaming download, the body is read from raw and closed with the response"""
+
+    def __init__(self, body):
+        self.raw = io.BytesIO(body)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+
+def run_batch(monkeypatch, tmp_path, engine, scans, failing=(), **kwargs):
+    """Run Batch.run_batch against FakeNessus serving scans, return the failed jobs"""
+    from app.utils import nessus
+    monkeypatch.setattr(nessus, 'Nessus', FakeNessus)
+    monkeypatch.setattr(FakeNessus, 'scans', scans)
+    monkeypatch.setattr(FakeNessus, 'calls', [])
+    monkeypatch.setattr(FakeNessus, 'failing', set(failing))
+    arguments = dict(csv_path=str(tmp_path / 'csv') + '/', engine=engine, nessus_server='https://nessus.test',
+        nessus_username='user', nessus_password='password', nessus_folder_exclude=['Trash'],
+        nessus_scan_exclude=['Excluded'], nessus_table='Vulnerabilities', nessus_history_table='History',
+        nessus_export_workers=1, nessus_pool_size=1, nessus_retries=0, nessus_export_batch_size=5,
+        nessus_async=False, nessus_stream=False, nessus_chunk_size=4)
+    arguments.update(kwargs)
+    return nessus.Batch.run_batch(**arguments)
+
+
+def make_app(tmp_path, **config):
+    """A Flask app on an sqlite Nessus database in tmp_path"""
+    from app import create_app
+    settings = dict(TESTING=True, SECRET_KEY='x' * 40, WTF_CSRF_ENABLED=False, CACHE_TYPE='memory',
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'app.sqlite'),
+        SQLALCHEMY_BINDS={'nessus_db': 'sqlite:///' + str(tmp_path / 'nessus.sqlite')},
+        NESSUS_SQLALCHEMY_BINDS='nessus_db', OMNIANA_LATEST_DATASET_PATH=False, OMNIANA_SNAPSHOT_PATH=False)
+    settings.update(config)
+    return create_app(settings)
+
+
+def nessus_engine(tmp_path):
+    return sa.create_engine('sqlite:///' + str(tmp_path / 'nessus.sqlite'))
+
+
+class LoggedIn:
+    is_authenticated = True
+
+
+def make_client(monkeypatch, tmp_path, scans, **config):
+    """
+    A test client of make_app() for a logged in user, its database loaded
+    with scans by run_batch
+    """
+    app = make_app(tmp_path, **config)
+    with app.app_context():
+        run_batch(monkeypatch, tmp_path, nessus_engine(tmp_path), scans)
+    monkeypatch.setattr('app.views.nessus_views.current_user', LoggedIn())
+    return app.test_client()
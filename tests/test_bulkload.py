@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from app.utils import bulkload
+
+
+def frame():
+    return pd.DataFrame({
+        'Host': ['10.0.0.1', '', None],
+        'Port': pd.array([443, None, 80], dtype='Int64'),
+        'CVSS': [9.8, np.nan, 5.0],
+    })
+
+
+def test_load_sqlite(tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'bulk.sqlite'))
+    rows, seconds = bulkload.load_dataframe(frame(), engine, 'Findings')
+    assert rows == 3
+    rows, seconds = bulkload.load_dataframe(frame(), engine, 'Findings')
+    with engine.connect() as connection:
+        stored = connection.execute(sa.text('SELECT "Host", "Port", "CVSS" FROM "Findings"')).fetchall()
+    assert [tuple(row) for row in stored] == [('10.0.0.1', 443, 9.8), ('', None, None), (None, 80, 5.0)] * 2
+
+
+def test_load_sqlite_in_callers_transaction(tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'bulk.sqlite'))
+    bulkload.load_dataframe(frame().head(1), engine, 'Findings')
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        bulkload.load_dataframe(frame(), connection, 'Findings')
+        transaction.rollback()
+        assert connection.execute(sa.text('SELECT COUNT(*) FROM "Findings"')).scalar() == 1
+
+
+class FakeCursor:
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def copy_expert(self, sql, buffer):
+        self.calls.append((sql, buffer.read()))
+
+    def close(self):
+        pass
+
+
+class FakePostgresConnection:
+    """Just enough of a Connection for the postgresql loader"""
+
+    def __init__(self):
+        self.calls = []
+        self.dialect = type('Dialect', (), {'name': 'postgresql', 'has_table': lambda self, c, t: True})()
+        self.connection = self
+
+    def cursor(self):
+        return FakeCursor(self.calls)
+
+
+def test_load_postgres_copy_keeps_empty_strings():
+    connection = FakePostgresConnection()
+    rows, seconds = bulkload.load_dataframe(frame(), connection, 'Findings')
+    assert rows == 3
+    [(sql, data)] = connection.calls
+    assert sql == 'COPY "Findings" ("Host", "Port", "CVSS") FROM STDIN WITH CSV NULL \'\\N\''
+    # an empty field is an empty string, \N is NULL
+    assert data.splitlines() == ['10.0.0.1,443,9.8', ',\\N,\\N', '\\N,80,5.0']
@@ -0,0 +1,63 @@
+import json
+import uuid
+
+import pytest
+
+import app as application
+from app.utils import cache
+from tests.nessus_fakes import make_app, make_client, nessus_engine, run_batch
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path)
+    with app.app_context():
+        yield app
+
+
+def test_make_key():
+    assert cache.make_key(7) == '7'
+    assert cache.make_key(7, {}) == '7'
+    # the same parameters in any order are the same entry
+    assert cache.make_key(7, {'risk': 'High', 'cvss': 5}) == cache.make_key(7, {'cvss': 5, 'risk': 'High'}) \
+        == '7?cvss=5&risk=High'
+    assert cache.make_key(8, {'cvss': 5}) != cache.make_key(7, {'cvss': 5})
+
+
+def test_get_or_create(app):
+    namespace = 'test-' + uuid.uuid4().hex
+    created = []
+
+    def create():
+        created.append(True)
+        return 'value %d' % len(created)
+
+    stats = cache.cache_stats()
+    assert cache.get_or_create(namespace, '7', create) == 'value 1'
+    assert cache.get_or_create(namespace, '7', create) == 'value 1'
+    assert cache.get_or_create(namespace, '8', create) == 'value 2'
+    assert cache.get_or_create(namespace + '-other', '7', create) == 'value 3'
+
+    after = cache.cache_stats()
+    assert (after['hits'] - stats['hits'], after['misses'] - stats['misses']) == (1, 3)
+    assert 0 < after['hit_ratio'] < 1
+
+
+def test_get_or_create_without_cache(app, monkeypatch):
+    monkeypatch.setattr(application, 'cache', None)
+    values = iter(['first', 'second'])
+    assert cache.get_or_create('test', '7', lambda: next(values)) == 'first'
+    assert cache.get_or_create('test', '7', lambda: next(values)) == 'second'
+
+
+def test_new_history_is_a_new_entry(monkeypatch, tmp_path):
+    client = make_client(monkeypatch, tmp_path, {1: ('Scan A', [(11, 1600000000)], 1600000000)})
+    rows = lambda: len(json.loads(client.get('/nessus-breakdown-data').get_data()))
+    assert rows() == rows() == 6
+
+    # the data version moves on, the entry of the old one is not read again
+    run_batch(monkeypatch, tmp_path, nessus_engine(tmp_path),
+        {1: ('Scan A', [(11, 1600000000), (12, 1600600000)], 1600600000)})
+    stats = cache.cache_stats()
+    assert rows() == 8
+    assert cache.cache_stats()['misses'] == stats['misses'] + 1
@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app.utils import datatables
+from tests.nessus_fakes import make_client
+
+
+def test_parse_request():
+    args = MultiDict({
+        'draw': '3', 'start': '20', 'length': '25', 'search[value]': ' 10.0.0 ',
+        'columns[0][data]': 'Plugin ID', 'columns[1][data]': 'Risk', 'columns[2][data]': 'Unknown',
+        'columns[1][orderable]': 'true',
+        'order[0][column]': '1', 'order[0][dir]': 'desc',
+        'order[1][column]': '2', 'order[1][dir]': 'asc',
+        'order[2][column]': '0', 'order[2][dir]': 'asc',
+    })
+    page = datatables.parse_request(args, ['Plugin ID', 'Risk'])
+    assert page == datatables.PageRequest(3, 20, 25, [('Risk', False), ('Plugin ID', True)], '10.0.0')
+    assert datatables.is_server_side(args)
+
+
+def test_parse_request_defaults_and_bounds():
+    page = datatables.parse_request(MultiDict(), ['Plugin ID'])
+    assert page == datatables.PageRequest(0, 0, 10, [], '')
+
+    args = MultiDict({'draw': '1', 'start': '-5', 'length': '-1',
+        'columns[0][data]': 'Plugin ID', 'columns[0][orderable]': 'false', 'order[0][column]': '0'})
+    page = datatables.parse_request(args, ['Plugin ID'])
+    assert page.start == 0
+    assert page.length == datatables.MAX_LENGTH
+    assert page.order == []
+
+    page = datatables.parse_request(MultiDict({'length': '100000'}), ['Plugin ID'])
+    assert page.length == datatables.MAX_LENGTH
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    # 12 findings on hosts 10.0.0.0 to 10.0.0.5
+    return make_client(monkeypatch, tmp_path, {1: ('Scan A', [(14, 1600000000)], 1600000000)})
+
+
+def test_server_side_page(client):
+    response = client.get('/nessus-breakdown-data', query_string={
+        'draw': '4', 'start': '2', 'length': '3', 'search[value]': 'Medium',
+        'columns[0][data]': 'Host', 'columns[0][orderable]': 'true',
+        'order[0][column]': '0', 'order[0][dir]': 'desc'})
+    body = json.loads(response.get_data())
+    assert (body['draw'], body['recordsTotal'], body['recordsFiltered']) == (4, 12, 6)
+    assert [(row['Host'], row['Risk']) for row in body['data']] == [
+        ('10.0.0.3', 'Medium'), ('10.0.0.2', 'Medium'), ('10.0.0.1', 'Medium')]
+
+
+def test_export_is_the_whole_filtered_table(client):
+    # what the Excel button downloads, every row matching the search box
+    response = client.get('/nessus-breakdown-data?format=csv&search=Medium')
+    assert response.headers['Content-Disposition'] == 'attachment; filename=nessus-breakdown.csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert sorted(row['Host'] for row in rows) == ['10.0.0.%d' % host for host in range(6)]
+    assert {row['Risk'] for row in rows} == {'Medium'}
@@ -0,0 +1,66 @@
+import gzip
+import json
+
+import pytest
+from flask import Response
+
+from app.utils import http_cache
+from tests.nessus_fakes import make_client
+
+
+def test_compress():
+    rows = [{'Plugin ID': i, 'Host': '10.0.0.%d' % (i % 255)} for i in range(200)]
+    body = json.dumps(rows).encode('utf-8')
+    response = http_cache.compress(Response(body, mimetype='application/json'), 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.get_data()) == body
+
+
+def test_compress_skips():
+    small = http_cache.compress(Response(b'[]', mimetype='application/json'), 'gzip')
+    assert 'Content-Encoding' not in small.headers
+    assert small.get_data() == b'[]'
+
+    image = http_cache.compress(Response(b'x' * 4096, mimetype='image/png'), 'gzip')
+    assert 'Content-Encoding' not in image.headers
+
+    plain = http_cache.compress(Response(b'x' * 4096, mimetype='application/json'), None)
+    assert 'Content-Encoding' not in plain.headers
+
+    not_modified = http_cache.compress(Response(status=304, mimetype='application/json'), 'gzip')
+    assert 'Content-Encoding' not in not_modified.headers
+
+
+def test_compress_streamed():
+    chunks = [b'[', b','.join(b'{"Plugin ID":%d}' % i for i in range(100)), b']']
+    response = http_cache.compress(Response(iter(chunks), mimetype='application/json'), 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(b''.join(response.response)) == b''.join(chunks)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    return make_client(monkeypatch, tmp_path, {1: ('Scan A', [(11, 1600000000)], 1600000000)})
+
+
+@pytest.mark.parametrize('url, encoding', [
+    ('/nessus-breakdown-data', 'gzip'),
+    # nothing matches, the body is too small to compress
+    ('/nessus-breakdown-plugin-data?cve=CVE-1999-0', None),
+])
+def test_etag_names_the_content_encoding(client, url, encoding):
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    etag, weak = response.get_etag()
+    assert response.headers.get('Content-Encoding') == encoding
+    assert etag.endswith('-gzip') == (encoding == 'gzip')
+
+    again = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"%s"' % etag})
+    assert again.status_code == 304
+    assert again.get_etag() == (etag, False)
+
+    # the plain representation is another ETag
+    plain = client.get(url, headers={'If-None-Match': '"%s"' % etag})
+    assert plain.status_code == (304 if encoding is None else 200)
+    assert 'Content-Encoding' not in plain.headers
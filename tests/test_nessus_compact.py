@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from app.utils.nessus import Plots
+
+
+def findings():
+    return pd.DataFrame({
+        'Plugin ID': [1000, 1000, 2000, 3000],
+        'CVSS': [9.8, 5.0, 7.5, np.nan],
+        'Risk': ['Critical', 'Medium', 'High', 'Low'],
+        'Host': ['10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.1'],
+        'Port': [443, 443, np.nan, 80],
+        'Synopsis': ['a', 'b', 'c', 'd'],
+    })
+
+
+def test_compact_frame_dtypes():
+    df = Plots.compact_frame(findings())
+    assert df['Plugin ID'].dtype == 'int32'
+    assert df['CVSS'].dtype == 'float32'
+    assert df['Host'].dtype == 'category'
+    assert df['Risk'].cat.ordered
+    # blanks keep the column as it was, Synopsis is not in COMPACT_DTYPES
+    assert df['Port'].dtype == 'float64'
+    assert df['Synopsis'].dtype == object
+
+
+def test_compact_frame_orders_risk_by_severity():
+    df = Plots.compact_frame(findings())
+    assert list(df.sort_values('Risk', ascending=False)['Risk']) == ['Critical', 'High', 'Medium', 'Low']
+    # keep each Plugin ID/Host pair at its most severe risk
+    pairs = df.sort_values('Risk', ascending=False).drop_duplicates(subset=['Plugin ID', 'Host'])
+    assert sorted(pairs['Risk'].astype(str)) == ['Critical', 'High', 'Low']
@@ -0,0 +1,62 @@
+"""
+The shared latest dataset is published by Batch.run_batch only, readers
+fall back to the database until it is there
+"""
+import os
+
+import pytest
+import sqlalchemy as sa
+
+from app import settings
+from app.utils.nessus import LATEST_COLUMNS, Plots
+from tests.nessus_fakes import nessus_engine, run_batch
+
+pytest.importorskip('pyarrow')
+
+SCANS = {1: ('Scan A', [(11, 1600000000)], 1600000000)}
+
+
+@pytest.fixture
+def dataset_path(monkeypatch, tmp_path):
+    path = str(tmp_path / 'latest')
+    monkeypatch.setattr(settings, 'OMNIANA_LATEST_DATASET_PATH', path)
+    monkeypatch.setattr(settings, 'OMNIANA_SNAPSHOT_PATH', False)
+    return path
+
+
+def rows(df):
+    return sorted(map(tuple, df[['Host', 'Plugin ID', 'Port']].values.tolist()))
+
+
+def test_readers_never_publish(monkeypatch, tmp_path, dataset_path):
+    engine = nessus_engine(tmp_path)
+    monkeypatch.setattr(settings, 'OMNIANA_LATEST_DATASET_PATH', False)
+    run_batch(monkeypatch, tmp_path, engine, SCANS)
+    monkeypatch.setattr(settings, 'OMNIANA_LATEST_DATASET_PATH', dataset_path)
+
+    assert Plots.get_latest_dataset(engine) is None
+    assert len(Plots.get_latest_vulnerabilities_data(engine=engine)) == 6
+    assert sum(len(batch) for batch in Plots.iter_latest_vulnerabilities(engine=engine)) == 6
+    assert not os.path.exists(dataset_path)
+
+    # the next batch run publishes it even with nothing new to load
+    run_batch(monkeypatch, tmp_path, engine, SCANS)
+    assert Plots.get_latest_dataset(engine) is not None
+
+
+def test_batch_publishes(monkeypatch, tmp_path, dataset_path):
+    engine = nessus_engine(tmp_path)
+    run_batch(monkeypatch, tmp_path, engine, SCANS)
+    dataset = Plots.get_latest_dataset(engine)
+    assert dataset is not None
+    assert dataset.num_rows == 6
+    shared = Plots.get_latest_vulnerabilities_data(engine=engine)
+    database = Plots.get_latest_vulnerabilities_data(engine=engine, where=[sa.true()])
+    assert rows(shared) == rows(database)
+    assert list(shared.columns) == LATEST_COLUMNS
+
+
+def test_relative_path_is_refused(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'OMNIANA_LATEST_DATASET_PATH', './data/latest/')
+    with pytest.raises(ValueError, match='absolute'):
+        Plots.get_latest_vulnerabilities_data(engine=nessus_engine(tmp_path))
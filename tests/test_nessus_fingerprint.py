@@ -0,0 +1,63 @@
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import sqlalchemy as sa
+
+from app.models import nessus_models
+from app.utils.nessus import Batch
+from tests.nessus_fakes import nessus_engine, run_batch
+
+
+def findings():
+    return pd.DataFrame({'Plugin ID': [1000, 1000, 1000, 2000, None], 'Host': ['10.0.0.1', '10.0.0.1', '10.0.0.2',
+        '10.0.0.1', '10.0.0.1'], 'Port': pd.array([443, 80, 443, None, 443], dtype='Int64')})
+
+
+def test_fingerprint_is_stable_across_processes():
+    script = ('import pandas as pd; from app.utils.nessus import Batch; '
+        'print(list(Batch.fingerprint(pd.DataFrame({"Plugin ID": [1000], "Host": ["10.0.0.1"], "Port": [443]}))))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed, SECRET_KEY='x' * 40)
+        outputs.add(subprocess.check_output([sys.executable, '-c', script], cwd=root, env=env).strip())
+    assert outputs == {str([int(Batch.fingerprint(findings()[:1])[0])]).encode()}
+
+
+def test_fingerprint_ignores_dtypes():
+    df = findings()
+    fingerprints = Batch.fingerprint(df)
+    assert fingerprints.dtype == 'int64'
+    assert len(set(fingerprints)) == len(df)
+    # read back from the database the integers may come as floats or plain ints
+    as_read = df.astype({'Plugin ID': 'float64', 'Port': 'float64'})
+    assert list(Batch.fingerprint(as_read)) == list(fingerprints)
+    other = pd.DataFrame({'Plugin ID': [1000], 'Host': ['10.0.0.1'], 'Port': [443], 'Risk': ['High']})
+    assert Batch.fingerprint(other)[0] == fingerprints[0]
+
+
+def test_fingerprint_is_unique():
+    df = pd.DataFrame([(plugin_id, '10.0.%d.%d' % (host // 256, host % 256), port)
+        for plugin_id in range(10000, 10050) for host in range(40) for port in (0, 22, 80, 443, 8443)],
+        columns=['Plugin ID', 'Host', 'Port'])
+    assert len(set(Batch.fingerprint(df))) == len(df)
+
+
+def test_migration_hash_matches():
+    path = os.path.join(nessus_models.MIGRATIONS_PATH, 'versions', '1b8e4f2a6d90_finding_fingerprint.py')
+    spec = importlib.util.spec_from_file_location('finding_fingerprint', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert list(module.fingerprint(findings())) == list(Batch.fingerprint(findings()))
+
+
+def test_fingerprints_are_stored(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    run_batch(monkeypatch, tmp_path, engine, {1: ('Scan A', [(11, 1600000000)], 1600000000)})
+    for table in ('Vulnerabilities', 'LatestVulnerabilities', 'FindingLifecycle'):
+        df = pd.read_sql_query(sa.text('SELECT "Plugin ID", "Host", "Port", fingerprint FROM "%s"' % table), engine)
+        assert len(df) == 6
+        assert list(df['fingerprint']) == list(Batch.fingerprint(df))
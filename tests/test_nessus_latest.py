@@ -0,0 +1,58 @@
+"""
+Batch.refresh_latest keeps LatestVulnerabilities at the newest loaded
+history of every scan, whatever order the histories load in.
+"""
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from app.models import nessus_models
+from app.utils.nessus import Batch, ExportJob
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'nessus.sqlite'))
+    nessus_models.upgrade_schema(engine)
+    return engine
+
+
+def load(engine, scan_id, history_id, history_date, hosts):
+    job = ExportJob(scan_id, 'Scan %d' % scan_id, history_id, history_date, None)
+    df = pd.DataFrame({'Plugin ID': 1000, 'Risk': 'High', 'Host': hosts, 'Port': 443, 'Protocol': 'tcp'})
+    df['scan_id'] = scan_id
+    df['scan_name'] = job.scan_name
+    df['history_id'] = history_id
+    df['history_date'] = history_date
+    with engine.begin() as connection:
+        Batch.load_df_database(df, connection, 'Vulnerabilities')
+        Batch.record_history(connection, 'History', job)
+        return Batch.refresh_latest(connection, 'Vulnerabilities', 'LatestVulnerabilities', 'History', job)
+
+
+def latest(engine):
+    with engine.connect() as connection:
+        return sorted(tuple(row) for row in connection.execute(sa.text(
+            'SELECT scan_id, history_id, "Host", "Port", "Protocol" FROM "LatestVulnerabilities"')))
+
+
+def test_newest_history_wins(engine):
+    assert load(engine, 1, 11, 1600000000, ['10.0.0.1', '10.0.0.2'])
+    assert load(engine, 2, 21, 1600000000, ['10.0.0.9'])
+    assert load(engine, 1, 12, 1600600000, ['10.0.0.3'])
+    # an older history loaded late leaves the newer one in place
+    assert not load(engine, 1, 10, 1599000000, ['10.0.0.4'])
+    assert latest(engine) == [(1, 12, '10.0.0.3', 443, 'tcp'), (2, 21, '10.0.0.9', 443, 'tcp')]
+
+
+def test_columns_are_matched_by_name(engine):
+    # the same columns as Vulnerabilities in another order, as an ALTER could leave them
+    table = nessus_models.latest_table()
+    columns = list(reversed([column.name for column in table.c]))
+    with engine.begin() as connection:
+        connection.execute(sa.text('DROP TABLE "LatestVulnerabilities"'))
+        connection.execute(sa.text('CREATE TABLE "LatestVulnerabilities" (%s)' % ', '.join(
+            '"%s" %s' % (name, table.c[name].type.compile(dialect=engine.dialect)) for name in columns)))
+
+    assert load(engine, 1, 11, 1600000000, ['10.0.0.1'])
+    assert latest(engine) == [(1, 11, '10.0.0.1', 443, 'tcp')]
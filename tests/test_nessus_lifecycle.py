@@ -0,0 +1,128 @@
+"""
+Batch.refresh_lifecycle folds histories into FindingLifecycle as they
+load, in any order. Whatever the order, the intervals must be the ones
+the finding_lifecycle migration rebuilds by replaying every history of
+the scan in date order.
+"""
+import importlib.util
+import os
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from app.models import nessus_models
+from app.utils.nessus import Batch, ExportJob
+
+
+def load_migration_replay():
+    path = os.path.join(nessus_models.MIGRATIONS_PATH, 'versions', '0a5c7e9d3b61_finding_lifecycle.py')
+    spec = importlib.util.spec_from_file_location('finding_lifecycle', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.replay
+
+replay = load_migration_replay()
+
+SCAN_ID = 7
+DAY = 86400
+
+# (history_id, history_date, {(Host, Plugin ID, Port): Risk}), in date order.
+# Findings are fixed, come back, change risk and appear late.
+HISTORIES = [
+    (101, 1600000000, {('10.0.0.1', 1000, 443): 'High', ('10.0.0.2', 1000, 443): 'High',
+        ('10.0.0.3', 2000, 0): 'Low'}),
+    (102, 1600000000 + DAY, {('10.0.0.1', 1000, 443): 'Critical', ('10.0.0.3', 2000, 0): 'Low'}),
+    (103, 1600000000 + 2 * DAY, {('10.0.0.1', 1000, 443): 'Critical', ('10.0.0.2', 1000, 443): 'High'}),
+    (104, 1600000000 + 3 * DAY, {('10.0.0.2', 1000, 443): 'Medium', ('10.0.0.4', 3000, 22): 'High'}),
+    (105, 1600000000 + 4 * DAY, {('10.0.0.1', 1000, 443): 'High', ('10.0.0.4', 3000, 22): 'High'}),
+    (106, 1600000000 + 5 * DAY, {('10.0.0.1', 1000, 443): 'High', ('10.0.0.3', 2000, 0): 'Low'}),
+]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'nessus.sqlite'))
+    nessus_models.upgrade_schema(engine)
+    return engine
+
+
+def load(engine, history, duplicates=()):
+    """
+    Insert a history's findings, and duplicates (Host, Plugin ID, Port,
+    Risk) of them, and fold it in, as Batch.run_batch does
+    """
+    history_id, history_date, present = history
+    job = ExportJob(SCAN_ID, 'Scan', history_id, history_date, None)
+    df = pd.DataFrame([{'Host': host, 'Plugin ID': plugin_id, 'Port': port, 'Risk': risk}
+        for (host, plugin_id, port), risk in present.items()] +
+        [{'Host': host, 'Plugin ID': plugin_id, 'Port': port, 'Risk': risk}
+        for host, plugin_id, port, risk in duplicates])
+    df['scan_id'] = SCAN_ID
+    df['scan_name'] = 'Scan'
+    df['history_id'] = history_id
+    df['history_date'] = history_date
+    df['fingerprint'] = Batch.fingerprint(df)
+    with engine.begin() as connection:
+        Batch.load_df_database(df, connection, 'Vulnerabilities')
+        Batch.record_history(connection, 'History', job)
+        Batch.refresh_lifecycle(connection, 'Vulnerabilities', 'FindingLifecycle', 'History', job)
+
+
+def lifecycle(engine):
+    table = nessus_models.lifecycle_table()
+    with engine.connect() as connection:
+        rows = connection.execute(sa.select([table.c['Host'], table.c['Plugin ID'], table.c['Port'],
+            table.c['Risk'], table.c.first_seen, table.c.last_seen, table.c.fixed_at])).fetchall()
+    return sorted(tuple(row) for row in rows)
+
+
+def replayed(histories):
+    intervals = replay([(date, present) for _, date, present in sorted(histories, key=lambda h: h[1])])
+    return sorted((i['Host'], i['Plugin ID'], i['Port'], i['Risk'], i['first_seen'], i['last_seen'],
+        i['fixed_at']) for i in intervals)
+
+
+@pytest.mark.parametrize('order', [
+    [0, 1, 2, 3, 4, 5],
+    [5, 4, 3, 2, 1, 0],
+    # the ends first, then into the middle of the gap between them
+    [0, 5, 2, 3, 1, 4],
+], ids=['in_order', 'reversed', 'gap'])
+def test_lifecycle_matches_replay(engine, order):
+    loaded = []
+    for index in order:
+        loaded.append(HISTORIES[index])
+        load(engine, HISTORIES[index])
+        assert lifecycle(engine) == replayed(loaded)
+
+
+def test_lifecycle_intervals(engine):
+    for history in HISTORIES:
+        load(engine, history)
+    day = lambda n: 1600000000 + n * DAY
+    intervals = [row for row in lifecycle(engine) if row[0] == '10.0.0.2']
+    # seen, fixed, back for two histories with its last risk, fixed again
+    assert intervals == [
+        ('10.0.0.2', 1000, 443, 'High', day(0), day(0), day(1)),
+        ('10.0.0.2', 1000, 443, 'Medium', day(2), day(3), day(4)),
+    ]
+    # back after being fixed, the new interval is still open
+    assert [row for row in lifecycle(engine) if row[0] == '10.0.0.1'] == [
+        ('10.0.0.1', 1000, 443, 'Critical', day(0), day(2), day(3)),
+        ('10.0.0.1', 1000, 443, 'High', day(4), day(5), None),
+    ]
+
+
+def test_lifecycle_keeps_most_severe_risk(engine):
+    # alphabetically Low comes after Critical
+    finding = ('10.0.0.1', 1000, 443)
+    day = lambda n: 1600000000 + n * DAY
+    load(engine, (101, day(0), {finding: 'Critical'}), duplicates=[finding + ('Low',)])
+    load(engine, (103, day(2), {finding: 'Medium'}), duplicates=[finding + ('High',)])
+    assert lifecycle(engine) == [finding + ('High', day(0), day(2), None)]
+
+    # the earlier part of the split takes the risk of the history before
+    load(engine, (102, day(1), {('10.0.0.2', 1000, 443): 'Low'}))
+    assert [row for row in lifecycle(engine) if row[0] == '10.0.0.1'] == [finding + ('Critical', day(0), day(0), day(1)),
+        finding + ('High', day(2), day(2), None)]
@@ -0,0 +1,74 @@
+"""
+The Nessus bind migrations convert the untyped tables that pandas
+to_sql created before they existed.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from app.models import nessus_models
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return sa.create_engine('sqlite:///' + str(tmp_path / 'nessus.sqlite'))
+
+
+def write_pandas_tables(engine):
+    """Vulnerabilities and History as the pre-migration ingest wrote them"""
+    df = pd.DataFrame({
+        'Plugin ID': [4000, 4000, 5000, 6000],
+        'CVE': ['CVE-2020-1', 'CVE-2020-1', None, None],
+        'CVSS': [9.8, 9.8, 5.0, np.nan],
+        'Risk': ['Critical', 'Critical', 'Medium', 'Low'],
+        'Host': ['10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.3'],
+        'Protocol': ['tcp', 'tcp', 'tcp', 'udp'],
+        'Port': [443, 443, 80, 161],
+        'Name': ['Plugin 4000', 'Plugin 4000', 'Plugin 5000', 'Plugin 6000'],
+        'Synopsis': ['syn', 'syn', 'syn', 'syn'],
+        'Description': ['desc', 'desc', 'desc', 'desc'],
+        'Solution': ['fix', 'fix', 'fix', 'fix'],
+        'See Also': [None, None, None, None],
+        'Plugin Output': ['out', 'out', 'out', 'out'],
+        'Plugin Publication Date': ['2020/04/14', '2020/04/14', '2019/01/02', None],
+        # a blank in the export makes read_csv give floats, stored as REAL 1.0
+        'Metasploit': [1.0, 1.0, np.nan, np.nan],
+        'Core Impact': [1.0, 1.0, 0.0, np.nan],
+        'CANVAS': ['true', 'true', 'false', None],
+        'STIG Severity': [None, None, None, None],
+        'scan_id': [1, 1, 1, 2],
+        'scan_name': ['Scan A', 'Scan A', 'Scan A', 'Scan B'],
+        'history_id': [11, 11, 11, 21],
+        'history_date': [1600000000, 1600000000, 1600000000, 1600003600],
+    })
+    df.to_sql('Vulnerabilities', con=engine, index=False)
+    pd.DataFrame({'history_id': [11, 21]}).to_sql('History', con=engine, index=False)
+
+
+def test_convert_pandas_tables(engine):
+    write_pandas_tables(engine)
+    with engine.connect() as connection:
+        stored = connection.execute(sa.text(
+            'SELECT typeof("Core Impact") FROM "Vulnerabilities" WHERE "Plugin ID" = 4000')).scalar()
+    assert stored == 'real'
+
+    nessus_models.upgrade_schema(engine)
+
+    plugins = nessus_models.plugins_table()
+    with engine.connect() as connection:
+        flags = {row[0]: tuple(row[1:]) for row in connection.execute(sa.select([plugins.c['Plugin ID'],
+            plugins.c['Metasploit'], plugins.c['Core Impact'], plugins.c['CANVAS']]))}
+        dates = dict(connection.execute(sa.select([plugins.c['Plugin ID'],
+            plugins.c['Plugin Publication Date']])).fetchall())
+        ledger = connection.execute(sa.text(
+            'SELECT history_id, scan_id, history_date FROM "History" ORDER BY history_id')).fetchall()
+        latest = connection.execute(sa.text('SELECT COUNT(*) FROM "LatestVulnerabilities"')).scalar()
+        ports = [row[0] for row in connection.execute(sa.text('SELECT "Port" FROM "Vulnerabilities"'))]
+
+    assert flags == {4000: (True, True, True), 5000: (False, False, False), 6000: (False, False, False)}
+    assert str(dates[4000]) == '2020-04-14'
+    assert dates[6000] is None
+    assert [tuple(row) for row in ledger] == [(11, 1, 1600000000), (21, 2, 1600003600)]
+    assert latest == 4
+    assert sorted(ports) == [80, 161, 443, 443]
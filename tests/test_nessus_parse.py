@@ -0,0 +1,103 @@
+import datetime
+import os
+
+import pandas as pd
+import sqlalchemy as sa
+
+from app.utils.nessus import Batch, EXPORT_DTYPES, ExportJob
+from tests.nessus_fakes import FakeNessus, StreamedExport, nessus_engine, run_batch
+
+EXPORT_HEADER = ['Plugin ID', 'CVE', 'CVSS', 'Risk', 'Host', 'Protocol', 'Port', 'Name', 'Synopsis',
+    'Description', 'Solution', 'See Also', 'Plugin Output', 'STIG Severity', 'MSKB',
+    'Plugin Publication Date', 'Metasploit', 'Core Impact', 'CANVAS']
+
+
+def write_export(path, rows):
+    pd.DataFrame(rows, columns=EXPORT_HEADER).to_csv(path, index=False)
+    return str(path)
+
+
+def export_rows():
+    return [
+        [1000, 'CVE-2020-1', 9.8, 'Critical', '10.0.0.1', 'tcp', 443, 'Bad', 'syn', 'desc', 'fix', '', 'out',
+            'I', 'KB1', '2020/01/02', 'true', '', 'false'],
+        [2000, '', '', 'None', '10.0.0.1', 'tcp', 0, 'Info', 's', 'd', 's', '', 'o', '', '', '2019/01/01',
+            '', '', ''],
+        # a blank Port must not lose the history
+        [3000, '', 5.0, 'Medium', '10.0.0.2', 'udp', '', 'Med', 'syn', 'desc', 'fix', '', 'out', '', '',
+            'not a date', 'false', 'true', ''],
+        [2000, '', '', 'None', '10.0.0.2', 'tcp', 0, 'Info', 's', 'd', 's', '', 'o', '', '', '2019/01/01',
+            '', '', ''],
+        [1000, 'CVE-2020-1', 9.8, 'Critical', '10.0.0.3', 'tcp', 443, 'Bad', 'syn', 'desc', 'fix', '', 'out',
+            'I', 'KB1', '2020/01/02', 'true', '', 'false'],
+    ]
+
+
+def test_transform_chunks(tmp_path, capsys):
+    path = write_export(tmp_path / 'export.csv', export_rows())
+    chunks = list(Batch.transform_chunks(path, 5, 'Scan', 51, 1600000000, chunk_size=2))
+    df = pd.concat(chunks, ignore_index=True)
+
+    # None risk rows are dropped chunk by chunk, unused columns never parsed
+    assert all(len(chunk) <= 2 for chunk in chunks)
+    assert list(df['Plugin ID']) == [1000, 3000, 1000]
+    assert 'STIG Severity' not in df.columns
+    assert set(EXPORT_DTYPES) <= set(df.columns)
+    assert df['Plugin ID'].dtype == 'int64'
+    assert df['Port'].isnull().tolist() == [False, True, False]
+    assert df['CVSS'].dtype == 'float64'
+
+    assert df['Metasploit'].tolist() == [True, False, True]
+    assert df['Core Impact'].tolist() == [False, True, False]
+    assert df['Plugin Publication Date'].tolist()[0] == datetime.date(2020, 1, 2)
+    assert pd.isnull(df['Plugin Publication Date'].tolist()[1])
+    assert set(df['scan_id']) == {5} and set(df['history_id']) == {51}
+    assert df['fingerprint'].notnull().all()
+
+    assert 'kept 3/5 rows' in capsys.readouterr().out
+
+
+def test_transform_chunks_only_info(tmp_path):
+    rows = [row for row in export_rows() if row[3] == 'None']
+    path = write_export(tmp_path / 'export.csv', rows)
+    assert list(Batch.transform_chunks(path, 5, 'Scan', 51, 1600000000, chunk_size=2)) == []
+
+
+def test_run_export_job_streams(tmp_path):
+    body = pd.DataFrame(export_rows(), columns=EXPORT_HEADER).to_csv(index=False).encode('utf-8')
+    response = StreamedExport(body)
+
+    class Streaming:
+        def scans_export_stream(self, scan_id, file_id):
+            assert (scan_id, file_id) == (5, 510)
+            return response
+
+    loaded = []
+
+    def load(job, chunks):
+        for df in chunks:
+            # parsed while the response is open
+            assert not response.closed
+            loaded.append(df)
+
+    job = ExportJob(5, 'Scan', 51, 1600000000, str(tmp_path / 'never.csv'))
+    assert Batch.run_export_job(Streaming(), job, 510, load, stream=True, chunk_size=2) == job
+    assert [len(df) for df in loaded] == [1, 1, 1]
+    assert response.closed
+    assert not os.path.exists(job.save_path)
+
+
+def test_stream_ingest_matches_csv(monkeypatch, tmp_path):
+    scans = {1: ('Scan A', [(11, 1600000000), (12, 1600600000)], 1600600000)}
+    latest = []
+    for stream in (False, True):
+        engine = nessus_engine(tmp_path / str(stream))
+        os.makedirs(str(tmp_path / str(stream)))
+        assert run_batch(monkeypatch, tmp_path / str(stream), engine, scans, nessus_stream=stream) == []
+        with engine.connect() as connection:
+            latest.append(sorted(tuple(row) for row in connection.execute(sa.text(
+                'SELECT "Plugin ID", "Host", "Port", "Risk", history_id FROM "LatestVulnerabilities"'))))
+    assert latest[0] == latest[1] and len(latest[1]) == 8
+    assert ('stream', 1, 12) in FakeNessus.calls
+    # nothing was written to disk
+    assert os.listdir(str(tmp_path / 'True' / 'csv' / 'Scan_A')) == []
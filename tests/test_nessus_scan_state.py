@@ -0,0 +1,64 @@
+"""
+Batch.run_batch skips a scan whose last_modification_date is the one
+stored in ScanState at its last complete load
+"""
+import sqlalchemy as sa
+
+from tests.nessus_fakes import FakeNessus, nessus_engine, run_batch
+
+
+def details():
+    return sorted(call[1] for call in FakeNessus.calls if call[0] == 'details')
+
+
+def exports():
+    return sorted(call[1:] for call in FakeNessus.calls if call[0] == 'export')
+
+
+def scan_states(engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(sa.text('SELECT scan_id, last_modification_date FROM "ScanState"')).fetchall())
+
+
+def test_unchanged_scans_are_skipped(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    scans = {1: ('Scan A', [(11, 1600000000)], 1600000000), 2: ('Scan B', [(21, 1600100000)], 1600100000),
+        3: ('Excluded', [(31, 1600100000)], 1600100000)}
+    run_batch(monkeypatch, tmp_path, engine, scans)
+    assert details() == [1, 2]
+    assert scan_states(engine) == {1: 1600000000, 2: 1600100000}
+
+    # nothing changed, only the scan list is read
+    run_batch(monkeypatch, tmp_path, engine, scans)
+    assert FakeNessus.calls == [('scans',)]
+
+    # a new history of scan 2 moves its modification date
+    scans[2] = ('Scan B', [(21, 1600100000), (22, 1600700000)], 1600700000)
+    run_batch(monkeypatch, tmp_path, engine, scans)
+    assert details() == [2]
+    assert exports() == [(2, 22)]
+    assert scan_states(engine)[2] == 1600700000
+
+
+def test_failed_scan_is_listed_again(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    scans = {1: ('Scan A', [(11, 1600000000), (12, 1600600000)], 1600600000),
+        2: ('Scan B', [(21, 1600100000)], 1600100000)}
+    failed = run_batch(monkeypatch, tmp_path, engine, scans, failing={12})
+    assert [job.history_id for job in failed] == [12]
+    assert scan_states(engine) == {2: 1600100000}
+
+    # the loaded history is not exported again, the failed one is retried
+    assert run_batch(monkeypatch, tmp_path, engine, scans) == []
+    assert details() == [1]
+    assert exports() == [(1, 12)]
+    assert scan_states(engine) == {1: 1600600000, 2: 1600100000}
+
+
+def test_scan_without_modification_date_is_always_checked(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    scans = {1: ('Scan A', [(11, 1600000000)], None)}
+    run_batch(monkeypatch, tmp_path, engine, scans)
+    run_batch(monkeypatch, tmp_path, engine, scans)
+    assert details() == [1]
+    assert exports() == []
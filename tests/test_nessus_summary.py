@@ -0,0 +1,70 @@
+"""
+The dashboard risk cards are counted once per data version, by
+Batch.run_batch after its loads, and read back by Plots.get_dashboard_summary
+"""
+import pandas as pd
+import sqlalchemy as sa
+
+from app.utils.nessus import Batch, Plots
+from tests.nessus_fakes import nessus_engine, run_batch
+
+SCANS = {1: ('Scan A', [(11, 1600000000), (12, 1600600000)], 1600600000),
+    2: ('Scan B', [(21, 1600100000)], 1600100000)}
+
+
+def count_refreshes(monkeypatch):
+    calls = []
+    refresh_summary = Batch.refresh_summary
+
+    def counted(*args):
+        calls.append(args)
+        return refresh_summary(*args)
+
+    monkeypatch.setattr(Batch, 'refresh_summary', staticmethod(counted))
+    return calls
+
+
+def stored(engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(sa.text('SELECT "Risk", plugin_hosts FROM "DashboardSummary"')).fetchall())
+
+
+def test_counted_once_per_batch(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    calls = count_refreshes(monkeypatch)
+    run_batch(monkeypatch, tmp_path, engine, SCANS)
+    assert len(calls) == 1
+
+    # the latest histories are 12 (4 hosts) and 21 (3 of the same hosts),
+    # a plugin and host found by both scans is counted once
+    summary = {'None': 0, 'Low': 0, 'Medium': 4, 'High': 0, 'Critical': 4}
+    assert stored(engine) == summary
+    assert Plots.get_dashboard_summary(engine) == summary
+    assert len(calls) == 1
+
+    # nothing new to load, nothing to count
+    run_batch(monkeypatch, tmp_path, engine, SCANS)
+    assert len(calls) == 1
+
+
+def test_counted_on_read_without_a_summary(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    run_batch(monkeypatch, tmp_path, engine, SCANS)
+    with engine.begin() as connection:
+        connection.execute(sa.text('DELETE FROM "DashboardSummary"'))
+    calls = count_refreshes(monkeypatch)
+    assert Plots.get_dashboard_summary(engine)['Critical'] == 4
+    assert Plots.get_dashboard_summary(engine)['Critical'] == 4
+    assert len(calls) == 1
+
+
+def test_pair_counted_at_most_severe_risk(monkeypatch, tmp_path):
+    engine = nessus_engine(tmp_path)
+    run_batch(monkeypatch, tmp_path, engine, {1: ('Scan A', [(11, 1600000000)], 1600000000)})
+    # the same plugin and host on two more ports, at a lower and a higher risk
+    df = pd.DataFrame({'Plugin ID': 1000, 'Host': '10.0.0.0', 'Port': [80, 8080], 'Risk': ['Low', 'High'],
+        'scan_id': 1, 'history_id': 11})
+    with engine.begin() as connection:
+        Batch.load_df_database(df, connection, 'LatestVulnerabilities')
+        counts = Batch.refresh_summary(connection, 'LatestVulnerabilities', 'History', 'DashboardSummary')
+    assert counts == {'None': 0, 'Low': 0, 'Medium': 3, 'High': 0, 'Critical': 3}
@@ -0,0 +1,71 @@
+"""
+Batch.refresh_trend keeps one VulnerabilityTrend row per scan, week and
+risk holding the counts of the newest history of that week
+"""
+import calendar
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from app.models import nessus_models
+from app.models.nessus_models import trend_week
+from app.utils.nessus import Batch, ExportJob, Plots
+
+
+def timestamp(*args):
+    return calendar.timegm(datetime(*args).utctimetuple())
+
+
+def test_trend_week():
+    # the Monday on or after the date a week before
+    assert trend_week(timestamp(2020, 9, 16, 13, 0)) == date(2020, 9, 14)
+    assert trend_week(timestamp(2020, 9, 14, 0, 0)) == date(2020, 9, 7)
+    assert trend_week(timestamp(2020, 9, 20, 23, 59)) == date(2020, 9, 14)
+    assert trend_week(timestamp(2020, 9, 21, 0, 0)) == date(2020, 9, 14)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'nessus.sqlite'))
+    nessus_models.upgrade_schema(engine)
+    return engine
+
+
+def load(engine, scan_id, history_id, history_date, findings):
+    """Load findings, (Plugin ID, Host, Risk) tuples, as a history and roll it up"""
+    job = ExportJob(scan_id, 'Scan %d' % scan_id, history_id, history_date, None)
+    df = pd.DataFrame(findings, columns=['Plugin ID', 'Host', 'Risk'])
+    df['Port'] = 443
+    df['scan_id'] = scan_id
+    df['scan_name'] = job.scan_name
+    df['history_id'] = history_id
+    df['history_date'] = history_date
+    with engine.begin() as connection:
+        Batch.load_df_database(df, connection, 'Vulnerabilities')
+        Batch.record_history(connection, 'History', job)
+        Batch.refresh_trend(connection, 'Vulnerabilities', 'VulnerabilityTrend', job)
+
+
+def trend(engine, column):
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(Plots.trend_query(column, 'VulnerabilityTrend'))]
+
+
+def test_newest_history_of_the_week_counts(engine):
+    # both in the week closed by Monday 2020/09/14
+    tuesday, thursday, next_week = timestamp(2020, 9, 15, 8), timestamp(2020, 9, 17, 8), timestamp(2020, 9, 22, 8)
+    # the same finding on two ports counts twice, as one plugin and host
+    load(engine, 1, 12, thursday, [(1000, '10.0.0.1', 'High'), (1000, '10.0.0.1', 'High'),
+        (2000, '10.0.0.1', 'Low')])
+    # older history of the same week, loaded late
+    load(engine, 1, 11, tuesday, [(1000, '10.0.0.1', 'High')] * 5)
+    load(engine, 1, 13, next_week, [(1000, '10.0.0.2', 'High')])
+    load(engine, 2, 21, tuesday, [(3000, '10.0.0.9', 'Critical')])
+
+    week, following = date(2020, 9, 14), date(2020, 9, 21)
+    assert trend(engine, 'findings') == [(week, 'Critical', 1), (week, 'High', 2), (week, 'Low', 1),
+        (following, 'High', 1)]
+    assert trend(engine, 'plugin_hosts') == [(week, 'Critical', 1), (week, 'High', 1), (week, 'Low', 1),
+        (following, 'High', 1)]
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from app.utils import cache
+from tests.nessus_fakes import make_client
+
+SCANS = {1: ('Scan A', [(11, 1600000000)], 1600000000)}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    return make_client(monkeypatch, tmp_path, SCANS)
+
+
+def lookups():
+    stats = cache.cache_stats()
+    return stats['hits'], stats['misses']
+
+
+def test_full_response_is_cached(client):
+    first = client.get('/nessus-breakdown-data')
+    hits, misses = lookups()
+    second = client.get('/nessus-breakdown-data')
+    assert lookups() == (hits + 1, misses)
+    assert json.loads(first.get_data()) == json.loads(second.get_data())
+    assert len(json.loads(first.get_data())) == 6
+
+
+def test_export_format_streams(client):
+    hits, misses = lookups()
+    response = client.get('/nessus-breakdown-data?format=ndjson')
+    assert lookups() == (hits, misses)
+    assert response.is_streamed
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 6
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from app.extensions.nessusapi import Nessus
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.text = json.dumps(body if body is not None else {})
+
+
+class FakeSession:
+    """Answers session.request from a handler, records every call"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.calls.append((method, url, dict(headers or {}), kwargs))
+        return self.handler(method, url, headers or {}, kwargs)
+
+    def close(self):
+        pass
+
+
+def run_with_timeout(function, timeout=5):
+    """Run function in a thread, a deadlock fails the test instead of hanging it"""
+    result = {}
+
+    def target():
+        try:
+            result['value'] = function()
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'still blocked after %ss' % timeout
+    return result
+
+
+def make_nessus(handler):
+    nessus = Nessus('https://nessus.test', 'user', 'password', backoff_factor=0)
+    nessus.session = FakeSession(handler)
+    return nessus
+
+
+def test_bad_credentials_raise():
+    nessus = make_nessus(lambda method, url, headers, kwargs: FakeResponse(401, {'error': 'Invalid Credentials'}))
+    result = run_with_timeout(nessus.get_session_token)
+    assert 'login failed' in str(result['error'])
+    assert len(nessus.session.calls) == 1
+
+
+def test_expired_token_reauthenticates_once():
+    tokens = iter(['first', 'second'])
+
+    def handler(method, url, headers, kwargs):
+        if url.endswith('/session'):
+            return FakeResponse(200, {'token': next(tokens)})
+        if kwargs['params']['token'] == 'first':
+            return FakeResponse(401)
+        return FakeResponse(200, {'folders': [{'id': 3, 'name': 'My Scans'}]})
+
+    nessus = make_nessus(handler)
+    result = run_with_timeout(nessus.get_scan_folders)
+    assert result['value'] == [(3, 'My Scans')]
+    assert nessus.token == 'second'
+    assert [url for _, url, _, _ in nessus.session.calls] == ['https://nessus.test/session',
+        'https://nessus.test/folders', 'https://nessus.test/session', 'https://nessus.test/folders']
+
+
+def test_export_request_is_not_resent_on_server_error():
+    def handler(method, url, headers, kwargs):
+        if url.endswith('/session'):
+            return FakeResponse(200, {'token': 'token'})
+        return FakeResponse(503, {})
+
+    nessus = make_nessus(handler)
+    run_with_timeout(lambda: nessus.scans_export_request(5, 7))
+    posts = [url for method, url, _, _ in nessus.session.calls if '/export' in url]
+    assert posts == ['https://nessus.test/scans/5/export?history_id=7']
+
+
+
+class ScriptedExports(Nessus):
+    """
+    Nessus whose exports turn ready after polls[history_id] "not ready"
+    answers, None never turns ready, an exception instance is raised.
+    Every request, status check and download is logged in order.
+    """
+
+    def __init__(self, polls):
+        Nessus.__init__(self, 'https://nessus.test', 'user', 'password')
+        self.polls = dict(polls)
+        self.log = []
+        self.pending = set()
+        self.most_pending = 0
+
+    def scans_export_request(self, scan_id, history_id=None, format_type='csv'):
+        self.log.append(('request', history_id))
+        if isinstance(self.polls[history_id], Exception):
+            raise self.polls[history_id]
+        self.pending.add(history_id)
+        self.most_pending = max(self.most_pending, len(self.pending))
+        return {'file': history_id * 10}
+
+    def scans_export_status(self, scan_id, file_id):
+        history_id = file_id // 10
+        self.log.append(('status', history_id))
+        if self.polls[history_id] is None:
+            return False
+        if self.polls[history_id] == 0:
+            self.pending.discard(history_id)
+            return True
+        self.polls[history_id] -= 1
+        return False
+
+    def scans_export_download(self, scan_id, file_id, filename):
+        self.log.append(('download', file_id // 10))
+        return filename
+
+
+def export_batch(nessus, exports, **kwargs):
+    kwargs = dict(dict(status_interval=0.001, max_interval=0.004, backoff=2), **kwargs)
+    result = run_with_timeout(lambda: list(nessus.scans_export_batch(exports, **kwargs)))
+    assert 'error' not in result
+    return result['value']
+
+
+def test_export_batch_submits_before_polling():
+    nessus = ScriptedExports({1: 2, 2: 0, 3: 1})
+    results = export_batch(nessus, [(5, 1), (5, 2), (6, 3, 'three.csv')])
+    assert nessus.log[:3] == [('request', 1), ('request', 2), ('request', 3)]
+    # each export as soon as it is ready, downloaded when a filename is given
+    assert results == [(5, 2, 20, None), (6, 3, 'three.csv', None), (5, 1, 10, None)]
+    assert nessus.log.count(('status', 1)) == 3
+    assert ('download', 3) in nessus.log and ('download', 1) not in nessus.log
+
+
+def test_export_batch_max_outstanding():
+    nessus = ScriptedExports({history_id: history_id % 3 for history_id in range(1, 11)})
+    results = export_batch(nessus, [(5, history_id) for history_id in range(1, 11)], max_outstanding=3)
+    assert nessus.most_pending == 3
+    assert sorted(history_id for _, history_id, _, _ in results) == list(range(1, 11))
+
+
+def test_export_batch_errors():
+    nessus = ScriptedExports({1: Exception('scan is running'), 2: None, 3: 0})
+    results = export_batch(nessus, [(5, 1), (5, 2), (5, 3)], timeout=0.02)
+    errors = {history_id: str(error) for _, history_id, _, error in results if error is not None}
+    # one failing export does not stop the others
+    assert errors == {1: 'scan is running', 2: 'File not ready for download in time, increase timeout value'}
+    assert (5, 3, 30, None) in results
+
+def run_async(handlers, function):
+    """
+    Serve handlers ({(method, path): handler}) on a local aiohttp server and
+    run function(AsyncNessus) against it, failing after 5s instead of hanging
+    """
+    web = pytest.importorskip('aiohttp.web')
+    from aiohttp.test_utils import TestServer
+    from app.extensions.nessusapi import AsyncNessus
+
+    async def main():
+        application = web.Application()
+        for (method, path), handler in handlers.items():
+            application.router.add_route(method, path, handler)
+        async with TestServer(application) as server:
+            nessus = AsyncNessus(str(server.make_url('')).rstrip('/'), 'user', 'password', backoff_factor=0)
+            try:
+                return nessus, await asyncio.wait_for(function(nessus), 5)
+            finally:
+                await nessus.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_async_bad_credentials_raise():
+    web = pytest.importorskip('aiohttp.web')
+    logins = []
+
+    async def session(request):
+        logins.append(await request.json())
+        return web.json_response({'error': 'Invalid Credentials'}, status=401)
+
+    with pytest.raises(Exception, match='login failed'):
+        run_async({('POST', '/session'): session}, lambda nessus: nessus.get_session_token())
+    assert len(logins) == 1
+
+
+def test_async_expired_token_reauthenticates_once():
+    web = pytest.importorskip('aiohttp.web')
+    tokens = iter(['first', 'second'])
+    calls = []
+
+    async def session(request):
+        calls.append('session')
+        return web.json_response({'token': next(tokens)})
+
+    async def folders(request):
+        calls.append('folders')
+        if request.query['token'] == 'first':
+            return web.json_response({}, status=401)
+        return web.json_response({'folders': [{'id': 3, 'name': 'My Scans'}]})
+
+    nessus, result = run_async({('POST', '/session'): session, ('GET', '/folders'): folders},
+        lambda nessus: nessus.get_scan_folders())
+    assert result == [(3, 'My Scans')]
+    assert nessus.token == 'second'
+    assert calls == ['session', 'folders', 'session', 'folders']
+
+
+def test_async_export_batch(tmp_path):
+    web = pytest.importorskip('aiohttp.web')
+    polls = {}
+
+    async def session(request):
+        return web.json_response({'token': 'token'})
+
+    async def export(request):
+        history_id = int(request.query['history_id'])
+        if history_id == 3:
+            return web.json_response({'error': 'scan is running'}, status=409)
+        return web.json_response({'file': history_id * 10})
+
+    async def status(request):
+        file_id = int(request.match_info['file_id'])
+        polls[file_id] = polls.get(file_id, 0) + 1
+        # the second export takes one more poll
+        ready = polls[file_id] > file_id // 10
+        return web.json_response({'status': 'ready' if ready else 'loading'})
+
+    async def download(request):
+        return web.Response(body=b'Plugin ID\n%s\n' % request.match_info['file_id'].encode())
+
+    async def run(nessus):
+        return [result async for result in nessus.scans_export_batch(
+            [(5, history_id, str(tmp_path / ('%d.csv' % history_id))) for history_id in (1, 2, 3)],
+            max_outstanding=2, status_interval=0.001)]
+
+    nessus, results = run_async({('POST', '/session'): session, ('POST', '/scans/5/export'): export,
+        ('GET', '/scans/5/export/{file_id}/status'): status,
+        ('GET', '/scans/5/export/{file_id}/download'): download}, run)
+    errors = {history_id: error for _, history_id, _, error in results if error is not None}
+    assert list(errors) == [3]
+    assert sorted(filename for _, _, filename, error in results if error is None) == \
+        [str(tmp_path / '1.csv'), str(tmp_path / '2.csv')]
+    assert (tmp_path / '2.csv').read_bytes() == b'Plugin ID\n20\n'
+    assert polls == {10: 2, 20: 3}
@@ -0,0 +1,59 @@
+import os
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from app import settings
+from app.utils import snapshots
+from app.utils.nessus import LATEST_COLUMNS, Plots
+from tests.nessus_fakes import nessus_engine, run_batch
+
+pytest.importorskip('pyarrow')
+
+
+def frame(hosts):
+    return pd.DataFrame({'Plugin ID': 1000, 'CVE': 'CVE-2020-1', 'CVSS': 9.8, 'Risk': 'Critical', 'Host': hosts,
+        'Protocol': 'tcp', 'Port': 443, 'Plugin Output': 'out', 'MSKB': None, 'scan_id': 1, 'scan_name': 'Scan A',
+        'history_id': 11, 'history_date': 1600000000})
+
+
+def test_write_and_read(tmp_path):
+    root = str(tmp_path)
+    writer = snapshots.SnapshotWriter(root, 1, 11)
+    writer.write(frame(['10.0.0.1', '10.0.0.2']))
+    writer.write(frame([]))
+    writer.write(frame(['10.0.0.3']))
+    writer.commit()
+    assert os.listdir(str(tmp_path / '1')) == ['11.arrow']
+
+    df, missing = snapshots.read_histories(root, [(1, 11), (2, 21)], ['Host', 'Port'])
+    assert list(df.columns) == ['Host', 'Port']
+    assert df['Host'].tolist() == ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    assert df['Port'].tolist() == [443] * 3
+    assert missing == [(2, 21)]
+
+
+def test_abort_leaves_nothing(tmp_path):
+    writer = snapshots.SnapshotWriter(str(tmp_path), 1, 11)
+    writer.write(frame(['10.0.0.1']))
+    writer.abort()
+    assert os.listdir(str(tmp_path / '1')) == []
+    df, missing = snapshots.read_histories(str(tmp_path), [(1, 11)])
+    assert df.empty and missing == [(1, 11)]
+
+
+def test_latest_from_snapshots(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'OMNIANA_LATEST_DATASET_PATH', False)
+    monkeypatch.setattr(settings, 'OMNIANA_SNAPSHOT_PATH', str(tmp_path / 'snapshots'))
+    engine = nessus_engine(tmp_path)
+    run_batch(monkeypatch, tmp_path, engine, {1: ('Scan A', [(11, 1600000000), (12, 1600600000)], 1600600000),
+        2: ('Scan B', [(21, 1600100000)], 1600100000)})
+    assert sorted(os.listdir(str(tmp_path / 'snapshots' / '1'))) == ['11.arrow', '12.arrow']
+
+    columns = LATEST_COLUMNS + ['Exploitable']
+    shared = Plots.get_latest_vulnerabilities_snapshot(columns, engine=engine)
+    database = Plots.get_latest_vulnerabilities_data(engine=engine, columns=columns, where=[sa.true()])
+    key = ['Host', 'Plugin ID', 'Scan']
+    pd.testing.assert_frame_equal(shared.sort_values(key).reset_index(drop=True),
+        database.sort_values(key).reset_index(drop=True), check_dtype=False)